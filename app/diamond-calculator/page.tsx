@@ -29,6 +29,43 @@ interface DiamondState {
   quantity?: number;
 }
 
+interface PriceMatrix {
+  version: string;
+  axes: Record<'clarity' | 'color' | 'cut' | 'certification', string[]>;
+  base_price: number;
+  multipliers: Record<'clarity' | 'color' | 'cut' | 'certification', number[]>;
+  shape: number[];
+  prices: number[];
+}
+
+const PRICE_MATRIX_STORAGE_KEY = 'price_matrix';
+
+// Round to cents like Python's round(price, 2): toFixed rounds the exact
+// binary value, and the only exact half-cent ties (odd multiples of 1/8)
+// go to the even cent
+const roundCents = (price: number): number => {
+  if (Number.isInteger(price * 8) && !Number.isInteger(price * 4)) {
+    const cents = Math.floor(price * 100);
+    return (cents % 2 === 0 ? cents : cents + 1) / 100;
+  }
+  return Number(price.toFixed(2));
+};
+
+// Mirrors utils.quote_price on the backend, multiplying in the same order
+const estimateDiamondPrice = (matrix: PriceMatrix, diamond: DiamondState): number | undefined => {
+  const carat = parseFloat(diamond.carat);
+  const axes = ['clarity', 'color', 'cut', 'certification'] as const;
+  const codes = axes.map(axis => matrix.axes[axis].indexOf(diamond[axis]));
+  if (!matrix.multipliers || isNaN(carat) || carat <= 0 || codes.some(code => code < 0)) {
+    return undefined;
+  }
+  let price = matrix.base_price * carat;
+  axes.forEach((axis, i) => {
+    price *= matrix.multipliers[axis][codes[i]];
+  });
+  return roundCents(price);
+};
+
 const DiamondCalculator = () => {
   const router = useRouter();
   const [isLoading, setIsLoading] = useState<boolean>(true);
@@ -38,6 +75,7 @@ const DiamondCalculator = () => {
   const [totalPrice, setTotalPrice] = useState<number>(0);
   const [calculationLoading, setCalculationLoading] = useState<boolean>(false);
   const [error, setError] = useState<string>('');
+  const [priceMatrix, setPriceMatrix] = useState<PriceMatrix | null>(null);
 
   const initialDiamondState: DiamondState = {
     carat: '1.0',
@@ -61,6 +99,32 @@ const DiamondCalculator = () => {
     }
   }, [router, activeFilter]);
 
+  useEffect(() => {
+    const apiKey = localStorage.getItem('api_key');
+    if (!apiKey) return;
+
+    const cached = localStorage.getItem(PRICE_MATRIX_STORAGE_KEY);
+    const cachedMatrix: PriceMatrix | null = cached ? JSON.parse(cached) : null;
+    if (cachedMatrix) {
+      setPriceMatrix(cachedMatrix);
+    }
+
+    // Revalidate the cached matrix; the backend answers 304 when it is unchanged
+    fetch('http://localhost:8000/api/price-matrix', {
+      headers: {
+        'Authorization': `Bearer ${apiKey}`,
+        ...(cachedMatrix ? { 'If-None-Match': `"${cachedMatrix.version}"` } : {})
+      }
+    })
+      .then(async (response) => {
+        if (response.status !== 200) return;
+        const matrix: PriceMatrix = await response.json();
+        localStorage.setItem(PRICE_MATRIX_STORAGE_KEY, JSON.stringify(matrix));
+        setPriceMatrix(matrix);
+      })
+      .catch((error) => console.error('Price matrix error:', error));
+  }, []);
+
   const clarityOptions = ['FL', 'IF', 'VVS1', 'VVS2', 'VS1', 'VS2', 'SI1', 'SI2', 'I1'];
   const colorOptions = ['D', 'E', 'F', 'G', 'H', 'I', 'J', 'K'];
   const cutOptions = ['Excellent', 'Very Good', 'Good', 'Fair', 'Poor'];
@@ -319,6 +383,20 @@ const DiamondInputs = ({ diamond, index, isOnly }: {
         </>
       )}
 
+      {individualPrices[index] === undefined && priceMatrix && estimateDiamondPrice(priceMatrix, diamond) !== undefined && (
+        <div className="col-span-2 mt-4 p-4 bg-gray-50 rounded-md">
+          <div className="flex justify-between items-center">
+            <span className="text-sm font-medium text-gray-600">Estimated Price:</span>
+            <span className="text-lg font-bold text-gray-700">
+              {new Intl.NumberFormat('ms-MY', {
+                style: 'currency',
+                currency: 'MYR'
+              }).format(estimateDiamondPrice(priceMatrix, diamond) ?? 0)}
+            </span>
+          </div>
+        </div>
+      )}
+
       {individualPrices[index] !== undefined && (
         <div className="col-span-2 mt-4 p-4 bg-gray-50 rounded-md">
           <div className="flex justify-between items-center">
@@ -0,0 +1,191 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, insert, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import DiamondPriceDB, PriceRollupDB, RequoteDB
+
+logger = logging.getLogger(__name__)
+
+# Rollup buckets follow the shops' local time (UTC+8)
+MALAYSIA_TZ = timezone(timedelta(hours=8))
+
+BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+GROUP_COLUMNS = ("calculated_by", "branch", "clarity", "color", "cut", "certification")
+
+ROLLUP_KEY = ("granularity", "bucket") + GROUP_COLUMNS
+
+def bucket_for(timestamp: Optional[datetime], granularity: str) -> str:
+    """Format a UTC timestamp as the local-time bucket it falls in."""
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    elif timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(MALAYSIA_TZ).strftime(BUCKET_FORMATS[granularity])
+
+def apply_price_rollups(db: Session, rows: Sequence[dict]) -> None:
+    """Fold a batch of DiamondPriceDB rows into the rollup table.
+
+    The batch is aggregated in memory first, so each touched bucket costs
+    one upsert no matter how many stones fell into it. A row may stand for
+    several stones of one grade combination: its ``quote_count`` (default
+    1) and the sums of their carats and prices.
+    """
+    totals: Dict[Tuple, List[float]] = {}
+    for row in rows:
+        group = tuple(row.get(column) or "" for column in GROUP_COLUMNS)
+        count = row.get("quote_count", 1)
+        for granularity in BUCKET_FORMATS:
+            key = (granularity, bucket_for(row.get("timestamp"), granularity)) + group
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [count, row["carat"], row["price"]]
+            else:
+                total[0] += count
+                total[1] += row["carat"]
+                total[2] += row["price"]
+    if not totals:
+        return
+
+    statement = sqlite_insert(PriceRollupDB)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(ROLLUP_KEY),
+        set_={
+            "quote_count": PriceRollupDB.quote_count + statement.excluded.quote_count,
+            "carat_sum": PriceRollupDB.carat_sum + statement.excluded.carat_sum,
+            "price_sum": PriceRollupDB.price_sum + statement.excluded.price_sum,
+        }
+    )
+    db.execute(statement, [
+        dict(zip(ROLLUP_KEY, key), quote_count=count, carat_sum=carat, price_sum=price)
+        for key, (count, carat, price) in totals.items()
+    ])
+
+def grade_totals(diamonds: Sequence, prices: Sequence[float]) -> List[dict]:
+    """Stone count, carat and price sums of a parcel per grade combination.
+
+    The rows apply_price_rollups takes for a requoted parcel, once the
+    requote's staff member, branch and timestamp are added.
+    """
+    totals: Dict[Tuple, List[float]] = {}
+    for diamond, price in zip(diamonds, prices):
+        key = (diamond.clarity, diamond.color, diamond.cut, diamond.certification)
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, diamond.carat, price]
+        else:
+            total[0] += 1
+            total[1] += diamond.carat
+            total[2] += price
+    return [
+        dict(zip(GROUP_COLUMNS[2:], key), quote_count=count, carat=carat, price=price)
+        for key, (count, carat, price) in totals.items()
+    ]
+
+def rebuild_price_rollups(db: Session) -> None:
+    """Recompute the rollup table from the raw DiamondPriceDB rows.
+
+    Requotes count the stones of the first quote with their quote_key. The
+    caller must commit.
+    """
+    db.query(PriceRollupDB).delete()
+    first_quotes = (
+        select(DiamondPriceDB.quote_key, func.min(DiamondPriceDB.timestamp).label("timestamp"))
+        .where(DiamondPriceDB.quote_key.is_not(None))
+        .group_by(DiamondPriceDB.quote_key)
+        .subquery()
+    )
+    stones = (
+        select(DiamondPriceDB)
+        .join(first_quotes, and_(
+            DiamondPriceDB.quote_key == first_quotes.c.quote_key,
+            DiamondPriceDB.timestamp == first_quotes.c.timestamp,
+        ))
+        .subquery()
+    )
+    grades = GROUP_COLUMNS[2:]
+    quotes = union_all(
+        select(DiamondPriceDB.timestamp, *[getattr(DiamondPriceDB, column) for column in GROUP_COLUMNS],
+               DiamondPriceDB.carat, DiamondPriceDB.price),
+        select(RequoteDB.timestamp, RequoteDB.calculated_by, RequoteDB.branch,
+               *[stones.c[column] for column in grades], stones.c.carat, stones.c.price)
+        .join(stones, stones.c.quote_key == RequoteDB.quote_key),
+    ).subquery()
+    for granularity, bucket_format in BUCKET_FORMATS.items():
+        bucket = func.strftime(bucket_format, quotes.c.timestamp, "+8 hours")
+        group = [func.coalesce(quotes.c[column], "") for column in GROUP_COLUMNS]
+        totals = (
+            select(
+                literal(granularity), bucket, *group,
+                func.count(), func.sum(quotes.c.carat), func.sum(quotes.c.price)
+            )
+            .group_by(bucket, *group)
+        )
+        db.execute(
+            insert(PriceRollupDB).from_select(
+                list(ROLLUP_KEY) + ["quote_count", "carat_sum", "price_sum"],
+                totals
+            )
+        )
+    logger.info("Rebuilt price rollups from diamond_prices and requotes")
+
+def ensure_price_rollups(db: Session) -> None:
+    """Backfill rollups for databases that have history but no rollups yet."""
+    if db.query(PriceRollupDB.id).first() is not None:
+        return
+    if db.query(DiamondPriceDB.id).first() is None:
+        return
+    rebuild_price_rollups(db)
+    db.commit()
+
+async def query_rollups(
+    db,
+    group_by: Sequence[str],
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    branch: Optional[str] = None,
+) -> List[dict]:
+    """Sum rollup buckets grouped by the given columns.
+
+    ``group_by`` may include "bucket" and any of GROUP_COLUMNS. ``start``
+    and ``end`` are inclusive bucket bounds in the bucket's own format.
+    """
+    columns = [getattr(PriceRollupDB, column) for column in group_by]
+    query = (
+        select(
+            *columns,
+            func.sum(PriceRollupDB.quote_count).label("quote_count"),
+            func.sum(PriceRollupDB.carat_sum).label("carat_sum"),
+            func.sum(PriceRollupDB.price_sum).label("price_sum"),
+        )
+        .where(PriceRollupDB.granularity == granularity)
+    )
+    if start:
+        query = query.where(PriceRollupDB.bucket >= start)
+    if end:
+        query = query.where(PriceRollupDB.bucket <= end)
+    if staff_id:
+        query = query.where(PriceRollupDB.calculated_by == staff_id)
+    if branch:
+        query = query.where(PriceRollupDB.branch == branch)
+
+    results = []
+    result_rows = await db.execute(query.group_by(*columns).order_by(*columns))
+    for row in result_rows:
+        result = {column: getattr(row, column) or None for column in group_by}
+        result.update(
+            quote_count=row.quote_count,
+            carat_sum=round(row.carat_sum, 4),
+            price_sum=round(row.price_sum, 2),
+        )
+        results.append(result)
+    return results
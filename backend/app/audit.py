@@ -0,0 +1,67 @@
+from typing import List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import config
+from .analytics import apply_price_rollups
+from .models import DiamondPriceDB, LoginLogDB, RequoteDB
+from .page_cache import page_cache
+from .writer import WriteBehindQueue
+
+def write_price_records(db: Session, rows: List[dict]) -> None:
+    """Bulk insert DiamondPriceDB audit rows and update their rollups."""
+    db.execute(insert(DiamondPriceDB), rows)
+    apply_price_rollups(db, rows)
+    page_cache.invalidate(DiamondPriceDB.__tablename__)
+
+def write_requote_records(db: Session, rows: List[dict]) -> None:
+    """Bulk insert RequoteDB references and fold their stones into the rollups.
+
+    Each row carries its parcel's grade_totals under "stones".
+    """
+    db.execute(insert(RequoteDB), [
+        {column: value for column, value in row.items() if column != "stones"} for row in rows
+    ])
+    apply_price_rollups(db, [
+        dict(stone, calculated_by=row["calculated_by"], branch=row["branch"], timestamp=row["timestamp"])
+        for row in rows
+        for stone in row["stones"]
+    ])
+
+def write_activity_records(db: Session, rows: List[dict]) -> None:
+    """Bulk insert LoginLogDB activity rows."""
+    db.execute(insert(LoginLogDB), rows)
+    page_cache.invalidate(LoginLogDB.__tablename__)
+
+# Write-behind queue for the per-stone audit trail of /api/calculate-price
+price_audit_queue = WriteBehindQueue(
+    "diamond_prices",
+    write_price_records,
+    maxsize=config.AUDIT_QUEUE_SIZE,
+    batch_size=config.AUDIT_BATCH_SIZE,
+    flush_interval=config.AUDIT_FLUSH_INTERVAL,
+    durability=config.AUDIT_DURABILITY,
+)
+
+# Write-behind queue for quote cache hits, one row per re-quoted parcel
+requote_queue = WriteBehindQueue(
+    "requotes",
+    write_requote_records,
+    maxsize=config.AUDIT_QUEUE_SIZE,
+    batch_size=config.AUDIT_BATCH_SIZE,
+    flush_interval=config.AUDIT_FLUSH_INTERVAL,
+    durability=config.AUDIT_DURABILITY,
+)
+
+# Write-behind queue for /api/log-activity/ events
+activity_log_queue = WriteBehindQueue(
+    "login_logs",
+    write_activity_records,
+    maxsize=config.AUDIT_QUEUE_SIZE,
+    batch_size=config.ACTIVITY_BATCH_SIZE,
+    flush_interval=config.ACTIVITY_FLUSH_INTERVAL,
+    durability=config.AUDIT_DURABILITY,
+)
+
+AUDIT_QUEUES = (price_audit_queue, requote_queue, activity_log_queue)
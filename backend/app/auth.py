@@ -1,34 +1,338 @@
+import time
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
 from fastapi import Depends, HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
+from sqlalchemy import delete, select, update
 from sqlalchemy.orm import Session
-from .database import get_db
-from .models import LoginLogDB
+from . import config
+from .database import DBSession, SessionLocal, get_read_db
+from .models import ActiveSessionDB, LoginLogDB
+from .versions import bump_version, get_version, version_bump
+from .metrics import timed
+from .tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
 
 # Define API key header security
 api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
 
-def get_current_user(
-    api_key: str = Security(api_key_header), 
-    db: Session = Depends(get_db)
-):
-    """Validate the API key and return the staff_id"""
-    if not api_key:
+# Name of the shared version counter bumped whenever sessions are revoked
+AUTH_CACHE_VERSION = "auth"
+
+# Expired sessions removed per sweep transaction
+SESSION_SWEEP_BATCH = 1000
+
+class StaffSession(NamedTuple):
+    """The staff member and branch a session token was issued to."""
+    staff_id: str
+    branch: Optional[str]
+    token: Optional[str] = None
+
+def utcnow() -> datetime:
+    """Naive UTC time, the form session expiry is stored and compared in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class TokenCache:
+    """Bounded LRU cache of session token -> StaffSession with a TTL.
+
+    Revocations in this process invalidate entries directly. Revocations in
+    other worker processes are picked up through the shared ``auth`` version
+    counter, which is polled at most every ``version_interval`` seconds.
+
+    Every invalidation advances ``generation``. A lookup records it before
+    reading the database and passes it to ``set``, which skips caching if
+    an invalidation happened in between: the row read may predate the revoke.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, version_interval: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self._entries = OrderedDict()  # token -> (StaffSession, expires_at)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[StaffSession]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token: str, session: StaffSession, ttl: Optional[float] = None,
+            generation: Optional[int] = None) -> None:
+        """Cache a session for the cache TTL, or ``ttl`` seconds if shorter.
+
+        Does nothing if ``generation`` is given and the cache has been
+        invalidated since it was read.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[token] = (session, time.monotonic() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(token, None)
+
+    def invalidate_staff(self, staff_id: str) -> None:
+        """Drop every cached token belonging to a staff member."""
+        with self._lock:
+            self.generation += 1
+            for token in [t for t, entry in self._entries.items() if entry[0].staff_id == staff_id]:
+                del self._entries[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    async def sync_version(self, db: DBSession) -> None:
+        """Clear the cache if another worker has revoked sessions."""
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_interval:
+            return
+        self._version_checked_at = now
+        version = await get_version(db, AUTH_CACHE_VERSION)
+        if version != self._version:
+            if self._version is not None:
+                self.clear()
+            self._version = version
+
+    def mark_version(self, version: int) -> None:
+        """Record a version this process bumped itself, so it is not cleared.
+
+        If other workers bumped the counter in between, force a re-check so
+        their revocations still clear the cache.
+        """
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._version_checked_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "capacity": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "version": self._version,
+        }
+
+token_cache = TokenCache(
+    maxsize=config.AUTH_CACHE_SIZE,
+    ttl=config.AUTH_CACHE_TTL,
+    version_interval=config.AUTH_CACHE_VERSION_INTERVAL,
+)
+
+def parse_api_key(authorization: Optional[str]) -> str:
+    """Extract the session token from an Authorization header.
+
+    Accepts both ``Bearer <token>`` and a bare token.
+    """
+    if not authorization:
         raise HTTPException(status_code=401, detail="API key is missing")
 
-    # Ensure API key does not contain extra spaces
-    api_key = api_key.strip()
+    parts = authorization.split()
+    if len(parts) == 1:
+        return parts[0]
+    if len(parts) != 2:
+        raise HTTPException(status_code=401, detail="Invalid authorization header format")
 
-    session = (
-        db.query(LoginLogDB)
-        .filter(
-            LoginLogDB.session_token == api_key,
-            LoginLogDB.logged_out.is_(False)
+    scheme, api_key = parts
+    if scheme.lower() != 'bearer':
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+    return api_key
+
+async def resolve_session(db: DBSession, api_key: str) -> StaffSession:
+    """Look up the session a bare token belongs to. Raises 401 if it has none."""
+    with timed("auth"):
+        await token_cache.sync_version(db)
+        cached = token_cache.get(api_key)
+        if cached is not None:
+            return cached
+
+        generation = token_cache.generation
+        now = utcnow()
+        result = await db.execute(
+            select(ActiveSessionDB.staff_id, ActiveSessionDB.branch, ActiveSessionDB.expires_at)
+            .where(
+                ActiveSessionDB.token == api_key,
+                ActiveSessionDB.expires_at > now
+            )
         )
-        .limit(1)
-        .first()
-    )
+        session = result.first()
 
     if not session:
         raise HTTPException(status_code=401, detail="Invalid or expired API key")
 
-    return session.staff_id  
+    staff_session = StaffSession(session.staff_id, session.branch, api_key)
+    token_cache.set(api_key, staff_session, (session.expires_at - now).total_seconds(), generation)
+    return staff_session
+
+async def get_current_session(
+    api_key: str = Security(api_key_header),
+    db: DBSession = Depends(get_read_db)
+) -> StaffSession:
+    """Validate the API key and return the session's staff_id and branch
+
+    Reads through the read-only pool, and only touches the database when
+    the token is not already cached.
+    """
+    return await resolve_session(db, parse_api_key(api_key))
+
+async def get_current_user(session: StaffSession = Depends(get_current_session)) -> str:
+    """Validate the API key and return the staff_id"""
+    return session.staff_id
+
+async def require_pricing_admin(session: StaffSession = Depends(get_current_session)) -> str:
+    """Return the staff_id if it may change company-wide pricing, else 403"""
+    if session.staff_id not in config.PRICING_ADMINS:
+        raise HTTPException(status_code=403, detail="Not allowed to manage pricing tables")
+    return session.staff_id
+
+def create_session(db, staff_id: str, branch: Optional[str]) -> str:
+    """Add a new active session and return its token. The caller commits."""
+    token = secrets.token_urlsafe(32)
+    now = utcnow()
+    db.add(ActiveSessionDB(
+        token=token,
+        staff_id=staff_id,
+        branch=branch,
+        created_at=now,
+        expires_at=now + timedelta(seconds=config.SESSION_TTL),
+    ))
+    return token
+
+async def _finish_revoke(db: DBSession, tokens) -> Optional[int]:
+    """Mark revoked sessions logged out in the history and bump the version."""
+    await db.execute(
+        update(LoginLogDB)
+        .where(LoginLogDB.session_token.in_(tokens))
+        .values(logged_out=True)
+    )
+    await db.execute(version_bump(LoginLogDB.__tablename__))
+    return await bump_version(db, AUTH_CACHE_VERSION)
+
+async def revoke_session(db: DBSession, token: str) -> int:
+    """Log out a single session. Returns 1 if it was active, else 0."""
+    result = await db.execute(delete(ActiveSessionDB).where(ActiveSessionDB.token == token))
+    revoked = result.rowcount
+    version = await _finish_revoke(db, [token]) if revoked else None
+    await db.commit()
+
+    token_cache.invalidate(token)
+    if version is not None:
+        token_cache.mark_version(version)
+    return revoked
+
+async def revoke_staff_sessions(db: DBSession, staff_id: str) -> int:
+    """Log out every active session of a staff member.
+
+    Commits, then drops the staff member's tokens from the cache. A
+    concurrent lookup that read a session row before the commit does not
+    cache it afterwards (see TokenCache). Returns the number of sessions
+    revoked.
+    """
+    result = await db.execute(
+        select(ActiveSessionDB.token).where(ActiveSessionDB.staff_id == staff_id)
+    )
+    tokens = result.scalars().all()
+    version = None
+    if tokens:
+        await db.execute(delete(ActiveSessionDB).where(ActiveSessionDB.staff_id == staff_id))
+        version = await _finish_revoke(db, tokens)
+    await db.commit()
+
+    token_cache.invalidate_staff(staff_id)
+    if version is not None:
+        token_cache.mark_version(version)
+    return len(tokens)
+
+def sweep_expired_sessions() -> int:
+    """Delete expired sessions in batches and mark them logged out.
+
+    Cached tokens never outlive their expiry, so no version bump is needed.
+    Returns the number of sessions removed.
+    """
+    swept = 0
+    while True:
+        db = SessionLocal()
+        try:
+            tokens = db.scalars(
+                select(ActiveSessionDB.token)
+                .where(ActiveSessionDB.expires_at <= utcnow())
+                .limit(SESSION_SWEEP_BATCH)
+            ).all()
+            if not tokens:
+                break
+            db.execute(
+                update(LoginLogDB)
+                .where(LoginLogDB.session_token.in_(tokens))
+                .values(logged_out=True)
+            )
+            db.execute(version_bump(LoginLogDB.__tablename__))
+            db.execute(delete(ActiveSessionDB).where(ActiveSessionDB.token.in_(tokens)))
+            db.commit()
+            swept += len(tokens)
+        finally:
+            db.close()
+    if swept:
+        logger.info(f"Swept {swept} expired sessions")
+    return swept
+
+def ensure_active_sessions(db: Session) -> None:
+    """Backfill active_sessions from login_logs on databases that predate it.
+
+    Sessions never expired before, so each open one gets a full SESSION_TTL.
+    """
+    if db.query(ActiveSessionDB.token).first() is not None:
+        return
+    open_sessions = db.execute(
+        select(LoginLogDB.session_token, LoginLogDB.staff_id, LoginLogDB.branch)
+        .where(
+            LoginLogDB.session_token.is_not(None),
+            LoginLogDB.logged_out.is_(False)
+        )
+    ).all()
+    if not open_sessions:
+        return
+    now = utcnow()
+    expires_at = now + timedelta(seconds=config.SESSION_TTL)
+    db.add_all([
+        ActiveSessionDB(
+            token=row.session_token, staff_id=row.staff_id, branch=row.branch,
+            created_at=now, expires_at=expires_at,
+        )
+        for row in open_sessions
+    ])
+    db.commit()
+    logger.info(f"Backfilled {len(open_sessions)} active sessions from login_logs")
+
+# Removes expired sessions every SESSION_SWEEP_INTERVAL seconds
+session_sweeper = PeriodicTask("session-sweeper", config.SESSION_SWEEP_INTERVAL, sweep_expired_sessions)
@@ -0,0 +1,179 @@
+import io
+import csv
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from . import config
+from .audit import price_audit_queue
+from .auth import StaffSession
+from .models import Diamond
+from .utils import PRICING_AXES, PricingSnapshot, calculate_diamond_prices
+
+# Streaming bulk pricing: stone records are read from the request body line
+# by line, validated and priced STREAM_CHUNK_SIZE at a time, and each chunk's
+# results are written out before the next chunk is read. Neither the parcel
+# nor its prices are ever held in memory as a whole.
+
+# Results are NDJSON whichever format the records arrive in
+BULK_MEDIA_TYPE = "application/x-ndjson"
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse for handlers that are still reading the request body.
+
+    StreamingResponse normally listens on ``receive`` for a disconnect while
+    it streams, which would swallow the body chunks the generator is reading.
+    A disconnect still surfaces as ClientDisconnect from ``request.stream()``.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def bulk_format(content_type: Optional[str]) -> str:
+    """Pick the record format from the request Content-Type."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return "csv" if media_type in ("text/csv", "application/csv") else "ndjson"
+
+async def iter_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yield (line number, raw bytes) for each non-blank line of the body."""
+    buffer = b""
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        line_number += 1
+        yield line_number, buffer
+
+async def iter_records(request: Request, fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (line number, record dict) pairs, or (line number, error message)."""
+    header = None
+    async for line_number, line in iter_lines(request):
+        try:
+            text = line.decode("utf-8-sig" if line_number == 1 else "utf-8").strip()
+        except UnicodeDecodeError as e:
+            yield line_number, f"Invalid UTF-8: {str(e)}"
+            continue
+        if fmt == "csv":
+            values = next(csv.reader(io.StringIO(text)))
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            # Empty cells fall back to the model defaults
+            yield line_number, {
+                field: value for field, value in zip(header, values) if value != ""
+            }
+        else:
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {str(e)}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, "Expected a JSON object"
+                continue
+            yield line_number, record
+
+def validate_record(record: Dict, pricing: PricingSnapshot) -> Diamond:
+    """Validate one stone record. Raises ValueError with a readable message."""
+    try:
+        diamond = Diamond.model_validate(record)
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        ))
+    for axis in PRICING_AXES:
+        if getattr(diamond, axis) not in pricing.codes[axis]:
+            raise ValueError(f"{axis}: no price for {getattr(diamond, axis)}")
+    return diamond
+
+async def stream_bulk_prices(
+    request: Request, fmt: str, session: StaffSession, pricing: PricingSnapshot
+) -> AsyncIterator[str]:
+    """Price a stream of stone records and yield NDJSON result lines.
+
+    Emits one line per record, either {"line", "price", "running_total"} or
+    {"line", "error"}, then a final {"summary": {...}} line. Invalid records
+    are reported and skipped rather than failing the whole stream, since the
+    response has already started by the time they are read.
+    """
+    chunk_size = config.STREAM_CHUNK_SIZE
+    running_total = 0.0
+    priced = errors = 0
+    carat_total = 0.0
+
+    async def flush(batch: List[Tuple[int, object]]) -> str:
+        """Price the stones of a chunk and render its results in line order.
+
+        Entries are (line number, Diamond) or (line number, error message).
+        """
+        nonlocal running_total, priced, carat_total
+        diamonds = [entry for _, entry in batch if not isinstance(entry, str)]
+        prices = calculate_diamond_prices(diamonds, pricing) if diamonds else []
+        calculated_at = datetime.now(timezone.utc)
+        lines = []
+        stone_prices = iter(prices)
+        for line_number, entry in batch:
+            if isinstance(entry, str):
+                lines.append(json.dumps({"line": line_number, "error": entry}))
+                continue
+            price = next(stone_prices)
+            running_total += price
+            carat_total += entry.carat
+            lines.append(json.dumps({
+                "line": line_number,
+                "price": price,
+                "running_total": round(running_total, 2),
+            }))
+        await price_audit_queue.submit([
+            {
+                "carat": diamond.carat,
+                "clarity": diamond.clarity,
+                "color": diamond.color,
+                "cut": diamond.cut,
+                "certification": diamond.certification,
+                "price": price,
+                "calculated_by": session.staff_id,
+                "branch": session.branch,
+                "pricing_version": pricing.version,
+                "timestamp": calculated_at,
+            }
+            for diamond, price in zip(diamonds, prices)
+        ])
+        priced += len(diamonds)
+        return "\n".join(lines) + "\n"
+
+    # Stones and errors share one buffer so results come out in input order
+    batch: List[Tuple[int, object]] = []
+    async for line_number, record in iter_records(request, fmt):
+        if not isinstance(record, str):
+            try:
+                record = validate_record(record, pricing)
+            except ValueError as e:
+                record = str(e)
+        if isinstance(record, str):
+            errors += 1
+        batch.append((line_number, record))
+        if len(batch) >= chunk_size:
+            yield await flush(batch)
+            batch = []
+
+    tail = await flush(batch) if batch else ""
+    yield tail + json.dumps({"summary": {
+        "count": priced,
+        "errors": errors,
+        "total_carat": round(carat_total, 4),
+        "total_price": round(running_total, 2),
+        "pricing_version": pricing.version,
+    }}) + "\n"
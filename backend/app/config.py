@@ -0,0 +1,107 @@
+import os
+
+# Runtime settings, overridable through environment variables
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# How startup decides whether the schema needs upgrading:
+#   version - compare the stored schema fingerprint with the models and only
+#             reflect the database when they differ
+#   full    - always reflect and upgrade (use after editing the file by hand)
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "version")
+
+# Audit write-behind queue for DiamondPriceDB records
+#   async - enqueue and return; rows are flushed in the background
+#   group - enqueue and wait until the batch containing the rows commits
+#   sync  - write the rows before returning (previous behaviour)
+AUDIT_DURABILITY = os.getenv("AUDIT_DURABILITY", "async")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "50000"))  # Rows held in memory
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))  # Rows per bulk insert
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.5"))  # Seconds
+
+# /api/log-activity/ events are buffered the same way (durability and queue
+# size follow the AUDIT_* settings)
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "500"))  # Rows per bulk insert
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "1.0"))  # Seconds
+
+# Session lifetime from login, and how often expired sessions are swept
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))  # Seconds
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "300"))  # Seconds
+
+# Session token cache used by the auth dependency
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))  # Tokens
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))  # Seconds
+# How often a worker checks the shared version counter for invalidations
+AUTH_CACHE_VERSION_INTERVAL = float(os.getenv("AUTH_CACHE_VERSION_INTERVAL", "2"))
+
+# Serve routes through SQLAlchemy's asyncio extension (requires aiosqlite).
+# When off, route sessions run the sync engine in the threadpool.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# SQLite tuning profile: durable, balanced or fast (see app.database)
+DB_PROFILE = os.getenv("DB_PROFILE", "balanced")
+# Connection pools; SQLite serializes writers, so the write pool stays small
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "2"))
+DB_WRITE_POOL_OVERFLOW = int(os.getenv("DB_WRITE_POOL_OVERFLOW", "4"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+DB_READ_POOL_OVERFLOW = int(os.getenv("DB_READ_POOL_OVERFLOW", "8"))
+
+# Fraction of requests whose latencies are recorded in /metrics histograms
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
+# Decode /api/calculate-price bodies without a Pydantic model per stone and
+# encode responses with orjson when installed (msgpack, when installed, is
+# served on request via the Accept header either way)
+FAST_PATH = os.getenv("FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# Memoized /api/calculate-price responses
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", "1024"))  # Quotes
+QUOTE_CACHE_MAX_STONES = int(os.getenv("QUOTE_CACHE_MAX_STONES", "50000"))  # Per quote
+
+# Pages of /api/login-logs/ and /api/calculation-history/ kept per filter set
+# for conditional polling, and the body size from which they are gzipped
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "256"))  # Pages
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))  # Bytes
+
+# Staff IDs allowed to publish pricing tables and run what-if simulations,
+# comma separated. Empty means nobody can.
+PRICING_ADMINS = frozenset(
+    staff_id.strip() for staff_id in os.getenv("PRICING_ADMINS", "").split(",") if staff_id.strip()
+)
+
+# How often a worker checks for a newly published pricing table
+PRICING_RELOAD_INTERVAL = float(os.getenv("PRICING_RELOAD_INTERVAL", "2"))  # Seconds
+
+# Stones validated, priced and audited per step of /api/calculate-price/stream
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+# Retention: rows older than this move from login_logs, diamond_prices and
+# requotes into gzip NDJSON monthly archives (see app.retention)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "365"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))  # Rows per delete
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "0"))  # Seconds, 0 disables
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "2000"))  # Per run
+# Defaults to an "archive" folder next to the database file
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH")
+
+# Multi-worker serving with ``python -m app.serve`` (see app.serve)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))  # 0 sizes to the CPU count
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))  # Shared listen queue
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))  # Seconds to drain
+# Run retention and the session sweeper in this process; app.serve turns
+# this off in every worker but the first
+BACKGROUND_TASKS = os.getenv("BACKGROUND_TASKS", "true").lower() in ("1", "true", "yes")
+
+# Inventory revaluation jobs (see app.inventory)
+REVALUATION_CHUNK_SIZE = int(os.getenv("REVALUATION_CHUNK_SIZE", "5000"))  # Stones per commit
+REVALUATION_POLL_INTERVAL = float(os.getenv("REVALUATION_POLL_INTERVAL", "2"))  # Seconds
+
+# History rows read and repriced per step of a what-if simulation, and how
+# many simulations one worker runs at once (more are refused with 429)
+SIMULATION_CHUNK_SIZE = int(os.getenv("SIMULATION_CHUNK_SIZE", "100000"))
+SIMULATION_CONCURRENCY = int(os.getenv("SIMULATION_CONCURRENCY", "1"))
+
+# Stones one /api/live-quotes connection may hold in its working parcel
+LIVE_QUOTE_MAX_LINES = int(os.getenv("LIVE_QUOTE_MAX_LINES", "10000"))
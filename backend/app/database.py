@@ -1,44 +1,128 @@
 import os
+import time
 import logging
+from contextlib import asynccontextmanager
 from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from . import config
 
-# Configure logging with more detail
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Define database path using absolute paths
+# Define database path using absolute paths; DATABASE_PATH overrides it
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_FOLDER = os.path.join(BASE_DIR, "database")
 DB_FILE = "sql_app.db"
-DB_PATH = os.path.join(DB_FOLDER, DB_FILE)
-
-# Ensure the database folder exists
-os.makedirs(DB_FOLDER, exist_ok=True)
-logger.info(f"Database directory: {DB_FOLDER}")
-logger.info(f"Database file path: {DB_PATH}")
+DB_PATH = os.path.abspath(
+    os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database", DB_FILE))
+)
+DB_FOLDER = os.path.dirname(DB_PATH)
 
 # SQLite database URL with absolute path
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# SQLite tuning profiles, selected with DB_PROFILE. All run in WAL mode.
+#   durable  - synchronous=FULL syncs the WAL on every commit, so committed
+#              rows survive power loss; a 16 MB page cache (SQLite's default
+#              is 2 MB) and no memory mapping
+#   balanced - synchronous=NORMAL can lose the last commits on power loss,
+#              but never corrupts the file
+#   fast     - synchronous=OFF never syncs, so power loss or an OS crash can
+#              lose committed rows, audit rows included, and may corrupt the
+#              file; an application crash alone loses nothing
+TUNING_PROFILES = {
+    "durable": {
+        "synchronous": "FULL",
+        "cache_size": -16000,  # KiB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "fast": {
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+if config.DB_PROFILE not in TUNING_PROFILES:
+    raise ValueError(f"Unknown DB_PROFILE: {config.DB_PROFILE}")
+TUNING = TUNING_PROFILES[config.DB_PROFILE]
+
 # Configure SQLite to enforce foreign key constraints
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     try:
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        # Only takes effect on a new database; see app.retention for older ones
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
         cursor.execute("PRAGMA journal_mode=WAL")  # Better concurrent access
+        for pragma, value in TUNING.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
         cursor.close()
-        logger.info("SQLite PRAGMA settings configured successfully")
+        logger.debug("SQLite PRAGMA settings configured successfully")
     except Exception as e:
         logger.error(f"Failed to set SQLite PRAGMA settings: {str(e)}")
         raise
 
+_db_folder_ready = False
+
+def ensure_db_folder(dialect, connection_record, cargs, cparams):
+    """Create the database folder on the first connect rather than at import."""
+    global _db_folder_ready
+    if not _db_folder_ready:
+        os.makedirs(DB_FOLDER, exist_ok=True)
+        _db_folder_ready = True
+
+def set_query_only(dbapi_connection, connection_record):
+    """Make every connection of a read engine refuse writes."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+class _WaitTimingMixin:
+    """Reports how long a checkout took when the pool had no idle connection."""
+
+    wait_listeners = ()
+
+    def _do_get(self):
+        if not self.wait_listeners or self.checkedin() > 0:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            for listener in self.wait_listeners:
+                listener(waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_listeners = self.wait_listeners
+        return pool
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_listeners = []
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_listeners = []
+
+# Writes go through a small pool: SQLite admits one writer at a time, and
+# IMMEDIATE transactions take the write lock up front instead of failing
+# to upgrade a read lock half way through.
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={
@@ -46,11 +130,31 @@ engine = create_engine(
         "timeout": 30,  # Connection timeout in seconds
         "isolation_level": "IMMEDIATE"  # Better concurrent write handling
     },
+    poolclass=InstrumentedQueuePool,
     pool_pre_ping=True,  # Enable connection health checks
     pool_recycle=3600,  # Recycle connections after 1 hour
-    pool_size=5,  # Maximum number of connections
-    max_overflow=10  # Maximum number of connections that can be created beyond pool_size
+    pool_size=config.DB_WRITE_POOL_SIZE,
+    max_overflow=config.DB_WRITE_POOL_OVERFLOW
+)
+
+# Reads use deferred transactions on query_only connections, so they only
+# take a shared lock and, under WAL, never wait for a writer.
+read_engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={
+        "check_same_thread": False,
+        "timeout": 30,
+        "isolation_level": "DEFERRED"
+    },
+    poolclass=InstrumentedQueuePool,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    pool_size=config.DB_READ_POOL_SIZE,
+    max_overflow=config.DB_READ_POOL_OVERFLOW
 )
+event.listen(read_engine, "connect", set_query_only)
+for _engine in (engine, read_engine):
+    event.listen(_engine, "do_connect", ensure_db_folder)
 
 # Create session factory
 SessionLocal = sessionmaker(
@@ -60,12 +164,123 @@ SessionLocal = sessionmaker(
     expire_on_commit=False  # Prevent expired object issues
 )
 
+ReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=read_engine,
+    expire_on_commit=False
+)
+
+# Async engines and session factories, only created when DB_ASYNC is enabled
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+
+if config.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{DB_PATH}",
+        connect_args={
+            "timeout": 30,
+            "isolation_level": "IMMEDIATE"
+        },
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_size=config.DB_WRITE_POOL_SIZE,
+        max_overflow=config.DB_WRITE_POOL_OVERFLOW
+    )
+    async_read_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{DB_PATH}",
+        connect_args={
+            "timeout": 30,
+            "isolation_level": "DEFERRED"
+        },
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_size=config.DB_READ_POOL_SIZE,
+        max_overflow=config.DB_READ_POOL_OVERFLOW
+    )
+    event.listen(async_read_engine.sync_engine, "connect", set_query_only)
+    for _engine in (async_engine, async_read_engine):
+        event.listen(_engine.sync_engine, "do_connect", ensure_db_folder)
+
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+    AsyncReadSessionLocal = async_sessionmaker(
+        bind=async_read_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
 # Base class for ORM models
 Base = declarative_base()
 
+class ThreadedSession:
+    """Awaitable facade over a sync Session.
+
+    Implements the subset of AsyncSession the routes use, running each
+    blocking call in the threadpool so the event loop is never stalled.
+    Row results are buffered in the worker thread, as AsyncSession does.
+    """
+
+    def __init__(self, sync_session):
+        self.sync_session = sync_session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    def _execute(self, statement, params=None):
+        result = self.sync_session.execute(statement, params)
+        # DML results carry only a rowcount and cannot be frozen
+        if getattr(result, "returns_rows", True):
+            return result.freeze()()
+        return result
+
+    async def execute(self, statement, params=None):
+        return await run_in_threadpool(self._execute, statement, params)
+
+    async def scalar(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+# Type of the session get_db yields: AsyncSession or the threaded facade
+DBSession = AsyncSession if config.DB_ASYNC else ThreadedSession
+
 # Dependency to get a database session
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    if AsyncSessionLocal is not None:
+        db = AsyncSessionLocal()
+    else:
+        db = ThreadedSession(SessionLocal())
     try:
         logger.debug("Database session created")
         yield db
@@ -74,7 +289,38 @@ def get_db():
         raise
     finally:
         logger.debug("Database session closed")
-        db.close()
+        await db.close()
+
+async def get_read_db():
+    """Session on the read-only pool, for routes that never write."""
+    if AsyncReadSessionLocal is not None:
+        db = AsyncReadSessionLocal()
+    else:
+        db = ThreadedSession(ReadSessionLocal())
+    try:
+        yield db
+    except Exception as e:
+        logger.error(f"Database session error: {str(e)}")
+        raise
+    finally:
+        await db.close()
+
+@asynccontextmanager
+async def read_session():
+    """A read-only session outside of a request, e.g. for a WebSocket handshake."""
+    if AsyncReadSessionLocal is not None:
+        db = AsyncReadSessionLocal()
+    else:
+        db = ThreadedSession(ReadSessionLocal())
+    try:
+        yield db
+    finally:
+        await db.close()
 
-# Log successful database setup
-logger.info("Database configuration completed successfully")
+async def dispose_engines():
+    """Close every pooled connection of the sync and async engines."""
+    engine.dispose()
+    read_engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+        await async_read_engine.dispose()
@@ -0,0 +1,226 @@
+import re
+import json
+import email.message
+from typing import List, NamedTuple, Optional, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from . import config
+from .models import Diamond, DiamondCalculationRequest
+from .utils import PRICING_AXES, PricingSnapshot
+
+# Optional serializers; without them responses fall back to the stdlib path
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Fast path for /api/calculate-price. Parcels made only of plainly valid
+# stones are checked against these sets and decoded into tuples instead of
+# one Pydantic model per stone. Anything else, including every invalid
+# request, is validated by DiamondCalculationRequest exactly as FastAPI
+# would, so error responses are unchanged.
+
+CLARITY_GRADES = frozenset(["FL", "IF", "VVS1", "VVS2", "VS1", "VS2", "SI1", "SI2", "I1"])
+COLOR_GRADES = frozenset("DEFGHIJK")
+CUT_GRADES = frozenset(["Excellent", "Very Good", "Good", "Fair", "Poor"])
+CERTIFICATION_GRADES = frozenset(["GIA", "AGS", "IGI", "HRD", "Others", "None"])
+
+GRADE_SETS = {
+    "clarity": CLARITY_GRADES,
+    "color": COLOR_GRADES,
+    "cut": CUT_GRADES,
+    "certification": CERTIFICATION_GRADES,
+}
+
+def _check_grade_sets() -> None:
+    """The sets may be narrower than the Diamond patterns, never wider."""
+    for field, grades in GRADE_SETS.items():
+        pattern = next(
+            meta.pattern for meta in Diamond.model_fields[field].metadata
+            if getattr(meta, "pattern", None)
+        )
+        for grade in grades:
+            if not re.fullmatch(pattern, grade):
+                raise RuntimeError(f"Fast path {field} grade {grade!r} fails {pattern}")
+
+_check_grade_sets()
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+class Stone(NamedTuple):
+    """A validated stone; stands in for Diamond wherever attributes are read."""
+    carat: float
+    clarity: str
+    color: str
+    cut: str
+    certification: str
+    quantity: Optional[int]
+
+def fast_validate(payload) -> Optional[List[Stone]]:
+    """Decode a request payload into Stones, or None if it needs Pydantic."""
+    if type(payload) is not dict:
+        return None
+    staff_id = payload.get("staff_id")
+    if staff_id is not None and type(staff_id) is not str:
+        return None
+    diamonds = payload.get("diamonds")
+    if type(diamonds) is not list:
+        return None
+
+    stones = []
+    append = stones.append
+    for record in diamonds:
+        if type(record) is not dict:
+            return None
+        carat = record.get("carat")
+        # bool is an int subclass, hence exact type checks
+        if (type(carat) is not float and type(carat) is not int) or not carat > 0:
+            return None
+        clarity = record.get("clarity")
+        color = record.get("color")
+        cut = record.get("cut")
+        certification = record.get("certification")
+        if (
+            clarity not in CLARITY_GRADES or color not in COLOR_GRADES
+            or cut not in CUT_GRADES or certification not in CERTIFICATION_GRADES
+        ):
+            return None
+        quantity = record.get("quantity", 1)
+        if quantity is not None and (type(quantity) is not int or quantity <= 0):
+            return None
+        append(Stone(float(carat), clarity, color, cut, certification, quantity))
+    return stones
+
+def _is_json(content_type: Optional[str]) -> bool:
+    """Mirror FastAPI's choice of whether to parse a body as JSON."""
+    if not content_type:
+        return True
+    message = email.message.Message()
+    message["content-type"] = content_type
+    if message.get_content_maintype() != "application":
+        return False
+    subtype = message.get_content_subtype()
+    return subtype == "json" or subtype.endswith("+json")
+
+def unpriced_grades(diamonds: Sequence, pricing: PricingSnapshot) -> List[dict]:
+    """Validation errors for grades the pricing table has no multiplier for.
+
+    The Diamond patterns accept grades such as certification "Others" that
+    no table prices.
+    """
+    errors = []
+    for i, diamond in enumerate(diamonds):
+        for axis in PRICING_AXES:
+            grade = getattr(diamond, axis)
+            if grade not in pricing.codes[axis]:
+                errors.append({
+                    "type": "value_error",
+                    "loc": ("body", "diamonds", i, axis),
+                    "msg": f"Value error, no price for {axis} {grade}",
+                    "input": grade,
+                    "ctx": {"error": f"no price for {axis} {grade}"},
+                })
+    return errors
+
+async def read_diamonds(request: Request, pricing: PricingSnapshot) -> Sequence:
+    """Read and validate a DiamondCalculationRequest body.
+
+    Returns Stones on the fast path, Diamond models otherwise. Raises
+    RequestValidationError with the errors FastAPI itself would report,
+    followed by a check that ``pricing`` prices every grade.
+    """
+    diamonds = await _read_diamonds(request)
+    errors = unpriced_grades(diamonds, pricing)
+    if errors:
+        raise RequestValidationError(errors, body=None)
+    return diamonds
+
+async def _read_diamonds(request: Request) -> Sequence:
+    body_bytes = await request.body()
+    payload = None
+    if body_bytes:
+        payload = body_bytes
+        if _is_json(request.headers.get("content-type")):
+            try:
+                payload = orjson.loads(body_bytes) if orjson is not None else json.loads(body_bytes)
+            except ValueError:
+                # Re-decode with json for FastAPI's exact error position and text
+                try:
+                    payload = json.loads(body_bytes)
+                except json.JSONDecodeError as e:
+                    raise RequestValidationError(
+                        [{
+                            "type": "json_invalid",
+                            "loc": ("body", e.pos),
+                            "msg": "JSON decode error",
+                            "input": {},
+                            "ctx": {"error": e.msg},
+                        }],
+                        body=e.doc,
+                    )
+
+    if config.FAST_PATH:
+        stones = fast_validate(payload)
+        if stones is not None:
+            return stones
+
+    if payload is None:
+        raise RequestValidationError(
+            [{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}],
+            body=None,
+        )
+    try:
+        # FastAPI validates bodies with from_attributes, which changes some errors
+        return DiamondCalculationRequest.model_validate(payload, from_attributes=True).diamonds
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body",) + tuple(error["loc"])}
+                for error in e.errors(include_url=False)
+            ],
+            body=payload,
+        )
+
+def render_response(content: dict, accept: Optional[str]) -> Response:
+    """Encode a response body as MessagePack or JSON per the Accept header."""
+    headers = {"Vary": "Accept"}
+    if msgpack is not None and accept and any(t in accept for t in MSGPACK_MEDIA_TYPES):
+        return Response(
+            msgpack.packb(jsonable_encoder(content)),
+            media_type=MSGPACK_MEDIA_TYPES[0],
+            headers=headers,
+        )
+    if config.FAST_PATH and orjson is not None:
+        return Response(orjson.dumps(content), media_type="application/json", headers=headers)
+    return JSONResponse(jsonable_encoder(content), headers=headers)
+
+def request_body_openapi(model) -> dict:
+    """OpenAPI requestBody for routes that read and validate the body themselves."""
+    schema = model.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return inline(definitions[node["$ref"].rsplit("/", 1)[-1]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(value) for value in node]
+        return node
+
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": inline(schema)}},
+            "required": True,
+        }
+    }
@@ -0,0 +1,237 @@
+"""Multi-criteria search over calculation history.
+
+A search filters on grade sets, carat and price ranges, a time window and
+staff, newest first with the same keyset cursors as /calculation-history/.
+It runs as a deferred join: the page of matching ids is found by walking
+one of the keyset indexes, ix_diamond_prices_timestamp_id or
+ix_diamond_prices_calculated_by_timestamp_id, and only those rows are then
+read from the table by primary key.
+
+diamond_prices is written once per audited stone, so it has no indexes for
+grades, carat or price. Searches on those walk the index newest first and
+check each row they pass against the table, stopping after one page: the
+rarer the match, the more rows are read to fill it. Searches on time and
+staff alone never read the table beyond the page (INDEX_ONLY_CASES).
+Searches on several staff members merge the staff index ranges and sort
+every match to find the page, so their cost grows with the number of
+matches, not the page size (FULL_SORT_CASES).
+
+Run from the backend directory to check that every kind of search still
+plans that way against a database; tests/test_history_plans.py runs the
+same checks:
+
+    python -m app.history             # exit status 1 if a search plans worse
+    python -m app.history --analyze   # plan with fresh ANALYZE statistics first
+"""
+import re
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import Select, select
+from sqlalchemy.engine import Connection
+
+from .database import engine, read_engine
+from .models import DiamondPriceDB
+from .pagination import apply_keyset, encode_cursor, raw_timestamp
+from .utils import DEFAULT_MULTIPLIERS, PRICING_AXES
+
+HISTORY_FIELDS = [
+    "id", "timestamp", "carat", "clarity", "color", "cut", "certification",
+    "price", "calculated_by"
+]
+
+class HistoryFilters(NamedTuple):
+    """Criteria of a history search; None leaves a criterion out.
+
+    Grade and staff criteria match any of the listed values. Ranges and the
+    time window are inclusive.
+    """
+    clarity: Optional[Sequence[str]] = None
+    color: Optional[Sequence[str]] = None
+    cut: Optional[Sequence[str]] = None
+    certification: Optional[Sequence[str]] = None
+    carat_min: Optional[float] = None
+    carat_max: Optional[float] = None
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    staff_id: Optional[Sequence[str]] = None
+
+def stored_time(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC; naive input is taken as UTC."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def check_filters(filters: HistoryFilters) -> None:
+    """Raise ValueError for unknown grades and inverted ranges."""
+    for axis in PRICING_AXES:
+        for grade in getattr(filters, axis) or ():
+            if grade not in DEFAULT_MULTIPLIERS[axis]:
+                raise ValueError(f"Unknown {axis} grade: {grade}")
+    for low, high in (("carat_min", "carat_max"), ("price_min", "price_max")):
+        low_value, high_value = getattr(filters, low), getattr(filters, high)
+        if low_value is not None and high_value is not None and high_value < low_value:
+            raise ValueError(f"{high} must not be less than {low}")
+    if filters.start and filters.end and stored_time(filters.end) < stored_time(filters.start):
+        raise ValueError("end must not be before start")
+
+def filter_conditions(filters: HistoryFilters) -> list:
+    """WHERE clauses on DiamondPriceDB for the given criteria."""
+    conditions = []
+    for axis in PRICING_AXES:
+        grades = getattr(filters, axis)
+        if grades:
+            conditions.append(getattr(DiamondPriceDB, axis).in_(grades))
+    if filters.staff_id:
+        conditions.append(DiamondPriceDB.calculated_by.in_(filters.staff_id))
+    if filters.carat_min is not None:
+        conditions.append(DiamondPriceDB.carat >= filters.carat_min)
+    if filters.carat_max is not None:
+        conditions.append(DiamondPriceDB.carat <= filters.carat_max)
+    if filters.price_min is not None:
+        conditions.append(DiamondPriceDB.price >= filters.price_min)
+    if filters.price_max is not None:
+        conditions.append(DiamondPriceDB.price <= filters.price_max)
+    if filters.start is not None:
+        conditions.append(DiamondPriceDB.timestamp >= stored_time(filters.start))
+    if filters.end is not None:
+        conditions.append(DiamondPriceDB.timestamp <= stored_time(filters.end))
+    return conditions
+
+def search_ids(filters: HistoryFilters, cursor: Optional[str], limit: int) -> Select:
+    """Ids of one page of matching rows, newest first."""
+    query = select(DiamondPriceDB.id).where(*filter_conditions(filters))
+    return apply_keyset(query, DiamondPriceDB.timestamp, DiamondPriceDB.id, cursor).limit(limit)
+
+def search_query(filters: HistoryFilters, cursor: Optional[str], limit: int) -> Select:
+    """One page of matching rows with HISTORY_FIELDS and the cursor timestamp."""
+    return (
+        select(
+            *[getattr(DiamondPriceDB, field) for field in HISTORY_FIELDS],
+            raw_timestamp(DiamondPriceDB.timestamp)
+        )
+        .where(DiamondPriceDB.id.in_(search_ids(filters, cursor, limit)))
+        .order_by(DiamondPriceDB.timestamp.desc(), DiamondPriceDB.id.desc())
+    )
+
+class PlanStep(NamedTuple):
+    id: int
+    parent: int
+    detail: str
+
+def explain(connection: Connection, query: Select) -> List[PlanStep]:
+    """The steps of SQLite's query plan for a query."""
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    return [
+        PlanStep(row.id, row.parent, row.detail)
+        for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+    ]
+
+def table_reads(plan: Sequence[PlanStep]) -> List[str]:
+    """Plan steps that read diamond_prices rows other than by primary key."""
+    return [
+        step.detail for step in plan
+        if re.match(r"(SCAN|SEARCH) diamond_prices\b", step.detail)
+        and "COVERING INDEX" not in step.detail and "INTEGER PRIMARY KEY" not in step.detail
+    ]
+
+def table_scans(plan: Sequence[PlanStep]) -> List[str]:
+    """Plan steps that scan diamond_prices without any index."""
+    return [step.detail for step in plan if re.fullmatch(r"SCAN diamond_prices", step.detail)]
+
+def full_sorts(plan: Sequence[PlanStep]) -> List[str]:
+    """Sorts inside the id subquery, which sort every matching row.
+
+    The outer query sorting the one page it returns is expected.
+    """
+    steps = {step.id: step for step in plan}
+
+    def in_subquery(step: PlanStep) -> bool:
+        while step.parent in steps:
+            step = steps[step.parent]
+            if "SUBQUERY" in step.detail:
+                return True
+        return False
+
+    return [
+        step.detail for step in plan
+        if step.detail.startswith("USE TEMP B-TREE") and in_subquery(step)
+    ]
+
+# Cases whose criteria are all in an index, so only the page is read
+INDEX_ONLY_CASES = frozenset(["recent", "time_window", "staff", "several_staff_time_window"])
+
+# Cases whose index cannot deliver rows in time order (see the module docstring)
+FULL_SORT_CASES = frozenset(["several_staff_time_window"])
+
+def plan_problems(name: str, plan: Sequence[PlanStep]) -> List[str]:
+    """What is wrong with a case's plan; empty when it plans as intended."""
+    name = name.removesuffix("_next_page")
+    problems = [f"scans the table: {step}" for step in table_scans(plan)]
+    if name in INDEX_ONLY_CASES:
+        problems.extend(f"reads the table: {step}" for step in table_reads(plan))
+    if name not in FULL_SORT_CASES:
+        problems.extend(f"sorts every match: {step}" for step in full_sorts(plan))
+    return problems
+
+def plan_cases() -> Dict[str, HistoryFilters]:
+    """One search per access pattern the indexes are meant to serve."""
+    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    grades = {"certification": ["GIA"], "color": ["D", "E", "F"], "carat_min": 1.0}
+    return {
+        "recent": HistoryFilters(),
+        "time_window": HistoryFilters(start=week_ago),
+        "staff": HistoryFilters(staff_id=["staff1"]),
+        "several_staff_time_window": HistoryFilters(staff_id=["staff1", "staff2"], start=week_ago),
+        "grades": HistoryFilters(**grades),
+        "grades_time_window": HistoryFilters(**grades, start=week_ago),
+        "carat_price_ranges": HistoryFilters(carat_min=0.5, carat_max=1.0, price_min=5000.0),
+        "everything": HistoryFilters(
+            clarity=["VVS1", "VVS2"], color=["D", "E"], cut=["Excellent"],
+            certification=["GIA", "AGS"], carat_min=1.0, carat_max=2.0,
+            price_min=10000.0, price_max=100000.0, start=week_ago,
+            end=datetime.now(timezone.utc), staff_id=["staff1"],
+        ),
+    }
+
+def check_plans(connection: Connection) -> Dict[str, List[PlanStep]]:
+    """Plan every case, first and later pages. Returns the plans by case."""
+    cursor = encode_cursor("2026-01-01 00:00:00", 1)
+    plans = {}
+    for name, filters in plan_cases().items():
+        plans[name] = explain(connection, search_query(filters, None, 50))
+        plans[f"{name}_next_page"] = explain(connection, search_query(filters, cursor, 50))
+    return plans
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check that history searches stay index-only")
+    parser.add_argument(
+        "--analyze", action="store_true",
+        help="Run ANALYZE first, so plans use statistics of the current data"
+    )
+    args = parser.parse_args(argv)
+
+    from .migrations import upgrade_schema
+    upgrade_schema(engine)
+    if args.analyze:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE diamond_prices")
+
+    failed = 0
+    with read_engine.connect() as connection:
+        for name, plan in check_plans(connection).items():
+            problems = plan_problems(name, plan)
+            failed += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':<6} {name}")
+            for step in plan:
+                print(f"       {step.detail}")
+            for problem in problems:
+                print(f"       -> {problem}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+"""Stored inventory and its revaluation jobs.
+
+Stones keep their grades as small integer codes, the positions of the grades
+in the built-in multiplier tables, which are also the indexes of every
+pricing snapshot's matrix. A revaluation job reprices the stock to one
+pricing table version in id-ordered chunks of REVALUATION_CHUNK_SIZE, each
+priced in one array pass and committed together with the job's checkpoint,
+so an interrupted job resumes where it stopped.
+
+Jobs are incremental: a stone priced under version W only needs repricing if
+W's table differs from the target for one of the stone's grades, or in base
+price. Publishing a table that changes one multiplier therefore rewrites only
+the stones holding that grade.
+
+Run from the backend directory:
+
+    python -m app.inventory revalue              # value at the newest table
+    python -m app.inventory revalue --version 3
+    python -m app.inventory status
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import config
+from .database import SessionLocal
+from .models import InventoryStoneCreate, InventoryStoneDB, PricingTableDB, RevaluationJobDB
+from .pricing import snapshot_from_record
+from .startup import configure_logging
+from .tasks import PeriodicTask
+from .utils import DEFAULT_MULTIPLIERS, PRICING_AXES, PricingSnapshot, price_encoded
+
+logger = logging.getLogger(__name__)
+
+GRADE_CODES = {
+    axis: {grade: code for code, grade in enumerate(DEFAULT_MULTIPLIERS[axis])}
+    for axis in PRICING_AXES
+}
+GRADE_NAMES = {axis: list(DEFAULT_MULTIPLIERS[axis]) for axis in PRICING_AXES}
+CODE_COLUMNS = {axis: getattr(InventoryStoneDB, f"{axis}_code") for axis in PRICING_AXES}
+
+# A running job whose heartbeat is older than this was interrupted and may
+# be resumed by any runner
+STALE_JOB_SECONDS = 60
+
+ACTIVE_JOB_STATUSES = ("pending", "running")
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def check_grade_codes(snapshot: PricingSnapshot) -> None:
+    """Stored codes are only meaningful if the snapshot indexes grades the same way."""
+    for axis in PRICING_AXES:
+        if snapshot.codes[axis] != GRADE_CODES[axis]:
+            raise RuntimeError(f"Pricing table {snapshot.version} does not follow the stored {axis} codes")
+
+def encode_stones(stones: Sequence[InventoryStoneCreate]) -> List[dict]:
+    """Inventory rows for validated stones. Raises ValueError for unpriced grades."""
+    rows = []
+    for i, stone in enumerate(stones):
+        row = {"sku": stone.sku, "branch": stone.branch, "carat": stone.carat, "quantity": stone.quantity or 1}
+        for axis in PRICING_AXES:
+            grade = getattr(stone, axis)
+            if grade not in GRADE_CODES[axis]:
+                raise ValueError(f"Stone {i+1}: {axis}: no price for {grade}")
+            row[f"{axis}_code"] = GRADE_CODES[axis][grade]
+        rows.append(row)
+    return rows
+
+def price_rows(snapshot: PricingSnapshot, rows) -> List[float]:
+    """Price rows carrying carat and the four grade codes in one array pass."""
+    check_grade_codes(snapshot)
+    carats = np.fromiter((row["carat"] for row in rows), dtype=np.float64, count=len(rows))
+    codes = [
+        np.fromiter((row[f"{axis}_code"] for row in rows), dtype=np.int8, count=len(rows))
+        for axis in PRICING_AXES
+    ]
+    return price_encoded(snapshot, carats, *codes)
+
+async def add_stones(db, stones: Sequence[InventoryStoneCreate], snapshot: PricingSnapshot) -> dict:
+    """Store stones valued under the given snapshot. The caller handles IntegrityError."""
+    rows = encode_stones(stones)
+    for row, price in zip(rows, price_rows(snapshot, rows)):
+        row.update(price=price, pricing_version=snapshot.version)
+    if rows:
+        await db.execute(insert(InventoryStoneDB.__table__), rows)
+    await db.commit()
+    return {
+        "added": len(rows),
+        "value": round(sum(row["price"] * row["quantity"] for row in rows), 2),
+        "pricing_version": snapshot.version,
+    }
+
+async def inventory_summary(db) -> dict:
+    value = InventoryStoneDB.price * InventoryStoneDB.quantity
+    result = await db.execute(
+        select(
+            InventoryStoneDB.pricing_version,
+            func.count().label("stones"),
+            func.sum(InventoryStoneDB.quantity).label("quantity"),
+            func.sum(value).label("value"),
+        )
+        .group_by(InventoryStoneDB.pricing_version)
+        .order_by(InventoryStoneDB.pricing_version)
+    )
+    by_version = [
+        {
+            "pricing_version": row.pricing_version,
+            "stones": row.stones,
+            "quantity": row.quantity or 0,
+            "value": round(row.value or 0.0, 2),
+        }
+        for row in result
+    ]
+    return {
+        "stones": sum(group["stones"] for group in by_version),
+        "quantity": sum(group["quantity"] for group in by_version),
+        "value": round(sum(group["value"] for group in by_version), 2),
+        "by_pricing_version": by_version,
+    }
+
+def plan_revaluation(db: Session, target: PricingSnapshot) -> Tuple[str, dict]:
+    """Work out which stones a revaluation to ``target`` must reprice.
+
+    Returns the mode and a plan ``{"versions": {W: changed}}`` where
+    ``changed`` is None when every stone priced under W is repriced, or
+    axis -> grade codes whose multiplier differs from the target. Unpriced
+    stones are always included.
+    """
+    versions = db.scalars(
+        select(InventoryStoneDB.pricing_version)
+        .where(InventoryStoneDB.pricing_version.is_not(None))
+        .distinct()
+    ).all()
+    plan: Dict[str, Optional[Dict[str, List[int]]]] = {}
+    for version in versions:
+        if version == target.version:
+            continue
+        source = snapshot_from_record(db.get(PricingTableDB, version))
+        if source.base_price != target.base_price:
+            plan[str(version)] = None
+            continue
+        changed = {
+            axis: [
+                code for grade, code in GRADE_CODES[axis].items()
+                if source.multipliers[axis][grade] != target.multipliers[axis][grade]
+            ]
+            for axis in PRICING_AXES
+        }
+        changed = {axis: codes for axis, codes in changed.items() if codes}
+        if changed:
+            plan[str(version)] = changed
+    full = all(plan.get(str(version), False) is None for version in versions)
+    return ("full" if full else "incremental"), {"versions": plan}
+
+def plan_filter(plan: dict):
+    """SQL condition matching the stones a plan reprices."""
+    conditions = [InventoryStoneDB.pricing_version.is_(None)]
+    for version, changed in plan["versions"].items():
+        in_version = InventoryStoneDB.pricing_version == int(version)
+        if changed is None:
+            conditions.append(in_version)
+        else:
+            conditions.append(and_(in_version, or_(*(
+                CODE_COLUMNS[axis].in_(codes) for axis, codes in changed.items()
+            ))))
+    return or_(*conditions)
+
+def describe_job(job: RevaluationJobDB) -> dict:
+    """Shape a job as a RevaluationJobResponse, with progress and throughput."""
+    rate = job.processed / job.elapsed_seconds if job.elapsed_seconds else None
+    remaining = max(job.total - job.processed, 0)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "pricing_version": job.pricing_version,
+        "mode": job.mode,
+        "total": job.total,
+        "processed": job.processed,
+        "progress": round(min(job.processed / job.total, 1.0), 4) if job.total else float(job.status == "completed"),
+        "stones_per_second": round(rate, 1) if rate else None,
+        "eta_seconds": round(remaining / rate, 1) if rate and job.status in ACTIVE_JOB_STATUSES else None,
+        "repriced_value": round(job.repriced_value, 2),
+        "requested_by": job.requested_by,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+def create_revaluation_job(db: Session, pricing_version: int, requested_by: Optional[str]) -> RevaluationJobDB:
+    """Queue a revaluation. The plan is made when the job starts, after any
+    job queued before it has finished."""
+    job = RevaluationJobDB(
+        status="pending", pricing_version=pricing_version, requested_by=requested_by,
+        total=0, processed=0, repriced_value=0.0, last_id=0, elapsed_seconds=0.0,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def claim_job(db: Session, job_id: int) -> bool:
+    """Mark a pending or stale running job as running in this process."""
+    now = _utcnow()
+    result = db.execute(
+        update(RevaluationJobDB)
+        .where(
+            RevaluationJobDB.id == job_id,
+            or_(
+                RevaluationJobDB.status == "pending",
+                and_(
+                    RevaluationJobDB.status == "running",
+                    RevaluationJobDB.heartbeat_at < now - timedelta(seconds=STALE_JOB_SECONDS),
+                ),
+            ),
+        )
+        .values(status="running", heartbeat_at=now)
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+def run_revaluation(
+    job_id: int,
+    chunk_size: Optional[int] = None,
+    progress: Optional[Callable[[dict], None]] = None,
+) -> Optional[dict]:
+    """Run or resume a job until done. Returns the final job description,
+    or None if another runner holds the job.
+
+    Each chunk's price updates and the job's checkpoint commit in one
+    transaction. The checkpoint update only applies while the job is still
+    running, which is how a cancellation stops it.
+    """
+    chunk_size = chunk_size or config.REVALUATION_CHUNK_SIZE
+    db = SessionLocal()
+    try:
+        if not claim_job(db, job_id):
+            return None
+        job = db.get(RevaluationJobDB, job_id)
+        target = snapshot_from_record(db.get(PricingTableDB, job.pricing_version))
+        if job.plan is None:
+            mode, plan = plan_revaluation(db, target)
+            job.mode, job.plan = mode, json.dumps(plan)
+            job.total = db.scalar(
+                select(func.count()).select_from(InventoryStoneDB).where(plan_filter(plan))
+            )
+            db.commit()
+            logger.info(f"Revaluation job {job_id} to version {target.version}: {mode}, {job.total} stones")
+        condition = plan_filter(json.loads(job.plan))
+        columns = [InventoryStoneDB.id, InventoryStoneDB.carat, InventoryStoneDB.quantity]
+        columns += [CODE_COLUMNS[axis] for axis in PRICING_AXES]
+
+        while True:
+            started = time.perf_counter()
+            rows = db.execute(
+                select(*columns)
+                .where(InventoryStoneDB.id > job.last_id, condition)
+                .order_by(InventoryStoneDB.id)
+                .limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+            prices = price_rows(target, rows)
+            db.execute(update(InventoryStoneDB), [
+                {"id": row["id"], "price": price, "pricing_version": target.version}
+                for row, price in zip(rows, prices)
+            ])
+            checkpoint = db.execute(
+                update(RevaluationJobDB)
+                .where(RevaluationJobDB.id == job_id, RevaluationJobDB.status == "running")
+                .values(
+                    processed=RevaluationJobDB.processed + len(rows),
+                    last_id=rows[-1]["id"],
+                    repriced_value=RevaluationJobDB.repriced_value + sum(
+                        price * row["quantity"] for row, price in zip(rows, prices)
+                    ),
+                    elapsed_seconds=RevaluationJobDB.elapsed_seconds + (time.perf_counter() - started),
+                    heartbeat_at=_utcnow(),
+                )
+            )
+            if not checkpoint.rowcount:
+                db.rollback()
+                logger.info(f"Revaluation job {job_id} was cancelled")
+                break
+            db.commit()
+            db.refresh(job)
+            if progress is not None:
+                progress(describe_job(job))
+
+        db.execute(
+            update(RevaluationJobDB)
+            .where(RevaluationJobDB.id == job_id, RevaluationJobDB.status == "running")
+            .values(status="completed", finished_at=_utcnow())
+        )
+        db.commit()
+        db.refresh(job)
+        summary = describe_job(job)
+        if job.status == "completed":
+            logger.info(
+                f"Revaluation job {job_id} repriced {job.processed} stones in "
+                f"{job.elapsed_seconds:.2f} s ({summary['stones_per_second'] or 0} stones/s)"
+            )
+        return summary
+    except Exception as e:
+        db.rollback()
+        db.execute(
+            update(RevaluationJobDB)
+            .where(RevaluationJobDB.id == job_id)
+            .values(status="failed", error=str(e), finished_at=_utcnow())
+        )
+        db.commit()
+        logger.error(f"Revaluation job {job_id} failed: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+def cancel_job(db: Session, job_id: int) -> bool:
+    result = db.execute(
+        update(RevaluationJobDB)
+        .where(RevaluationJobDB.id == job_id, RevaluationJobDB.status.in_(ACTIVE_JOB_STATUSES))
+        .values(status="cancelled", finished_at=_utcnow())
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+def run_pending_revaluations() -> int:
+    """Run queued and interrupted jobs in order. Returns how many ran."""
+    ran = 0
+    while True:
+        db = SessionLocal()
+        try:
+            stale = _utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+            job_id = db.scalar(
+                select(RevaluationJobDB.id)
+                .where(or_(
+                    RevaluationJobDB.status == "pending",
+                    and_(RevaluationJobDB.status == "running", RevaluationJobDB.heartbeat_at < stale),
+                ))
+                .order_by(RevaluationJobDB.id)
+                .limit(1)
+            )
+        finally:
+            db.close()
+        if job_id is None:
+            return ran
+        try:
+            run_revaluation(job_id)
+        except Exception:
+            pass  # Recorded on the job and logged
+        ran += 1
+
+# Picks up queued revaluation jobs every REVALUATION_POLL_INTERVAL seconds
+revaluation_runner = PeriodicTask(
+    "revaluation", config.REVALUATION_POLL_INTERVAL, run_pending_revaluations
+)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Revalue the stored inventory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    revalue = commands.add_parser("revalue", help="Reprice the inventory and wait for the job")
+    revalue.add_argument("--version", type=int, help="Pricing table version (default: newest)")
+    revalue.add_argument("--chunk-size", type=int, default=config.REVALUATION_CHUNK_SIZE)
+    commands.add_parser("status", help="Show recent revaluation jobs")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from .database import engine
+    from .migrations import upgrade_schema
+    upgrade_schema(engine)
+
+    db = SessionLocal()
+    try:
+        if args.command == "status":
+            jobs = db.scalars(select(RevaluationJobDB).order_by(RevaluationJobDB.id.desc()).limit(10)).all()
+            for job in jobs:
+                print(json.dumps(describe_job(job), default=str))
+            return 0
+        version = args.version or db.scalar(select(func.max(PricingTableDB.version)))
+        if db.get(PricingTableDB, version) is None:
+            print(f"No pricing table version {version}", file=sys.stderr)
+            return 1
+        job = create_revaluation_job(db, version, "cli")
+    finally:
+        db.close()
+
+    def report(status: dict) -> None:
+        print(
+            f"job {status['id']}: {status['processed']}/{status['total']} "
+            f"({status['progress'] * 100:.1f}%), {status['stones_per_second'] or 0} stones/s",
+            flush=True
+        )
+
+    summary = run_revaluation(job.id, args.chunk_size, report)
+    if summary is None:
+        print(f"Job {job.id} was taken by another runner")
+        return 1
+    print(json.dumps(summary, default=str))
+    return 0 if summary["status"] == "completed" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
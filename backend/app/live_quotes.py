@@ -0,0 +1,243 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from . import config
+from .audit import price_audit_queue
+from .auth import StaffSession, resolve_session
+from .bulk import validate_record
+from .database import read_session
+from .models import Diamond
+from .quote_cache import quote_key
+from .utils import (
+    BATCH_PRICING_THRESHOLD, PricingSnapshot, calculate_diamond_price,
+    calculate_diamond_prices, current_pricing
+)
+
+# Live quotes over /api/live-quotes. The connection authenticates once, with
+# an Authorization header or, from browsers, which cannot set one, by
+# offering the subprotocols "live-quotes" and "bearer.<token>". Tokens never
+# go in the URL, which ends up in access logs. The working parcel lives on
+# the server, so each edit sends only a delta:
+#
+#   {"op": "add", "line": "a", "stone": {...}}   line is optional
+#   {"op": "change", "line": "a", "stone": {"carat": 1.2}}
+#   {"op": "remove", "line": "a"}
+#   {"op": "reset"}
+#   {"op": "finalize"}
+#
+# A message is one op or a list of ops. Each is answered with
+#
+#   {"type": "quote", "changed": {line: price}, "removed": [line],
+#    "total_price", "count", "pricing_version", "errors": [...]}
+#
+# carrying only the lines whose price changed. Only the changed stones are
+# validated and priced; a newly published pricing table reprices them all.
+# Nothing is audited until "finalize", which writes one DiamondPriceDB row
+# per stone, answers {"type": "finalized", ...} and empties the parcel, so a
+# repeated finalize cannot audit the same stones twice.
+
+LIVE_QUOTE_OPS = ("add", "change", "remove", "reset", "finalize")
+
+LIVE_QUOTE_PROTOCOL = "live-quotes"
+TOKEN_PROTOCOL_PREFIX = "bearer."
+
+def websocket_credentials(websocket: WebSocket) -> Optional[str]:
+    """The Authorization header, or the token offered as a subprotocol."""
+    authorization = websocket.headers.get("authorization")
+    if authorization:
+        return authorization
+    for protocol in websocket.scope.get("subprotocols", ()):
+        if protocol.startswith(TOKEN_PROTOCOL_PREFIX):
+            return protocol[len(TOKEN_PROTOCOL_PREFIX):]
+    return None
+
+def accepted_protocol(websocket: WebSocket) -> Optional[str]:
+    """The subprotocol to answer with; never echoes the token protocol."""
+    if LIVE_QUOTE_PROTOCOL in websocket.scope.get("subprotocols", ()):
+        return LIVE_QUOTE_PROTOCOL
+    return None
+
+class LiveQuote:
+    """The working parcel of one connection, with its line prices and total."""
+
+    def __init__(self, session: StaffSession, max_lines: int = config.LIVE_QUOTE_MAX_LINES):
+        self.session = session
+        self.max_lines = max_lines
+        self.pricing: PricingSnapshot = current_pricing()
+        self.lines: Dict[str, Diamond] = {}  # In parcel order
+        self.prices: Dict[str, float] = {}
+        self.total = 0.0
+        self._next_line = 1
+
+    def _new_line_id(self) -> str:
+        while str(self._next_line) in self.lines:
+            self._next_line += 1
+        return str(self._next_line)
+
+    def _apply(self, op: dict, pending: set, removed: List[str]) -> Optional[str]:
+        """Apply one op to the parcel; raises ValueError. Returns the op kind."""
+        if not isinstance(op, dict) or op.get("op") not in LIVE_QUOTE_OPS:
+            raise ValueError(f"Each op needs an \"op\" of {', '.join(LIVE_QUOTE_OPS)}")
+        kind = op["op"]
+        line = op.get("line")
+        line = None if line is None else str(line)
+
+        if kind == "add":
+            if line is None:
+                line = self._new_line_id()
+            elif line in self.lines:
+                raise ValueError(f"Line {line} already exists")
+            if len(self.lines) >= self.max_lines:
+                raise ValueError(f"A live quote holds at most {self.max_lines} stones")
+            self.lines[line] = validate_record(op.get("stone") or {}, self.pricing)
+            pending.add(line)
+        elif kind == "change":
+            if line not in self.lines:
+                raise ValueError(f"Line {line} does not exist")
+            record = {**self.lines[line].model_dump(), **(op.get("stone") or {})}
+            self.lines[line] = validate_record(record, self.pricing)
+            pending.add(line)
+        elif kind == "remove":
+            if line not in self.lines:
+                raise ValueError(f"Line {line} does not exist")
+            del self.lines[line]
+            self.total -= self.prices.pop(line, 0.0)
+            pending.discard(line)
+            removed.append(line)
+        elif kind == "reset":
+            removed.extend(self.lines)
+            self.lines.clear()
+            self.prices.clear()
+            self.total = 0.0
+            pending.clear()
+        return kind
+
+    def apply(self, message) -> dict:
+        """Apply a message of one or more ops and describe what changed.
+
+        Invalid ops are reported in "errors" and skipped; the others apply.
+        Sets ``finalize_requested`` when the message asks to finalize.
+        """
+        ops = message if isinstance(message, list) else [message]
+        pending = set()
+        removed: List[str] = []
+        errors = []
+        self.finalize_requested = False
+
+        snapshot = current_pricing()
+        if snapshot.version != self.pricing.version:
+            if snapshot.matrix_version != self.pricing.matrix_version:
+                pending.update(self.lines)
+            self.pricing = snapshot
+
+        for index, op in enumerate(ops):
+            try:
+                if self._apply(op, pending, removed) == "finalize":
+                    self.finalize_requested = True
+            except ValueError as e:
+                error = {"index": index, "detail": str(e)}
+                if isinstance(op, dict) and op.get("line") is not None:
+                    error["line"] = str(op["line"])
+                errors.append(error)
+
+        changed = {}
+        if pending:
+            lines = [line for line in self.lines if line in pending]
+            diamonds = [self.lines[line] for line in lines]
+            if len(diamonds) > BATCH_PRICING_THRESHOLD:
+                prices = calculate_diamond_prices(diamonds, self.pricing)
+            else:
+                prices = [calculate_diamond_price(diamond, self.pricing) for diamond in diamonds]
+            for line, price in zip(lines, prices):
+                self.total += price - self.prices.get(line, 0.0)
+                self.prices[line] = price
+                changed[line] = price
+        if not self.lines:
+            self.total = 0.0  # Drop accumulated float error
+
+        response = {
+            "type": "quote",
+            "changed": changed,
+            "removed": [line for line in removed if line not in self.lines],
+            "total_price": round(self.total, 2),
+            "count": len(self.lines),
+            "pricing_version": self.pricing.version,
+        }
+        if errors:
+            response["errors"] = errors
+        return response
+
+    async def finalize(self) -> dict:
+        """Audit the parcel as it stands, one DiamondPriceDB row per stone.
+
+        The parcel is emptied once its rows are queued.
+        """
+        if not self.lines:
+            raise ValueError("Nothing to finalize")
+        diamonds = list(self.lines.values())
+        key = quote_key(diamonds, self.pricing.matrix_version)
+        calculated_at = datetime.now(timezone.utc)
+        await price_audit_queue.submit([
+            {
+                "carat": diamond.carat,
+                "clarity": diamond.clarity,
+                "color": diamond.color,
+                "cut": diamond.cut,
+                "certification": diamond.certification,
+                "price": self.prices[line],
+                "calculated_by": self.session.staff_id,
+                "branch": self.session.branch,
+                "quote_key": key,
+                "pricing_version": self.pricing.version,
+                "timestamp": calculated_at,
+            }
+            for line, diamond in self.lines.items()
+        ])
+        finalized = {
+            "type": "finalized",
+            "quote_key": key,
+            "total_price": round(sum(self.prices.values()), 2),
+            "individual_prices": {line: self.prices[line] for line in self.lines},
+            "count": len(self.lines),
+            "pricing_version": self.pricing.version,
+            # Malaysia time, as /api/calculate-price reports it
+            "timestamp": datetime.now(timezone(timedelta(hours=8))).isoformat(),
+        }
+        self.lines.clear()
+        self.prices.clear()
+        self.total = 0.0
+        return finalized
+
+async def run_live_quote(websocket: WebSocket, session: StaffSession) -> None:
+    """Serve one accepted connection until the client goes away."""
+    quote = LiveQuote(session)
+    await websocket.send_json({
+        "type": "ready",
+        "staff_id": session.staff_id,
+        "pricing_version": quote.pricing.version,
+        "max_lines": quote.max_lines,
+    })
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid JSON: {str(e)}"})
+                continue
+            await websocket.send_json(quote.apply(message))
+            if not quote.finalize_requested:
+                continue
+            try:
+                # Sessions revoked since the handshake may not audit quotes
+                async with read_session() as db:
+                    await resolve_session(db, session.token)
+                await websocket.send_json(await quote.finalize())
+            except HTTPException as e:
+                await websocket.close(code=1008, reason=e.detail)
+                return
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
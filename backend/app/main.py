@@ -1,15 +1,28 @@
-from fastapi import FastAPI, Depends, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.requests import Request
-from sqlalchemy.orm import Session
-from .database import engine, Base, get_db  
+from . import config
+from .database import (
+    DB_PATH, async_engine, async_read_engine, dispose_engines, engine, read_engine
+)
 from .routes import router
-from .models import LoginLogDB, LogActivityRequest  # Updated import
+from .audit import AUDIT_QUEUES
+from .migrations import upgrade_schema
+from .auth import session_sweeper, token_cache
+from .quote_cache import quote_cache
+from .page_cache import page_cache
+from .pricing import pricing_reloader
+from .retention import retention_worker
+from .inventory import revaluation_runner
+from .metrics import MetricsMiddleware, instrument_pool, register_gauge, registry
+from .startup import configure_logging, startup_timer
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create FastAPI app
@@ -29,6 +42,59 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Request counts and sampled latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
+instrument_pool("write", engine.pool)
+instrument_pool("read", read_engine.pool)
+if async_engine is not None:
+    instrument_pool("async_write", async_engine.sync_engine.pool)
+    instrument_pool("async_read", async_read_engine.sync_engine.pool)
+
+register_gauge(
+    "write_behind_queue_depth", "Rows waiting in a write-behind queue",
+    lambda: {(queue.name,): queue.depth for queue in AUDIT_QUEUES}, ("queue",)
+)
+register_gauge(
+    "write_behind_flushed_rows", "Rows written by a write-behind queue",
+    lambda: {(queue.name,): queue.flushed_rows for queue in AUDIT_QUEUES}, ("queue",)
+)
+register_gauge(
+    "write_behind_dropped_rows", "Rows a write-behind queue gave up on after repeated failures",
+    lambda: {(queue.name,): queue.dropped_rows for queue in AUDIT_QUEUES}, ("queue",)
+)
+register_gauge(
+    "auth_token_cache", "Session token cache size and hit/miss totals",
+    lambda: {(key,): value for key, value in token_cache.stats().items()
+             if key in ("size", "hits", "misses", "evictions")},
+    ("stat",)
+)
+
+register_gauge(
+    "quote_cache", "Quote cache size and hit/miss/eviction totals",
+    lambda: {(key,): value for key, value in quote_cache.stats().items()
+             if key in ("size", "hits", "misses", "evictions")},
+    ("stat",)
+)
+
+register_gauge(
+    "page_cache", "Log and history page cache size and hit/miss/eviction totals",
+    lambda: {(key,): value for key, value in page_cache.stats().items()
+             if key in ("size", "hits", "misses", "evictions")},
+    ("stat",)
+)
+
+register_gauge(
+    "startup_phase_seconds", "Time this worker spent in each startup phase",
+    lambda: {(name,): seconds for name, seconds in startup_timer.phases.items()},
+    ("phase",)
+)
+
+register_gauge(
+    "pricing_table_version", "Pricing table version this worker is serving",
+    lambda: {(): pricing_reloader.stats()["version"]}
+)
+
 # Include the router with API prefix
 app.include_router(
     router,
@@ -36,6 +102,8 @@ app.include_router(
     tags=["diamonds", "login"]
 )
 
+startup_timer.record("import", time.perf_counter() - _import_started)
+
 # Health check endpoint
 @app.get("/", tags=["health"])
 async def root():
@@ -48,26 +116,10 @@ async def root():
         "version": "1.0.0"
     }
 
-# Log activity endpoint with improved error handling
-@app.post("/api/log-activity/", tags=["login"])
-async def log_activity(request: LogActivityRequest, db: Session = Depends(get_db)):
-    try:
-        log = LoginLogDB(
-            staff_id=request.staff_id,
-            branch=request.branch,
-            counter=request.counter,
-            success=request.success,
-            details=request.details
-        )
-        db.add(log)
-        db.commit()
-        db.refresh(log)
-        logger.info(f"Activity logged successfully for user {request.staff_id}")
-        return {"message": "Activity logged successfully"}
-    except Exception as e:
-        logger.error(f"Failed to log activity: {str(e)}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Failed to log activity")
+# Prometheus scrape endpoint
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 # Global Exception Handler with improved logging
 @app.exception_handler(Exception)
@@ -86,9 +138,21 @@ async def global_exception_handler(request: Request, exc: Exception):
 @app.on_event("startup")
 async def startup_event():
     logger.info("Application is starting...")
+    logger.info(f"Database file path: {DB_PATH}" + (" (async)" if async_engine is not None else ""))
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
+        with startup_timer.phase("schema"):
+            upgrade_schema(engine)
+        with startup_timer.phase("pricing"):
+            pricing_reloader.start()
+        with startup_timer.phase("queues"):
+            for queue in AUDIT_QUEUES:
+                queue.start()
+        if config.BACKGROUND_TASKS:
+            with startup_timer.phase("background"):
+                retention_worker.start()
+                session_sweeper.start()
+                revaluation_runner.start()
+        logger.info(startup_timer.summary())
     except Exception as e:
         logger.error(f"Failed to create database tables: {str(e)}")
         raise
@@ -98,7 +162,14 @@ async def startup_event():
 async def shutdown_event():
     logger.info("Shutting down application...")
     try:
-        await engine.dispose()
+        revaluation_runner.stop()
+        session_sweeper.stop()
+        retention_worker.stop()
+        # Flush queued audit rows before the connections go away
+        for queue in AUDIT_QUEUES:
+            queue.stop()
+        pricing_reloader.stop()
+        await dispose_engines()
         logger.info("Database connection closed successfully")
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}")
@@ -0,0 +1,260 @@
+import time
+import random
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import config
+
+# Minimal Prometheus text-format metrics. Counters are always updated;
+# latency histograms only for the sampled fraction of requests
+# (METRICS_SAMPLE_RATE) so the overhead on the hot path stays negligible.
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Dict[Tuple, float]],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.collect().items()
+        ]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        # The exposition format allows one HELP/TYPE block per family
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status")
+))
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "End-to-end request latency (sampled)", ("method", "route")
+))
+PHASE_LATENCY = registry.register(Histogram(
+    "app_phase_duration_seconds", "Time spent in hot-path phases (sampled)", ("phase",)
+))
+DB_POOL_CHECKOUTS = registry.register(Counter(
+    "db_pool_checkouts_total", "Connections checked out of the pool", ("engine",)
+))
+DB_POOL_WAITS = registry.register(Counter(
+    "db_pool_waits_total", "Checkouts that found no idle connection in the pool", ("engine",)
+))
+DB_POOL_WAIT_LATENCY = registry.register(Histogram(
+    "db_pool_wait_seconds", "Time to obtain a connection when none was idle", ("engine",)
+))
+WRITE_BEHIND_FLUSH_LATENCY = registry.register(Histogram(
+    "write_behind_flush_seconds", "Duration of write-behind bulk inserts", ("queue",)
+))
+
+# Pools passed to instrument_pool, by engine name
+_pools: Dict[str, object] = {}
+
+DB_POOL_CHECKED_OUT = registry.register(Gauge(
+    "db_pool_checked_out", "Connections currently checked out",
+    lambda: {(name,): pool.checkedout() for name, pool in list(_pools.items())}, ("engine",)
+))
+
+# Start time of the current request when it is sampled, None otherwise
+_request_started: ContextVar[Optional[float]] = ContextVar("request_started", default=None)
+_phase_totals: ContextVar[Optional[Dict[str, float]]] = ContextVar("phase_totals", default=None)
+
+def observe_phase(phase: str, seconds: float) -> None:
+    """Record a phase duration if the current request is sampled."""
+    totals = _phase_totals.get()
+    if totals is None:
+        return
+    totals[phase] = totals.get(phase, 0.0) + seconds
+    PHASE_LATENCY.observe(seconds, phase=phase)
+
+@contextmanager
+def timed(phase: str):
+    """Time a block as ``phase`` when the current request is sampled."""
+    if _phase_totals.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - started)
+
+def mark_handler_start() -> None:
+    """Record the time from request start to the route body as ``validation``.
+
+    This covers reading and validating the request body and resolving
+    dependencies, minus the separately timed auth phase.
+    """
+    started = _request_started.get()
+    if started is None:
+        return
+    totals = _phase_totals.get()
+    elapsed = time.perf_counter() - started - totals.get("auth", 0.0)
+    observe_phase("validation", max(elapsed, 0.0))
+
+def register_gauge(name: str, documentation: str, collect: Callable[[], Dict[Tuple, float]],
+                   labelnames: Iterable[str] = ()) -> None:
+    registry.register(Gauge(name, documentation, collect, labelnames))
+
+def instrument_pool(engine_name: str, pool) -> None:
+    """Count checkouts and time waits on an InstrumentedPool."""
+    from sqlalchemy import event
+
+    event.listen(pool, "checkout", lambda *args: DB_POOL_CHECKOUTS.inc(engine=engine_name))
+
+    def on_wait(seconds: float) -> None:
+        DB_POOL_WAITS.inc(engine=engine_name)
+        DB_POOL_WAIT_LATENCY.observe(seconds, engine=engine_name)
+
+    pool.wait_listeners.append(on_wait)
+    _pools[engine_name] = pool
+
+class MetricsMiddleware:
+    """ASGI middleware that counts requests and samples their latency."""
+
+    def __init__(self, app, sample_rate: float = config.METRICS_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        is_sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        started = time.perf_counter()
+        started_token = _request_started.set(started if is_sampled else None)
+        totals_token = _phase_totals.set({} if is_sampled else None)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            REQUESTS.inc(method=scope["method"], route=route_path, status=str(status["code"]))
+            if is_sampled:
+                REQUEST_LATENCY.observe(
+                    time.perf_counter() - started, method=scope["method"], route=route_path
+                )
+            _request_started.reset(started_token)
+            _phase_totals.reset(totals_token)
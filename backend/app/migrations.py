@@ -0,0 +1,141 @@
+import hashlib
+import logging
+from typing import Optional
+
+from sqlalchemy import inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from . import config
+from .database import Base, SessionLocal
+from .models import SchemaVersionDB
+from .analytics import ensure_price_rollups
+from .pricing import ensure_pricing_table
+from .auth import ensure_active_sessions
+
+logger = logging.getLogger(__name__)
+
+def create_missing_indexes(engine: Engine) -> None:
+    """Create indexes declared on models that an older database lacks.
+
+    ``Base.metadata.create_all`` only creates indexes together with their
+    table, so indexes added to an existing table need creating here.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                logger.info(f"Created index {index.name} on {table.name}")
+
+# Indexes of earlier schemas that are redundant or cost more to write than
+# they save
+RETIRED_INDEXES = {
+    "diamond_prices": [
+        "ix_diamond_prices_calculated_by",  # Prefix of ..._calculated_by_timestamp_id
+        "ix_diamond_prices_search_timestamp",
+        "ix_diamond_prices_search_staff",
+        "ix_diamond_prices_search_grades",
+    ],
+}
+
+def drop_retired_indexes(engine: Engine) -> None:
+    """Drop indexes an older database still maintains on every write."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table, names in RETIRED_INDEXES.items():
+            if table not in existing_tables:
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table)}
+            for name in names:
+                if name in existing:
+                    connection.exec_driver_sql(f'DROP INDEX "{name}"')
+                    logger.info(f"Dropped retired index {name} on {table}")
+
+def add_missing_columns(engine: Engine) -> None:
+    """Add nullable columns declared on models that an older table lacks."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(
+                        f"Cannot add NOT NULL column {table.name}.{column.name} automatically"
+                    )
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                )
+                logger.info(f"Added column {table.name}.{column.name}")
+
+_fingerprint: Optional[str] = None
+
+def schema_fingerprint(engine: Engine) -> str:
+    """Hash of every table, column and index the models declare."""
+    global _fingerprint
+    if _fingerprint is None:
+        parts = []
+        for table in Base.metadata.sorted_tables:
+            parts.append(f"table {table.name}")
+            for column in table.columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                parts.append(f"column {column.name} {column_type} {column.nullable} {column.primary_key}")
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                parts.append(f"index {index.name} {[column.name for column in index.columns]}")
+        _fingerprint = hashlib.sha256("\n".join(parts).encode()).hexdigest()
+    return _fingerprint
+
+def stored_fingerprint(engine: Engine) -> Optional[str]:
+    """Fingerprint recorded by the last upgrade, None on an older database."""
+    try:
+        with engine.connect() as connection:
+            return connection.scalar(
+                select(SchemaVersionDB.fingerprint).order_by(SchemaVersionDB.id.desc()).limit(1)
+            )
+    except OperationalError:
+        return None
+
+_upgraded = set()
+
+def upgrade_schema(engine: Engine) -> None:
+    """Bring an existing database up to the current models.
+
+    Runs once per process and database; workers forked by app.serve inherit
+    the supervisor's run instead of racing each other through it. With
+    SCHEMA_CHECK=version a database whose stored fingerprint matches the
+    models costs a single query instead of reflecting every table.
+    """
+    if str(engine.url) in _upgraded:
+        return
+    fingerprint = schema_fingerprint(engine)
+    if config.SCHEMA_CHECK == "version" and stored_fingerprint(engine) == fingerprint:
+        _upgraded.add(str(engine.url))
+        return
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    create_missing_indexes(engine)
+    drop_retired_indexes(engine)
+
+    db = SessionLocal()
+    try:
+        ensure_price_rollups(db)
+        ensure_pricing_table(db)
+        ensure_active_sessions(db)
+        db.add(SchemaVersionDB(fingerprint=fingerprint))
+        db.commit()
+    finally:
+        db.close()
+    _upgraded.add(str(engine.url))
+    logger.info(f"Schema upgraded to {fingerprint[:12]}")
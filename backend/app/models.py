@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean
+from sqlalchemy import (
+    Column, Integer, SmallInteger, Float, String, Text, DateTime, Boolean, Index, UniqueConstraint
+)
 from sqlalchemy.sql import func
 from datetime import datetime, timezone, timedelta  
-from typing import List, Optional
+from typing import Dict, List, Optional
 from .database import Base
 
 # SQLAlchemy Models
@@ -21,6 +23,13 @@ class LoginLogDB(Base):
     session_token = Column(String(255), unique=True, index=True)  
     logged_out = Column(Boolean, default=False)
 
+    # Keyset pagination on (timestamp, id), optionally filtered by staff or branch
+    __table_args__ = (
+        Index("ix_login_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_login_logs_staff_timestamp_id", "staff_id", "timestamp", "id"),
+        Index("ix_login_logs_branch_timestamp_id", "branch", "timestamp", "id"),
+    )
+
 class DiamondPriceDB(Base):
     __tablename__ = "diamond_prices"
     
@@ -31,9 +40,166 @@ class DiamondPriceDB(Base):
     cut = Column(String(20))  
     certification = Column(String(10))  
     price = Column(Float)
-    calculated_by = Column(String(50), index=True) 
+    calculated_by = Column(String(50))  # Indexed by ix_diamond_prices_calculated_by_timestamp_id
+    branch = Column(String(100))  # Branch of the session that priced the stone
+    quote_key = Column(String(64), index=True)  # Content hash of the parcel
+    pricing_version = Column(Integer)  # PricingTableDB version used for the price
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Keyset pagination on (timestamp, id), optionally filtered by staff.
+    # /calculation-history/search walks the same two indexes newest first and
+    # checks its other criteria against the table rows it passes. Every index
+    # here is written by each audited stone, so there are no wider ones
+    __table_args__ = (
+        Index("ix_diamond_prices_timestamp_id", "timestamp", "id"),
+        Index("ix_diamond_prices_calculated_by_timestamp_id", "calculated_by", "timestamp", "id"),
+    )
+
+class RequoteDB(Base):
+    """A repeat of an already priced parcel, served from the quote cache.
+
+    Points at the original DiamondPriceDB rows through ``quote_key`` instead
+    of duplicating one row per stone. Its stones still count in the rollups.
+    """
+    __tablename__ = "requotes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    quote_key = Column(String(64), nullable=False, index=True)
+    stone_count = Column(Integer, nullable=False)
+    total_price = Column(Float, nullable=False)
+    pricing_version = Column(Integer)  # PricingTableDB version of the cached prices
+    calculated_by = Column(String(50), index=True)
+    branch = Column(String(100))
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+class PriceRollupDB(Base):
+    """Incremental per-bucket totals of DiamondPriceDB rows.
+
+    One row per bucket, staff member, branch and grade combination, kept up
+    to date as audit rows are written. Buckets are in Malaysia time.
+    """
+    __tablename__ = "price_rollups"
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(5), nullable=False)  # "hour" or "day"
+    bucket = Column(String(16), nullable=False)  # "YYYY-MM-DD HH:00" or "YYYY-MM-DD"
+    calculated_by = Column(String(50), nullable=False, default="")
+    branch = Column(String(100), nullable=False, default="")
+    clarity = Column(String(10), nullable=False)
+    color = Column(String(5), nullable=False)
+    cut = Column(String(20), nullable=False)
+    certification = Column(String(10), nullable=False)
+    quote_count = Column(Integer, nullable=False, default=0)
+    carat_sum = Column(Float, nullable=False, default=0.0)
+    price_sum = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "bucket", "calculated_by", "branch",
+            "clarity", "color", "cut", "certification",
+            name="uq_price_rollups_key"
+        ),
+        Index("ix_price_rollups_branch", "granularity", "branch", "bucket"),
+        Index("ix_price_rollups_staff", "granularity", "calculated_by", "bucket"),
+    )
+
+class ActiveSessionDB(Base):
+    """A live session token. login_logs keeps the history; this table only
+    holds sessions that can still authenticate."""
+    __tablename__ = "active_sessions"
+
+    token = Column(String(255), primary_key=True)
+    staff_id = Column(String(50), nullable=False, index=True)
+    branch = Column(String(100))
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)  # UTC
+
+class CacheVersionDB(Base):
+    __tablename__ = "cache_versions"
+
+    name = Column(String(50), primary_key=True)  # e.g. "auth"
+    version = Column(Integer, nullable=False, default=0)
+
+class SchemaVersionDB(Base):
+    """One row per schema upgrade; startup compares the latest fingerprint
+    with the models instead of reflecting every table."""
+    __tablename__ = "schema_version"
+
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    upgraded_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchiveSegmentDB(Base):
+    """A batch of rows moved from a hot table into its monthly archive file."""
+    __tablename__ = "archive_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(50), nullable=False)
+    month = Column(String(7), nullable=False)  # YYYY-MM
+    row_count = Column(Integer, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_archive_segments_table_month", "table_name", "month"),
+    )
+
+class PricingTableDB(Base):
+    """A published pricing table. Rows are never updated; a rate change
+    publishes a new version."""
+    __tablename__ = "pricing_tables"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    base_price = Column(Float, nullable=False)
+    multipliers = Column(Text, nullable=False)  # JSON: axis -> grade -> multiplier
+    published_by = Column(String(50))
+    published_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class InventoryStoneDB(Base):
+    """A stone in stock. Grades are stored as the codes of the built-in
+    multiplier tables (see app.inventory), so revaluation never parses text."""
+    __tablename__ = "inventory_stones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sku = Column(String(64), unique=True)
+    branch = Column(String(100))
+    carat = Column(Float, nullable=False)
+    clarity_code = Column(SmallInteger, nullable=False)
+    color_code = Column(SmallInteger, nullable=False)
+    cut_code = Column(SmallInteger, nullable=False)
+    certification_code = Column(SmallInteger, nullable=False)
+    quantity = Column(Integer, nullable=False, default=1)
+    price = Column(Float)  # Per stone, under pricing_version
+    pricing_version = Column(Integer)  # Null until first valued
+    added_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_inventory_stones_pricing_version", "pricing_version"),
+    )
+
+class RevaluationJobDB(Base):
+    """A background repricing of the inventory to one pricing table version.
+    ``last_id`` is the checkpoint: stones are processed in id order and
+    each chunk commits together with the job's progress."""
+    __tablename__ = "revaluation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="pending", index=True)
+    pricing_version = Column(Integer, nullable=False)
+    mode = Column(String(20))  # full or incremental, decided when the job starts
+    plan = Column(Text)  # JSON, see app.inventory.plan_revaluation
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    repriced_value = Column(Float, nullable=False, default=0.0)
+    last_id = Column(Integer, nullable=False, default=0)
+    elapsed_seconds = Column(Float, nullable=False, default=0.0)  # Time spent running
+    requested_by = Column(String(50))
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    heartbeat_at = Column(DateTime(timezone=True))  # UTC, refreshed every chunk
+    finished_at = Column(DateTime(timezone=True))
+
 # Pydantic Models for Request/Response
 class Diamond(BaseModel):
     carat: float = Field(..., gt=0)
@@ -104,4 +270,55 @@ class LogActivityRequest(BaseModel):
 
     class Config:
         from_attributes = True  # ✅ Pydantic v2
-        
\ No newline at end of file
+        
+class PricingTableCreate(BaseModel):
+    base_price: float = Field(..., gt=0, description="Price of a one carat stone before multipliers")
+    clarity: Dict[str, float] = Field(..., description="Multiplier per clarity grade")
+    color: Dict[str, float] = Field(..., description="Multiplier per color grade")
+    cut: Dict[str, float] = Field(..., description="Multiplier per cut grade")
+    certification: Dict[str, float] = Field(..., description="Multiplier per certification lab")
+
+class PricingTableResponse(BaseModel):
+    version: int
+    base_price: float
+    clarity: Dict[str, float]
+    color: Dict[str, float]
+    cut: Dict[str, float]
+    certification: Dict[str, float]
+    published_by: Optional[str] = None
+    published_at: Optional[datetime] = None
+
+class SimulationScenario(PricingTableCreate):
+    name: Optional[str] = Field(None, max_length=100, description="Label in the results; \"scenario N\" when omitted")
+
+class SimulationRequest(BaseModel):
+    scenarios: List[SimulationScenario] = Field(..., min_length=1, max_length=16, description="Candidate pricing tables")
+    start: Optional[datetime] = Field(None, description="Only quotes from this time on; UTC unless an offset is given")
+    end: Optional[datetime] = Field(None, description="Only quotes up to this time; UTC unless an offset is given")
+    staff_id: Optional[List[str]] = Field(None, description="Only quotes by these staff members")
+
+class InventoryStoneCreate(Diamond):
+    sku: Optional[str] = Field(None, max_length=64, description="Stock keeping unit, unique when given")
+    branch: Optional[str] = Field(None, description="Branch holding the stone")
+
+class InventoryAddRequest(BaseModel):
+    stones: List[InventoryStoneCreate]
+
+class RevaluationRequest(BaseModel):
+    pricing_version: Optional[int] = Field(None, description="Table to value at; the newest when omitted")
+
+class RevaluationJobResponse(BaseModel):
+    id: int
+    status: str
+    pricing_version: int
+    mode: Optional[str] = None
+    total: int
+    processed: int
+    progress: float
+    stones_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    repriced_value: float
+    requested_by: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,148 @@
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, NamedTuple, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select
+from starlette.responses import Response
+
+from . import config
+from .models import CacheVersionDB
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Conditional GET for the polled /api/login-logs/ and /api/calculation-history/
+# pages. A page's validator is its table's highest id, which every insert
+# raises, with the table's cache version, which in-place updates (logouts
+# marking rows) and retention deletes bump. Both come from one indexed query.
+# A matching If-None-Match gets 304 without reading the page; otherwise the
+# encoded (and, when large, gzipped) page is kept per filter set and served
+# again until the validator moves.
+
+GZIP_LEVEL = 6
+
+class Page(NamedTuple):
+    etag: str
+    body: bytes
+    gzipped: Optional[bytes]  # Set when the body is at least GZIP_MINIMUM_SIZE
+    next_cursor: Optional[str]
+
+async def table_validator(db, model) -> str:
+    """Highest id and cache version of a table, as "<id>.<version>"."""
+    table = model.__tablename__
+    max_id, version = (await db.execute(select(
+        select(func.max(model.id)).scalar_subquery(),
+        select(CacheVersionDB.version).where(CacheVersionDB.name == table).scalar_subquery(),
+    ))).one()
+    return f"{max_id or 0}.{version or 0}"
+
+def page_etag(key: Tuple, validator: str) -> str:
+    """Weak ETag of one page: the same bytes may be sent gzipped or not."""
+    digest = hashlib.sha256(f"{key!r}|{validator}".encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+def encode_json(content) -> bytes:
+    """Encode like FastAPI's JSONResponse, with orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
+
+def page_headers(etag: str) -> dict:
+    # no-cache: clients keep the page but revalidate it on every poll
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=page_headers(etag))
+
+def page_response(page: Page, accept_encoding: Optional[str]) -> Response:
+    headers = page_headers(page.etag)
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    if page.gzipped is not None and "gzip" in (accept_encoding or ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(page.gzipped, media_type="application/json", headers=headers)
+    return Response(page.body, media_type="application/json", headers=headers)
+
+class PageCache:
+    """Bounded LRU cache of (table, filters...) -> the Page last served.
+
+    Entries are only served while their ETag is current. Inserts in this
+    process drop their table's entries right away; changes made by other
+    workers are caught by the validator.
+    """
+
+    def __init__(self, maxsize: int, gzip_minimum_size: int):
+        self.maxsize = maxsize
+        self.gzip_minimum_size = gzip_minimum_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[Hashable, ...], etag: str) -> Optional[Page]:
+        with self._lock:
+            page = self._entries.get(key)
+            if page is None or page.etag != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def store(self, key: Tuple[Hashable, ...], etag: str, rows: List[dict],
+              next_cursor: Optional[str]) -> Page:
+        """Encode rows as a page, cache it and return it."""
+        body = encode_json(rows)
+        gzipped = None
+        if len(body) >= self.gzip_minimum_size:
+            gzipped = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        page = Page(etag, body, gzipped, next_cursor)
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return page
+
+    def invalidate(self, table: str) -> None:
+        """Drop the cached pages of a table."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+page_cache = PageCache(
+    maxsize=config.PAGE_CACHE_SIZE,
+    gzip_minimum_size=config.GZIP_MINIMUM_SIZE,
+)
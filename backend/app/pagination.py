@@ -0,0 +1,105 @@
+import io
+import csv
+import json
+import base64
+import binascii
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Select, String, and_, or_, type_coerce
+
+from .database import ReadSessionLocal
+
+# Rows read from the database per round trip when streaming an export
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def raw_timestamp(column):
+    """Select a timestamp column as the text SQLite stores.
+
+    Cursors carry the stored text so comparisons match rows written with
+    and without fractional seconds exactly.
+    """
+    return type_coerce(column, String).label("cursor_timestamp")
+
+def encode_cursor(timestamp: str, row_id: int) -> str:
+    payload = f"{timestamp}|{row_id}".encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded).decode().rsplit("|", 1)
+        return timestamp, int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def apply_keyset(query: Select, timestamp_column, id_column, cursor: Optional[str]) -> Select:
+    """Order newest first on (timestamp, id) and skip past the cursor."""
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        stored = type_coerce(timestamp_column, String)
+        query = query.where(or_(
+            stored < timestamp,
+            and_(stored == timestamp, id_column < row_id)
+        ))
+    return query.order_by(timestamp_column.desc(), id_column.desc())
+
+def next_cursor(rows: Sequence, limit: int) -> Optional[str]:
+    """Cursor for the page after ``rows``, or None on the last page.
+
+    Rows must carry ``id`` and the ``cursor_timestamp`` label.
+    """
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor(last.cursor_timestamp, last.id)
+
+def iter_keyset_chunks(query: Select, timestamp_column, id_column) -> Iterator[List]:
+    """Yield successive pages of a keyset-ordered query.
+
+    ``query`` must select ``id`` and ``raw_timestamp(timestamp_column)``.
+    Iterate from a worker thread (StreamingResponse does so for plain
+    generators): each chunk runs in its own short-lived sync session so
+    that no read transaction spans the export.
+    """
+    cursor = None
+    while True:
+        db = ReadSessionLocal()
+        try:
+            page = apply_keyset(query, timestamp_column, id_column, cursor)
+            rows = db.execute(page.limit(EXPORT_CHUNK_SIZE)).all()
+        finally:
+            db.close()
+        if rows:
+            yield rows
+        cursor = next_cursor(rows, EXPORT_CHUNK_SIZE)
+        if cursor is None:
+            return
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def stream_export(chunks: Iterable[List], fields: List[str], fmt: str) -> Iterator[str]:
+    """Encode row chunks as NDJSON lines or CSV, one chunk at a time."""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            for row in rows:
+                writer.writerow([getattr(row, field) for field in fields])
+            yield buffer.getvalue()
+    else:
+        for rows in chunks:
+            yield "".join(
+                json.dumps({field: getattr(row, field) for field in fields}, default=_json_default) + "\n"
+                for row in rows
+            )
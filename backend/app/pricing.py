@@ -0,0 +1,184 @@
+import json
+import logging
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import config
+from .database import ReadSessionLocal
+from .models import PricingTableDB
+from .utils import (
+    DEFAULT_MULTIPLIERS, DEFAULT_PRICING_VERSION, BASE_PRICE, PRICING_AXES,
+    PricingSnapshot, build_pricing_snapshot, current_pricing, install_pricing
+)
+
+logger = logging.getLogger(__name__)
+
+# Pricing tables are immutable rows in pricing_tables. Every worker keeps the
+# newest one as a PricingSnapshot and a background thread swaps in newer
+# versions as they are published, so the pricing hot path never queries or
+# locks anything.
+
+def validate_multipliers(multipliers: Dict[str, Dict[str, float]]) -> None:
+    """Check a table prices exactly the grades requests can carry."""
+    for axis in PRICING_AXES:
+        grades = multipliers.get(axis) or {}
+        expected = set(DEFAULT_MULTIPLIERS[axis])
+        if set(grades) != expected:
+            missing = sorted(expected - set(grades))
+            unknown = sorted(set(grades) - expected)
+            raise ValueError(
+                f"{axis} multipliers must cover exactly {sorted(expected)}"
+                f" (missing {missing}, unknown {unknown})"
+            )
+        for grade, value in grades.items():
+            if not value > 0:
+                raise ValueError(f"{axis} multiplier for {grade} must be greater than 0")
+
+def snapshot_from_record(record: PricingTableDB) -> PricingSnapshot:
+    multipliers = json.loads(record.multipliers)
+    # Keep matrix indexes in the built-in grade order whatever the JSON order
+    ordered = {
+        axis: {grade: multipliers[axis][grade] for grade in DEFAULT_MULTIPLIERS[axis]}
+        for axis in PRICING_AXES
+    }
+    return build_pricing_snapshot(record.version, record.base_price, ordered)
+
+def describe_pricing_table(record: PricingTableDB) -> dict:
+    """Shape a PricingTableDB row as a PricingTableResponse."""
+    return dict(
+        version=record.version,
+        base_price=record.base_price,
+        published_by=record.published_by,
+        published_at=record.published_at,
+        **json.loads(record.multipliers),
+    )
+
+def ensure_pricing_table(db: Session) -> None:
+    """Publish the built-in table as the first version on a new database."""
+    if db.query(PricingTableDB.version).first() is not None:
+        return
+    db.add(PricingTableDB(
+        version=DEFAULT_PRICING_VERSION,
+        base_price=BASE_PRICE,
+        multipliers=json.dumps(DEFAULT_MULTIPLIERS),
+        published_by="system",
+    ))
+    db.commit()
+    logger.info(f"Published built-in pricing table as version {DEFAULT_PRICING_VERSION}")
+
+async def get_pricing_table(db, version: Optional[int] = None) -> Optional[PricingTableDB]:
+    """Return a pricing table by version, or the newest one."""
+    query = select(PricingTableDB)
+    if version is None:
+        query = query.order_by(PricingTableDB.version.desc()).limit(1)
+    else:
+        query = query.where(PricingTableDB.version == version)
+    result = await db.execute(query)
+    return result.scalars().first()
+
+async def publish_pricing_table(
+    db, base_price: float, multipliers: Dict[str, Dict[str, float]], published_by: str
+) -> PricingTableDB:
+    """Store a new pricing table version and make it current in this worker.
+
+    Raises ValueError for a table that does not cover the known grades.
+    Commits; other workers pick the version up within
+    PRICING_RELOAD_INTERVAL seconds.
+    """
+    validate_multipliers(multipliers)
+    latest = await db.scalar(select(func.max(PricingTableDB.version)))
+    record = PricingTableDB(
+        version=(latest or 0) + 1,
+        base_price=base_price,
+        multipliers=json.dumps({axis: multipliers[axis] for axis in PRICING_AXES}),
+        published_by=published_by,
+    )
+    db.add(record)
+    await db.commit()
+    await db.refresh(record)
+
+    pricing_reloader.install(snapshot_from_record(record))
+    logger.info(f"Pricing table version {record.version} published by {published_by}")
+    return record
+
+class PricingReloader:
+    """Background thread that swaps in newly published pricing tables."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()  # Serializes swaps, never taken by readers
+        self._loaded_version: Optional[int] = None
+
+        self.reloads = 0
+        self.failed_checks = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Load the newest table, then keep polling for new versions."""
+        self.check()
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pricing-reloader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def install(self, snapshot: PricingSnapshot) -> None:
+        """Make a snapshot current unless a newer version already is."""
+        with self._lock:
+            if self._loaded_version is not None and snapshot.version <= self._loaded_version:
+                return
+            install_pricing(snapshot)
+            self._loaded_version = snapshot.version
+            self.reloads += 1
+        logger.info(f"Pricing table version {snapshot.version} is now current")
+
+    def check(self) -> None:
+        """Install the newest published table if it is not current yet.
+
+        The poll is a primary-key max lookup; the full table is only read
+        and the snapshot only built when the version has moved.
+        """
+        db = ReadSessionLocal()
+        try:
+            latest = db.scalar(select(func.max(PricingTableDB.version)))
+            if latest is None or latest == self._loaded_version:
+                return
+            record = db.get(PricingTableDB, latest)
+        finally:
+            db.close()
+        self.install(snapshot_from_record(record))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.failed_checks += 1
+                logger.error(f"Pricing table reload failed: {str(e)}")
+
+    def stats(self) -> dict:
+        snapshot = current_pricing()
+        return {
+            "version": snapshot.version,
+            "matrix_version": snapshot.matrix_version,
+            "running": self.running,
+            "reloads": self.reloads,
+            "failed_checks": self.failed_checks,
+        }
+
+pricing_reloader = PricingReloader(interval=config.PRICING_RELOAD_INTERVAL)
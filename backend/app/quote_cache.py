@@ -0,0 +1,78 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from . import config
+from .models import Diamond, DiamondCalculationResponse
+
+def quote_key(diamonds: Sequence[Diamond], table_version: str) -> str:
+    """Content-addressed key of a parcel under a given price table.
+
+    Only the fields that affect the price are hashed, in parcel order, with
+    carats normalized to floats so "1" and "1.0" map to the same quote.
+    """
+    canonical = json.dumps(
+        [
+            (float(d.carat), d.clarity, d.color, d.cut, d.certification)
+            for d in diamonds
+        ],
+        separators=(",", ":"),
+    )
+    digest = hashlib.sha256(table_version.encode())
+    digest.update(canonical.encode())
+    return digest.hexdigest()
+
+class QuoteCache:
+    """Bounded LRU cache of quote key -> DiamondCalculationResponse."""
+
+    def __init__(self, maxsize: int, max_stones: int):
+        self.maxsize = maxsize
+        self.max_stones = max_stones
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[DiamondCalculationResponse]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def set(self, key: str, response: DiamondCalculationResponse) -> None:
+        if len(response.individual_prices) > self.max_stones:
+            return
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+quote_cache = QuoteCache(
+    maxsize=config.QUOTE_CACHE_SIZE,
+    max_stones=config.QUOTE_CACHE_MAX_STONES,
+)
@@ -0,0 +1,362 @@
+"""Retention and archival for the append-only tables.
+
+Rows older than RETENTION_DAYS are appended to gzip NDJSON files, one per
+table and month (``<archive>/<table>/<YYYY-MM>.ndjson.gz``), then deleted
+from SQLite in batches of RETENTION_BATCH_SIZE so no write transaction is
+long. Freed pages are returned to the filesystem with an incremental vacuum.
+Price rollups are left untouched, so analytics still cover archived months.
+
+Each table is handled in the time its timestamps are stored in: login_logs
+in Malaysia time (UTC+8), diamond_prices and requotes in UTC. The cutoff is
+shifted to match, and a row's month is the month of its stored timestamp.
+
+Run from the backend directory:
+
+    python -m app.retention                  # archive everything past retention
+    python -m app.retention --days 90 --table login_logs
+    python -m app.retention --convert-vacuum # one-off, for pre-existing databases
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import zlib
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import String, delete, func, or_, select, type_coerce
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import config
+from .database import DB_FOLDER, ReadSessionLocal, SessionLocal, engine
+from .models import ArchiveSegmentDB, DiamondPriceDB, LoginLogDB, RequoteDB
+from .pagination import EXPORT_CHUNK_SIZE
+from .startup import configure_logging
+from .tasks import PeriodicTask
+from .versions import version_bump
+
+logger = logging.getLogger(__name__)
+
+RETENTION_TABLES = {
+    "login_logs": LoginLogDB,
+    "diamond_prices": DiamondPriceDB,
+    "requotes": RequoteDB,
+}
+
+# Offset from UTC of the timestamps each table stores (login rows are
+# written with get_malaysia_time)
+TIMESTAMP_OFFSETS = {
+    "login_logs": timedelta(hours=8),
+    "diamond_prices": timedelta(0),
+    "requotes": timedelta(0),
+}
+
+MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+# zlib window bits for reading gzip members one at a time
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+def archive_root() -> str:
+    return config.ARCHIVE_PATH or os.path.join(DB_FOLDER, "archive")
+
+def archive_file(table: str, month: str) -> str:
+    if table not in RETENTION_TABLES or not MONTH_PATTERN.match(month):
+        raise ValueError(f"No archive for {table} {month}")
+    return os.path.join(archive_root(), table, f"{month}.ndjson.gz")
+
+def archive_fields(table: str) -> List[str]:
+    return [column.name for column in RETENTION_TABLES[table].__table__.columns]
+
+def _archivable(model, cutoff: datetime):
+    """Conditions for expired rows, given a naive UTC cutoff."""
+    conditions = [model.timestamp < cutoff + TIMESTAMP_OFFSETS[model.__tablename__]]
+    if model is LoginLogDB:
+        # Rows that back a live session stay until the session ends
+        conditions.append(or_(LoginLogDB.session_token.is_(None), LoginLogDB.logged_out.is_(True)))
+    return conditions
+
+# End of the last complete member of each archive file this process has
+# appended to, so a file is only scanned when someone else changed it
+_archive_ends: Dict[str, int] = {}
+
+def append_archive(table: str, month: str, rows: Sequence[dict]) -> None:
+    """Append rows to a monthly archive as a new gzip member and fsync it.
+
+    A member left half-written by a crash is cut off first; appending after
+    it would make the next member unreadable.
+    """
+    path = archive_file(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = _archive_ends.get(path)
+        if end != size:
+            end = complete_length(path)
+        if end < size:
+            logger.warning(f"Truncating an incomplete batch at the end of {path}")
+            f.truncate(end)
+        with gzip.GzipFile(fileobj=f, mode="wb") as archive:
+            archive.write("".join(json.dumps(row) + "\n" for row in rows).encode())
+        f.flush()
+        os.fsync(f.fileno())
+        _archive_ends[path] = f.tell()
+
+def archive_batch(db: Session, table: str, cutoff: datetime, batch_size: int) -> int:
+    """Move the oldest batch of expired rows of a table into the archive.
+
+    ``cutoff`` is naive UTC. Files are written and synced before the delete
+    commits, so a crash in between can only leave rows in both places. The
+    next batch then starts with the same rows, so readers skip ids that
+    repeat the member before. Returns the number of rows archived.
+    """
+    model = RETENTION_TABLES[table]
+    columns = [
+        # Timestamps are archived exactly as SQLite stores them
+        type_coerce(column, String).label(column.name) if column.name == "timestamp" else column
+        for column in model.__table__.columns
+    ]
+    rows = db.execute(
+        select(*columns)
+        .where(*_archivable(model, cutoff))
+        .order_by(model.timestamp, model.id)
+        .limit(batch_size)
+    ).mappings().all()
+    if not rows:
+        return 0
+
+    by_month: Dict[str, List[dict]] = defaultdict(list)
+    for row in rows:
+        by_month[row["timestamp"][:7]].append(dict(row))
+    for month, month_rows in by_month.items():
+        append_archive(table, month, month_rows)
+        ids = [row["id"] for row in month_rows]
+        db.add(ArchiveSegmentDB(
+            table_name=table, month=month, row_count=len(month_rows),
+            first_id=min(ids), last_id=max(ids),
+        ))
+    db.execute(delete(model).where(model.id.in_([row["id"] for row in rows])))
+    # Cached pages of the table may include the deleted rows
+    db.execute(version_bump(table))
+    db.commit()
+    return len(rows)
+
+def count_expired(table: str, cutoff: datetime) -> int:
+    model = RETENTION_TABLES[table]
+    db = ReadSessionLocal()
+    try:
+        return db.scalar(select(func.count()).select_from(model).where(*_archivable(model, cutoff)))
+    finally:
+        db.close()
+
+def incremental_vacuum(bind: Engine = engine, pages: Optional[int] = None) -> bool:
+    """Release free pages and truncate the WAL. False if auto_vacuum is off."""
+    pages = config.RETENTION_VACUUM_PAGES if pages is None else pages
+    connection = bind.raw_connection()
+    try:
+        sqlite = connection.driver_connection
+        if sqlite.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning(
+                "auto_vacuum is not INCREMENTAL; run 'python -m app.retention --convert-vacuum'"
+                " once to enable it"
+            )
+            return False
+        # execute() steps the pragma once, freeing a single page;
+        # executescript() runs it to completion
+        sqlite.executescript(
+            f"PRAGMA incremental_vacuum({int(pages)}); PRAGMA wal_checkpoint(TRUNCATE);"
+        )
+    finally:
+        connection.close()
+    return True
+
+def convert_to_incremental_vacuum(bind: Engine = engine) -> None:
+    """Switch an existing database to incremental auto_vacuum.
+
+    Needs a full VACUUM, which rewrites the file and blocks writers, so it
+    is only run on request.
+    """
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+    logger.info("Database converted to incremental auto_vacuum")
+
+def run_retention(
+    days: Optional[int] = None,
+    tables: Optional[Sequence[str]] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, int]:
+    """Archive and delete expired rows, then vacuum. Returns rows per table."""
+    days = config.RETENTION_DAYS if days is None else days
+    batch_size = batch_size or config.RETENTION_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+
+    archived = {}
+    for table in tables or RETENTION_TABLES:
+        archived[table] = 0
+        while True:
+            # A short session per batch keeps each write transaction small
+            db = SessionLocal()
+            try:
+                moved = archive_batch(db, table, cutoff, batch_size)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            archived[table] += moved
+            if moved < batch_size:
+                break
+        if archived[table]:
+            logger.info(f"Archived {archived[table]} rows from {table} older than {cutoff} UTC")
+
+    if any(archived.values()):
+        incremental_vacuum()
+    return archived
+
+async def list_archive_months(db, table: str) -> List[dict]:
+    result = await db.execute(
+        select(
+            ArchiveSegmentDB.month,
+            func.sum(ArchiveSegmentDB.row_count).label("row_count"),
+            func.max(ArchiveSegmentDB.archived_at).label("archived_at"),
+        )
+        .where(ArchiveSegmentDB.table_name == table)
+        .group_by(ArchiveSegmentDB.month)
+        .order_by(ArchiveSegmentDB.month.desc())
+    )
+    return [
+        {"month": row.month, "row_count": row.row_count, "archived_at": row.archived_at}
+        for row in result
+    ]
+
+def _read_member(f, start: int):
+    """Decompress the gzip member at ``start``.
+
+    Returns its data and the offset just past it, or (None, None) when the
+    member is cut short or corrupt.
+    """
+    f.seek(start)
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    data, consumed = [], 0
+    try:
+        while not decompressor.eof:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                return None, None
+            data.append(decompressor.decompress(chunk))
+            consumed += len(chunk)
+    except zlib.error:
+        return None, None
+    return b"".join(data), start + consumed - len(decompressor.unused_data)
+
+def _next_header(f, start: int) -> Optional[int]:
+    """Offset of the next gzip member header at or after ``start``."""
+    magic = b"\x1f\x8b\x08"
+    f.seek(start)
+    position, tail = start, b""
+    while True:
+        chunk = f.read(1 << 16)
+        if not chunk:
+            return None
+        found = (tail + chunk).find(magic)
+        if found >= 0:
+            return position - len(tail) + found
+        tail = chunk[-(len(magic) - 1):]
+        position += len(chunk)
+
+def _scan_members(path: str) -> Iterator[Tuple[bytes, int]]:
+    """Yield (data, end offset) for each readable member of an archive file.
+
+    After a member that can't be read, reading resumes at the next gzip
+    header, so a batch cut short by a crash only loses itself.
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        offset = 0
+        while offset < size:
+            data, end = _read_member(f, offset)
+            if data is not None:
+                yield data, end
+                offset = end
+                continue
+            resume = _next_header(f, offset + 1)
+            logger.warning(f"Skipped an incomplete batch at byte {offset} of {path}")
+            if resume is None:
+                return
+            offset = resume
+
+def complete_length(path: str) -> int:
+    """Length of an archive file up to the end of its last readable member."""
+    end = 0
+    for _, end in _scan_members(path):
+        pass
+    return end
+
+def iter_members(path: str) -> Iterator[List[dict]]:
+    """Yield the rows of each gzip member of an archive file in turn.
+
+    Every member is one archived batch. A member cut short by a crash while
+    it was being appended is skipped: its rows were never deleted.
+    """
+    for data, _ in _scan_members(path):
+        yield [json.loads(line) for line in data.splitlines() if line.strip()]
+
+def iter_archive(table: str, month: str) -> Iterator[List[SimpleNamespace]]:
+    """Yield chunks of archived rows of one month, oldest first.
+
+    Duplicates left by an interrupted batch can only repeat the batch just
+    before, so ids are only checked against that one; memory stays bounded
+    by the batch size. Meant for stream_export, so it is a plain generator
+    that StreamingResponse iterates in a worker thread.
+    """
+    previous = set()
+    chunk = []
+    for rows in iter_members(archive_file(table, month)):
+        for row in rows:
+            if row["id"] not in previous:
+                chunk.append(SimpleNamespace(**row))
+                if len(chunk) >= EXPORT_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+        previous = {row["id"] for row in rows}
+    if chunk:
+        yield chunk
+
+# Runs retention every RETENTION_INTERVAL seconds when enabled
+retention_worker = PeriodicTask("retention", config.RETENTION_INTERVAL, run_retention)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Archive and delete expired rows")
+    parser.add_argument("--days", type=int, default=config.RETENTION_DAYS)
+    parser.add_argument("--table", action="append", choices=list(RETENTION_TABLES))
+    parser.add_argument("--batch-size", type=int, default=config.RETENTION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Only count expired rows")
+    parser.add_argument(
+        "--convert-vacuum", action="store_true",
+        help="Enable incremental auto_vacuum on an existing database (runs a full VACUUM)"
+    )
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from .migrations import upgrade_schema
+    upgrade_schema(engine)
+
+    if args.convert_vacuum:
+        convert_to_incremental_vacuum()
+    if args.dry_run:
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days)
+        for table in args.table or RETENTION_TABLES:
+            print(f"{table}: {count_expired(table, cutoff)} rows older than {cutoff} UTC")
+        return 0
+    for table, rows in run_retention(args.days, args.table, args.batch_size).items():
+        print(f"{table}: archived {rows} rows")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
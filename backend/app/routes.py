@@ -1,16 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, Request,Header
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Header, Response, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional, Union
 from datetime import datetime, timezone, timedelta
-import secrets
-from .database import get_db
+import os
+from .database import DBSession, get_db, get_read_db, read_session
 from .models import (
     Diamond, DiamondCalculationRequest, DiamondCalculationResponse,
     LoginLogCreate, LoginLogResponse, LoginLogDB, DiamondPriceDB,
-    LoginRequest, LoginResponse, LogActivityRequest  # Add LogActivityRequest here
+    LoginRequest, LoginResponse, LogActivityRequest,
+    PricingTableCreate, PricingTableResponse, InventoryAddRequest, RevaluationJobDB,
+    RevaluationJobResponse, RevaluationRequest, SimulationRequest
+)
+from .utils import (
+    BATCH_PRICING_THRESHOLD, calculate_diamond_price, calculate_diamond_prices,
+    current_pricing, get_price_matrix
+)
+from .pricing import (
+    describe_pricing_table, get_pricing_table, pricing_reloader, publish_pricing_table
+)
+from .inventory import (
+    add_stones, cancel_job, create_revaluation_job, describe_job, inventory_summary
+)
+from .quote_cache import quote_cache, quote_key
+from .search import SEARCH_SORTS, search_prices
+from .retention import (
+    RETENTION_TABLES, archive_fields, archive_file, iter_archive, list_archive_months
+)
+from .fastpath import read_diamonds, render_response, request_body_openapi
+from .page_cache import (
+    etag_matches, not_modified, page_cache, page_etag, page_response, table_validator
+)
+from .history import HISTORY_FIELDS, HistoryFilters, check_filters, search_query
+from .live_quotes import accepted_protocol, run_live_quote, websocket_credentials
+from .simulation import build_scenarios, simulate, simulation_slots
+from .bulk import BULK_MEDIA_TYPE, BodyStreamingResponse, bulk_format, stream_bulk_prices
+from .auth import (
+    StaffSession, create_session, get_current_session, get_current_user, parse_api_key,
+    require_pricing_admin, resolve_session, revoke_session, revoke_staff_sessions, token_cache
+)
+from .analytics import BUCKET_FORMATS, GROUP_COLUMNS, grade_totals, query_rollups
+from .audit import AUDIT_QUEUES, activity_log_queue, price_audit_queue, requote_queue
+from .metrics import mark_handler_start, timed
+from .pagination import (
+    EXPORT_MEDIA_TYPES, apply_keyset, iter_keyset_chunks, next_cursor,
+    raw_timestamp, stream_export
 )
-from .utils import calculate_diamond_price
-from .auth import get_current_user
 
 # Add after imports, before routes
 
@@ -18,45 +55,18 @@ def get_malaysia_time():
     """Get current time in Malaysia timezone (UTC+8)"""
     return datetime.now(timezone(timedelta(hours=8)))
 
-async def verify_api_key(authorization: Optional[str] = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="API key is missing")
-    
-    try:
-        scheme, api_key = authorization.split()
-        if scheme.lower() != 'bearer':
-            raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-        
-        # Create a database session
-        db = next(get_db())
-        try:
-            # Verify the API key exists in the database and is not logged out
-            log = db.query(LoginLogDB).filter(
-                LoginLogDB.session_token == api_key,
-                LoginLogDB.logged_out.is_(False)
-            ).first()
-            
-            if not log:
-                raise HTTPException(status_code=401, detail="Invalid or expired API key")
-            
-            return log.staff_id
-        finally:
-            db.close()
-            
-    except ValueError:
-        raise HTTPException(status_code=401, detail="Invalid authorization header format")
-
 router = APIRouter()
 
 @router.post("/login", response_model=LoginResponse)
 async def login(
     login_data: LoginRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_db)
 ):
     """Login and return an API key"""
     try:
-        session_token = secrets.token_urlsafe(32)
+        # The active session row is what auth reads; the log row is history
+        session_token = create_session(db, login_data.staff_id, login_data.branch)
         
         # Create login log with session token
         db_log = LoginLogDB(
@@ -71,7 +81,8 @@ async def login(
             details="Successful login"
         )
         db.add(db_log)
-        db.commit()
+        await db.commit()
+        page_cache.invalidate(LoginLogDB.__tablename__)
         
         return LoginResponse(
             api_key=session_token,
@@ -79,39 +90,48 @@ async def login(
             message="Login successful"
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to log login: {str(e)}")
 
 @router.post("/logout")
 async def logout(
-    current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    all_sessions: bool = Query(True, description="Log out every session of the staff member, not just this one"),
+    session: StaffSession = Depends(get_current_session),
+    db: DBSession = Depends(get_db)
 ):
     """Logout and invalidate session"""
-    result = db.query(LoginLogDB).filter(
-        LoginLogDB.staff_id == current_user,
-        LoginLogDB.logged_out.is_(False)
-    ).update({"logged_out": True})
-    
-    db.commit()
+    if all_sessions:
+        result = await revoke_staff_sessions(db, session.staff_id)
+    else:
+        result = await revoke_session(db, session.token)
     if result == 0:
         raise HTTPException(status_code=404, detail="No active sessions found")
     
     return {"message": "Logged out successfully"}
 
-@router.post("/calculate-price", response_model=DiamondCalculationResponse)
+@router.post(
+    "/calculate-price",
+    response_model=DiamondCalculationResponse,
+    openapi_extra=request_body_openapi(DiamondCalculationRequest)
+)
 async def calculate_price(
-    request: DiamondCalculationRequest,
-    staff_id: str = Depends(verify_api_key),
-    db: Session = Depends(get_db)
+    http_request: Request,
+    session: StaffSession = Depends(get_current_session)
 ):
-    """Calculate diamond prices"""
+    """Calculate diamond prices
+
+    The body is a DiamondCalculationRequest. Send ``Accept: application/msgpack``
+    for a MessagePack response when msgpack is installed.
+    """
+    # One snapshot for the whole request, even if a new table is swapped in
+    pricing = current_pricing()
+    diamonds = await read_diamonds(http_request, pricing)
+    mark_handler_start()
     try:
-        request.staff_id = staff_id
-        individual_prices = []
+        staff_id = session.staff_id
         
         # Add validation before calculation
-        for i, diamond in enumerate(request.diamonds):
+        for i, diamond in enumerate(diamonds):
             if float(diamond.carat) <= 0:
                 raise HTTPException(
                     status_code=422,
@@ -122,41 +142,319 @@ async def calculate_price(
                     status_code=422,
                     detail=f"Diamond {i+1}: Quantity must be greater than 0"
                 )
-            
-            price = calculate_diamond_price(diamond)
-            individual_prices.append(price)
-
-            db_record = DiamondPriceDB(
-                carat=diamond.carat,
-                clarity=diamond.clarity,
-                color=diamond.color,
-                cut=diamond.cut,
-                certification=diamond.certification,
-                price=price,
-                calculated_by=staff_id
-            )
-            db.add(db_record)
-
-        db.commit()
+
+        # A parcel already priced under the current table is served from the
+        # quote cache and audited with a single reference row
+        key = quote_key(diamonds, pricing.matrix_version)
+        cached = quote_cache.get(key)
+        if cached is not None:
+            with timed("audit"):
+                await requote_queue.submit([{
+                    "quote_key": key,
+                    "stone_count": len(diamonds),
+                    "total_price": cached.total_price,
+                    "calculated_by": staff_id,
+                    "branch": session.branch,
+                    "pricing_version": pricing.version,
+                    "timestamp": datetime.now(timezone.utc),
+                    "stones": grade_totals(diamonds, cached.individual_prices),
+                }])
+            response = cached.model_copy(update={"timestamp": get_malaysia_time()})
+            return render_response(response.model_dump(), http_request.headers.get("accept"))
+
+        with timed("pricing"):
+            if len(diamonds) > BATCH_PRICING_THRESHOLD:
+                individual_prices = calculate_diamond_prices(diamonds, pricing)
+            else:
+                individual_prices = [
+                    calculate_diamond_price(diamond, pricing) for diamond in diamonds
+                ]
+
+        # Audit rows go through the write-behind queue instead of a commit here
+        with timed("audit"):
+            calculated_at = datetime.now(timezone.utc)
+            await price_audit_queue.submit([
+                {
+                    "carat": diamond.carat,
+                    "clarity": diamond.clarity,
+                    "color": diamond.color,
+                    "cut": diamond.cut,
+                    "certification": diamond.certification,
+                    "price": price,
+                    "calculated_by": staff_id,
+                    "branch": session.branch,
+                    "quote_key": key,
+                    "pricing_version": pricing.version,
+                    "timestamp": calculated_at,
+                }
+                for diamond, price in zip(diamonds, individual_prices)
+            ])
         
-        return DiamondCalculationResponse(
+        response = DiamondCalculationResponse(
             total_price=round(sum(individual_prices), 2),
             individual_prices=[round(price, 2) for price in individual_prices],
             timestamp=get_malaysia_time()  
         )
+        quote_cache.set(key, response)
+        return render_response(response.model_dump(), http_request.headers.get("accept"))
 
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Calculation error: {str(e)}")
 
+@router.post("/calculate-price/stream")
+async def calculate_price_stream(
+    request: Request,
+    session: StaffSession = Depends(get_current_session)
+):
+    """Price a stream of NDJSON or CSV stone records, streaming NDJSON results
+
+    Send one stone per line (``Content-Type: application/x-ndjson``) or a CSV
+    with a header row (``Content-Type: text/csv``) using the Diamond fields.
+    """
+    fmt = bulk_format(request.headers.get("content-type"))
+    return BodyStreamingResponse(
+        stream_bulk_prices(request, fmt, session, current_pricing()),
+        media_type=BULK_MEDIA_TYPE
+    )
+
+@router.websocket("/live-quotes")
+async def live_quotes(websocket: WebSocket):
+    """Keep a working parcel on the server and price edits as deltas
+
+    Authenticates once, from the Authorization header or a "bearer.<token>"
+    subprotocol. See app.live_quotes for the message protocol.
+    """
+    try:
+        token = parse_api_key(websocket_credentials(websocket))
+        async with read_session() as db:
+            session = await resolve_session(db, token)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept(subprotocol=accepted_protocol(websocket))
+    await run_live_quote(websocket, session)
+
+@router.get("/price-matrix")
+async def price_matrix(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    staff_id: str = Depends(get_current_user)
+):
+    """Return the per-carat price for every grade combination"""
+    matrix = get_price_matrix()
+    etag = f'"{matrix["version"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return matrix
+
+@router.get("/price-search")
+async def price_search(
+    budget: float = Query(..., gt=0, description="Maximum price in RM"),
+    carat_min: float = Query(..., gt=0),
+    carat_max: Optional[float] = Query(None, gt=0),
+    clarity: Optional[List[str]] = Query(None),
+    color: Optional[List[str]] = Query(None),
+    cut: Optional[List[str]] = Query(None),
+    certification: Optional[List[str]] = Query(None),
+    sort: str = "best_grade",
+    limit: int = Query(20, ge=1, le=200),
+    current_user: str = Depends(get_current_user)
+):
+    """Find the grade combinations a budget buys within a carat range"""
+    carat_max = carat_max or carat_min
+    if carat_max < carat_min:
+        raise HTTPException(status_code=422, detail="carat_max must not be less than carat_min")
+    if sort not in SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+    try:
+        return search_prices(
+            current_pricing(),
+            budget=budget,
+            carat_min=carat_min,
+            carat_max=carat_max,
+            grades={"clarity": clarity, "color": color, "cut": cut, "certification": certification},
+            sort=sort,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/pricing-tables/current", response_model=PricingTableResponse)
+async def current_pricing_table(
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Return the newest published pricing table"""
+    record = await get_pricing_table(db)
+    if record is None:
+        raise HTTPException(status_code=404, detail="No pricing table published")
+    return describe_pricing_table(record)
+
+@router.post("/pricing-tables/simulate")
+async def simulate_pricing_tables(
+    request: SimulationRequest,
+    current_user: str = Depends(require_pricing_admin)
+):
+    """Reprice past quotes under candidate pricing tables without publishing them
+
+    Returns, per scenario, the quoted and repriced totals overall, per branch
+    and per staff member, and the distribution of per-stone price changes.
+    """
+    filters = HistoryFilters(start=request.start, end=request.end, staff_id=request.staff_id)
+    try:
+        check_filters(filters)
+        scenarios = build_scenarios([scenario.model_dump() for scenario in request.scenarios])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not simulation_slots.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Too many simulations running, retry later")
+    try:
+        return await run_in_threadpool(simulate, scenarios, filters)
+    finally:
+        simulation_slots.release()
+
+@router.get("/pricing-tables/status")
+async def pricing_table_status(current_user: str = Depends(get_current_user)):
+    """Report the pricing table version this worker is serving"""
+    return pricing_reloader.stats()
+
+@router.get("/pricing-tables/{version}", response_model=PricingTableResponse)
+async def pricing_table(
+    version: int,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Return a published pricing table by version"""
+    record = await get_pricing_table(db, version)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Pricing table version {version} not found")
+    return describe_pricing_table(record)
+
+@router.post("/pricing-tables", response_model=PricingTableResponse, status_code=201)
+async def publish_pricing(
+    table: PricingTableCreate,
+    current_user: str = Depends(require_pricing_admin),
+    db: DBSession = Depends(get_db)
+):
+    """Publish a new pricing table version; workers switch to it without a restart"""
+    try:
+        record = await publish_pricing_table(
+            db,
+            base_price=table.base_price,
+            multipliers=table.model_dump(include={"clarity", "color", "cut", "certification"}),
+            published_by=current_user,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409, detail="Another pricing table was published at the same time, retry"
+        )
+    return describe_pricing_table(record)
+
+@router.post("/inventory", status_code=201)
+async def add_inventory(
+    request: InventoryAddRequest,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_db)
+):
+    """Add stones to the stored inventory, valued at the current pricing table"""
+    try:
+        return await add_stones(db, request.stones, current_pricing())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="A stone with one of these SKUs already exists")
+
+@router.get("/inventory/summary")
+async def get_inventory_summary(
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Stone count and value of the inventory, per pricing table version"""
+    return await inventory_summary(db)
+
+@router.post("/inventory/revaluations", response_model=RevaluationJobResponse, status_code=202)
+async def start_revaluation(
+    request: RevaluationRequest,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_db)
+):
+    """Queue a background revaluation of the inventory
+
+    Only stones whose grades use a multiplier that changed since they were
+    last priced are repriced. Poll the returned job for progress.
+    """
+    record = await get_pricing_table(db, request.pricing_version)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Pricing table version {request.pricing_version} not found")
+    job = await db.run_sync(create_revaluation_job, record.version, current_user)
+    return describe_job(job)
+
+@router.get("/inventory/revaluations", response_model=List[RevaluationJobResponse])
+async def list_revaluations(
+    limit: int = Query(20, ge=1, le=200),
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Recent revaluation jobs, newest first"""
+    result = await db.execute(
+        select(RevaluationJobDB).order_by(RevaluationJobDB.id.desc()).limit(limit)
+    )
+    return [describe_job(job) for job in result.scalars().all()]
+
+@router.get("/inventory/revaluations/{job_id}", response_model=RevaluationJobResponse)
+async def get_revaluation(
+    job_id: int,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Progress and throughput of a revaluation job"""
+    result = await db.execute(select(RevaluationJobDB).where(RevaluationJobDB.id == job_id))
+    job = result.scalars().first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Revaluation job not found")
+    return describe_job(job)
+
+@router.post("/inventory/revaluations/{job_id}/cancel")
+async def cancel_revaluation(
+    job_id: int,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_db)
+):
+    """Stop a queued or running job; chunks already committed keep their prices"""
+    if not await db.run_sync(cancel_job, job_id):
+        raise HTTPException(status_code=404, detail="No active revaluation job with this id")
+    return {"message": "Revaluation job cancelled"}
+
+@router.get("/audit/metrics")
+async def audit_metrics(current_user: str = Depends(get_current_user)):
+    """Report write-behind queue depth and flush statistics"""
+    return {queue.name: queue.metrics() for queue in AUDIT_QUEUES}
+
+@router.get("/auth/cache-stats")
+async def auth_cache_stats(current_user: str = Depends(get_current_user)):
+    """Report session token cache statistics"""
+    return token_cache.stats()
+
+@router.get("/quote-cache/stats")
+async def quote_cache_stats(current_user: str = Depends(get_current_user)):
+    """Report quote cache hit/miss/eviction statistics"""
+    return quote_cache.stats()
+
 # 🔹 Create a login log
 @router.post("/login-log")
 async def create_login_log(
     log_data: LoginLogCreate,
     request: Request,
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_db)
 ):
     """Log login attempts"""
     if not log_data.staff_id or not log_data.branch:
@@ -175,55 +473,195 @@ async def create_login_log(
             logged_out=log_data.logged_out
         )
         db.add(db_log)
-        db.commit()
+        await db.commit()
+        page_cache.invalidate(LoginLogDB.__tablename__)
         return {"message": "Login activity logged successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to log activity: {str(e)}")
 
+LOGIN_LOG_FIELDS = [
+    "id", "staff_id", "branch", "counter", "success", "details", "timestamp",
+    "ip_address", "user_agent", "session_token", "logged_out"
+]
+
+def _login_log_query(staff_id: Optional[str], branch: Optional[str]):
+    query = select(
+        *[getattr(LoginLogDB, field) for field in LOGIN_LOG_FIELDS],
+        raw_timestamp(LoginLogDB.timestamp)
+    )
+    if staff_id:
+        query = query.where(LoginLogDB.staff_id == staff_id)
+    if branch:
+        query = query.where(LoginLogDB.branch == branch)
+    return query
+
+def _history_query(staff_id: Optional[str]):
+    query = select(
+        *[getattr(DiamondPriceDB, field) for field in HISTORY_FIELDS],
+        raw_timestamp(DiamondPriceDB.timestamp)
+    )
+    if staff_id:
+        query = query.where(DiamondPriceDB.calculated_by == staff_id)
+    return query
+
+def _export_response(chunks, fields: List[str], fmt: str, filename: str) -> StreamingResponse:
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {fmt}")
+    return StreamingResponse(
+        stream_export(chunks, fields, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
+
 # 🔹 Get login logs
 @router.get("/login-logs/", response_model=List[LoginLogResponse])
 async def get_login_logs(
     staff_id: Optional[str] = None,
     branch: Optional[str] = None,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_read_db)
 ):
-    """Retrieve login logs"""
-    query = db.query(LoginLogDB)
-    if staff_id:
-        query = query.filter(LoginLogDB.staff_id == staff_id)
-    if branch:
-        query = query.filter(LoginLogDB.branch == branch)
-    
-    logs = query.order_by(LoginLogDB.timestamp.desc()).limit(limit).all()
+    """Retrieve login logs, newest first
 
-    if not logs:
-        raise HTTPException(status_code=404, detail="No logs found")
-    
-    return [LoginLogResponse.model_validate(log) for log in logs]  # 🔹 Fix .to_dict() error
+    Pass the X-Next-Cursor header of a response as ``cursor`` to get the
+    next page. Send the ETag back as If-None-Match to get 304 while the
+    logs are unchanged.
+    """
+    key = ("login_logs", staff_id, branch, limit, cursor)
+    etag = page_etag(key, await table_validator(db, LoginLogDB))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    page = page_cache.get(key, etag)
+    if page is None:
+        query = apply_keyset(
+            _login_log_query(staff_id, branch), LoginLogDB.timestamp, LoginLogDB.id, cursor
+        )
+        logs = (await db.execute(query.limit(limit))).all()
+
+        if not logs and not cursor:
+            raise HTTPException(status_code=404, detail="No logs found")
+
+        page = page_cache.store(
+            key, etag,
+            [{field: getattr(log, field) for field in LOGIN_LOG_FIELDS} for log in logs],
+            next_cursor(logs, limit),
+        )
+    return page_response(page, accept_encoding)
+
+@router.get("/login-logs/export")
+async def export_login_logs(
+    format: str = "ndjson",
+    staff_id: Optional[str] = None,
+    branch: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Stream every matching login log as NDJSON or CSV"""
+    chunks = iter_keyset_chunks(
+        _login_log_query(staff_id, branch),
+        LoginLogDB.timestamp, LoginLogDB.id
+    )
+    return _export_response(chunks, LOGIN_LOG_FIELDS, format, "login_logs")
 
 # 🔹 Get calculation history
 @router.get("/calculation-history/", response_model=List[dict])
 async def get_calculation_history(
     staff_id: Optional[str] = None,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_read_db)
 ):
-    """Retrieve calculation history"""
-    query = db.query(DiamondPriceDB)
-    if staff_id:
-        query = query.filter(DiamondPriceDB.calculated_by == staff_id)
+    """Retrieve calculation history, newest first
+
+    Pass the X-Next-Cursor header of a response as ``cursor`` to get the
+    next page. Send the ETag back as If-None-Match to get 304 while the
+    history is unchanged.
+    """
+    key = ("diamond_prices", staff_id, limit, cursor)
+    etag = page_etag(key, await table_validator(db, DiamondPriceDB))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    page = page_cache.get(key, etag)
+    if page is None:
+        query = apply_keyset(
+            _history_query(staff_id), DiamondPriceDB.timestamp, DiamondPriceDB.id, cursor
+        )
+        history = (await db.execute(query.limit(limit))).all()
+
+        if not history and not cursor:
+            raise HTTPException(status_code=404, detail="No history found")
 
-    history = query.order_by(DiamondPriceDB.timestamp.desc()).limit(limit).all()
+        page = page_cache.store(
+            key, etag,
+            [
+                {
+                    "timestamp": record.timestamp,
+                    "carat": record.carat,
+                    "clarity": record.clarity,
+                    "color": record.color,
+                    "cut": record.cut,
+                    "certification": record.certification,
+                    "price": round(record.price, 2),
+                    "calculated_by": record.calculated_by
+                }
+                for record in history
+            ],
+            next_cursor(history, limit),
+        )
+    return page_response(page, accept_encoding)
 
-    if not history:
-        raise HTTPException(status_code=404, detail="No history found")
+@router.get("/calculation-history/search", response_model=List[dict])
+async def search_calculation_history(
+    response: Response,
+    clarity: Optional[List[str]] = Query(None),
+    color: Optional[List[str]] = Query(None),
+    cut: Optional[List[str]] = Query(None),
+    certification: Optional[List[str]] = Query(None),
+    carat_min: Optional[float] = Query(None, ge=0),
+    carat_max: Optional[float] = Query(None, ge=0),
+    price_min: Optional[float] = Query(None, ge=0),
+    price_max: Optional[float] = Query(None, ge=0),
+    start: Optional[datetime] = Query(None, description="ISO 8601; UTC unless an offset is given"),
+    end: Optional[datetime] = Query(None, description="ISO 8601; UTC unless an offset is given"),
+    staff_id: Optional[List[str]] = Query(None),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Search calculation history by grades, ranges, time window and staff, newest first
+
+    Repeat a grade or staff parameter to match any of several values. Pass
+    the X-Next-Cursor header of a response as ``cursor`` to get the next
+    page; an empty list means nothing (more) matched.
+    """
+    filters = HistoryFilters(
+        clarity=clarity, color=color, cut=cut, certification=certification,
+        carat_min=carat_min, carat_max=carat_max, price_min=price_min, price_max=price_max,
+        start=start, end=end, staff_id=staff_id,
+    )
+    try:
+        check_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    history = (await db.execute(search_query(filters, cursor, limit))).all()
+
+    page_cursor = next_cursor(history, limit)
+    if page_cursor:
+        response.headers["X-Next-Cursor"] = page_cursor
 
     return [
         {
+            "id": record.id,
             "timestamp": record.timestamp,
             "carat": record.carat,
             "clarity": record.clarity,
@@ -236,25 +674,124 @@ async def get_calculation_history(
         for record in history
     ]
 
+@router.get("/calculation-history/export")
+async def export_calculation_history(
+    format: str = "ndjson",
+    staff_id: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Stream every matching calculation record as NDJSON or CSV"""
+    chunks = iter_keyset_chunks(
+        _history_query(staff_id),
+        DiamondPriceDB.timestamp, DiamondPriceDB.id
+    )
+    return _export_response(chunks, HISTORY_FIELDS, format, "calculation_history")
+
+# 🔹 Archived months of login logs, calculation history and re-quotes
+@router.get("/archive/{table}")
+async def get_archive_months(
+    table: str,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """List the archived months of a table"""
+    if table not in RETENTION_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown archive table: {table}")
+    return await list_archive_months(db, table)
+
+@router.get("/archive/{table}/{month}")
+async def read_archive_month(
+    table: str,
+    month: str,
+    format: str = "ndjson",
+    current_user: str = Depends(get_current_user)
+):
+    """Stream one archived month of a table as NDJSON or CSV"""
+    try:
+        path = archive_file(table, month)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"No archive for {table} {month}")
+    return _export_response(
+        iter_archive(table, month), archive_fields(table), format, f"{table}_{month}"
+    )
+
+def _check_granularity(granularity: str) -> None:
+    if granularity not in BUCKET_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported granularity: {granularity}")
+
+# 🔹 Pricing analytics, served from the incremental rollups
+@router.get("/analytics/staff")
+async def staff_analytics(
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    branch: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Quote count, carat and value totals per staff member per bucket"""
+    _check_granularity(granularity)
+    return await query_rollups(
+        db, ["bucket", "calculated_by"], granularity, start, end, staff_id, branch
+    )
+
+@router.get("/analytics/branches")
+async def branch_analytics(
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    branch: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Quote count, carat and value totals per branch per bucket"""
+    _check_granularity(granularity)
+    return await query_rollups(db, ["bucket", "branch"], granularity, start, end, branch=branch)
+
+@router.get("/analytics/grades")
+async def grade_analytics(
+    dimension: str = "clarity",
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    branch: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+    db: DBSession = Depends(get_read_db)
+):
+    """Stone grade mix per branch over the selected buckets"""
+    _check_granularity(granularity)
+    if dimension not in GROUP_COLUMNS[2:]:
+        raise HTTPException(status_code=400, detail=f"Unsupported grade dimension: {dimension}")
+    return await query_rollups(
+        db, ["branch", dimension], granularity, start, end, staff_id, branch
+    )
+
 @router.post("/log-activity/")
-async def log_activity(request: LogActivityRequest, db: Session = Depends(get_db)):
-    """Log user activity"""
+async def log_activity(request: Union[LogActivityRequest, List[LogActivityRequest]]):
+    """Log one user activity event or a list of them
+
+    Events are buffered and written in batches, so they show up in the
+    login logs shortly after the response.
+    """
+    events = request if isinstance(request, list) else [request]
     try:
-        log = LoginLogDB(
-            staff_id=request.staff_id,
-            branch=request.branch,
-            counter=request.counter,
-            success=request.success,
-            details=request.details,
-            ip_address=None,  
-            user_agent=None, 
-            session_token=None, 
-            logged_out=False
-        )
-        db.add(log)
-        db.commit()
-        db.refresh(log)
-        return {"message": "Activity logged successfully"}
+        logged_at = get_malaysia_time()
+        await activity_log_queue.submit([
+            {
+                "staff_id": event.staff_id,
+                "branch": event.branch,
+                "counter": event.counter,
+                "success": event.success,
+                "details": event.details,
+                "timestamp": logged_at,
+                "logged_out": False,
+            }
+            for event in events
+        ])
+        return {"message": "Activity logged successfully", "count": len(events)}
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to log activity: {str(e)}")
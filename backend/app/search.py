@@ -0,0 +1,133 @@
+import math
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .utils import PRICING_AXES, PricingSnapshot, price_encoded, quote_price
+
+# Inverse price search. A price is per_carat * carat, so for a budget and a
+# minimum carat weight the affordable grade combinations are exactly those
+# whose per-carat price is at most budget / carat_min. With the per-carat
+# prices sorted once per pricing table, that set is a prefix found by binary
+# search; grade filters and ranking only touch the prefix.
+#
+# Quotes multiply in a different order than the combined per-carat price and
+# round to cents, so the sorted prices only bound the prefix. Entries in it
+# are then kept or dropped on the quoted price itself (see quote_price).
+
+SEARCH_SORTS = ("best_grade", "max_carat")
+
+class PriceIndex(NamedTuple):
+    matrix_version: str
+    per_carat: np.ndarray  # Ascending
+    codes: Dict[str, np.ndarray]  # axis -> grade code of each entry, same order
+    grades: Dict[str, List[str]]  # axis -> grade names by code
+
+def build_price_index(snapshot: PricingSnapshot) -> PriceIndex:
+    flat = snapshot.matrix.ravel()
+    order = np.argsort(flat, kind="stable")
+    unravelled = np.unravel_index(order, snapshot.matrix.shape)
+    return PriceIndex(
+        matrix_version=snapshot.matrix_version,
+        per_carat=flat[order],
+        codes={axis: codes.astype(np.int8) for axis, codes in zip(PRICING_AXES, unravelled)},
+        grades={axis: list(snapshot.codes[axis]) for axis in PRICING_AXES},
+    )
+
+_index: Optional[PriceIndex] = None
+_index_lock = threading.Lock()
+
+def get_price_index(snapshot: PricingSnapshot) -> PriceIndex:
+    """Return the index for a snapshot, building it once per pricing table."""
+    global _index
+    index = _index
+    if index is not None and index.matrix_version == snapshot.matrix_version:
+        return index
+    with _index_lock:
+        if _index is None or _index.matrix_version != snapshot.matrix_version:
+            _index = build_price_index(snapshot)
+        return _index
+
+def affordable_carat(
+    snapshot: PricingSnapshot,
+    grades: Sequence[str],
+    budget: float,
+    per_carat: float,
+    carat_min: float,
+    carat_max: float,
+) -> float:
+    """Largest two-decimal weight up to carat_max whose quote is within budget.
+
+    Estimated from the per-carat price, then stepped a cent of a carat at a
+    time until the quoted price agrees. Never below carat_min, which the
+    caller has already checked is affordable.
+    """
+    carat = max(min(carat_max, math.floor(budget / per_carat * 100) / 100), carat_min)
+    while carat > carat_min and quote_price(snapshot, grades, carat) > budget:
+        carat = max(round(carat - 0.01, 2), carat_min)
+    while (
+        round(carat + 0.01, 2) <= carat_max
+        and quote_price(snapshot, grades, round(carat + 0.01, 2)) <= budget
+    ):
+        carat = round(carat + 0.01, 2)
+    return carat
+
+def search_prices(
+    snapshot: PricingSnapshot,
+    budget: float,
+    carat_min: float,
+    carat_max: float,
+    grades: Optional[Dict[str, Sequence[str]]] = None,
+    sort: str = "best_grade",
+    limit: int = 20,
+) -> dict:
+    """Find grade combinations a budget buys within a carat range.
+
+    ``grades`` optionally restricts each axis to the listed grades.
+    ``best_grade`` ranks the dearest per-carat combinations first, the
+    best quality the budget reaches; ``max_carat`` ranks the largest
+    affordable stone first. Raises ValueError for unknown grades or sorts.
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Unsupported sort: {sort}")
+    index = get_price_index(snapshot)
+
+    # A cent and a little relative slack cover rounding and product order
+    bound = (budget + 0.01) / carat_min * (1 + 1e-9)
+    end = int(np.searchsorted(index.per_carat, bound, side="right"))
+    min_carat_prices = np.array(price_encoded(
+        snapshot, np.full(end, carat_min), *(index.codes[axis][:end] for axis in PRICING_AXES)
+    ))
+    mask = min_carat_prices <= budget
+    for axis, allowed in (grades or {}).items():
+        if not allowed:
+            continue
+        unknown = sorted(set(allowed) - set(index.grades[axis]))
+        if unknown:
+            raise ValueError(f"Unknown {axis} grades: {unknown}")
+        codes = [index.grades[axis].index(grade) for grade in allowed]
+        mask &= np.isin(index.codes[axis][:end], codes)
+    positions = np.flatnonzero(mask)
+    if sort == "best_grade":
+        positions = positions[::-1]
+
+    results = []
+    for position in positions[:limit].tolist():
+        per_carat = float(index.per_carat[position])
+        result = {axis: index.grades[axis][index.codes[axis][position]] for axis in PRICING_AXES}
+        grades = tuple(result[axis] for axis in PRICING_AXES)
+        max_carat = affordable_carat(snapshot, grades, budget, per_carat, carat_min, carat_max)
+        result.update(
+            price_per_carat=round(per_carat, 2),
+            min_carat_price=float(min_carat_prices[position]),
+            max_carat=max_carat,
+            max_carat_price=quote_price(snapshot, grades, max_carat),
+        )
+        results.append(result)
+
+    return {
+        "pricing_version": snapshot.version,
+        "total_matches": int(positions.size),
+        "results": results,
+    }
@@ -0,0 +1,254 @@
+"""Production entry point: a pre-forking supervisor for uvicorn workers.
+
+The supervisor binds the listening socket, brings the schema up to date and
+loads the current pricing table once, then forks WEB_WORKERS uvicorn workers
+(the CPU count by default) that share the socket, so the kernel spreads
+connections across them. Workers keep their caches in memory and stay
+consistent through the database: revocations bump the cache_versions
+counters and published pricing tables are picked up by each worker's
+PricingReloader within seconds.
+
+Run from the backend directory:
+
+    python -m app.serve                       # one worker per core
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+Signals to the supervisor:
+
+    TERM, INT  drain every worker (up to WORKER_GRACEFUL_TIMEOUT) and exit
+    HUP        reload the pricing table and replace workers one at a time
+    TTIN, TTOU add or remove a worker
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+import argparse
+from typing import Dict, List, Optional, Set
+
+from . import config
+from .startup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+WORKER_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU)
+
+# A worker that dies sooner than this after starting is crash-looping; the
+# supervisor waits this long before replacing it again
+MIN_WORKER_LIFETIME = 1.0
+
+def default_workers() -> int:
+    return config.WEB_WORKERS or os.cpu_count() or 1
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def preload() -> None:
+    """Do the per-database startup work once, before any worker is forked.
+
+    Workers inherit the upgraded-schema marker and the pricing snapshot, so
+    their own startup only starts queues and threads. Pooled connections are
+    closed first, since SQLite connections must not cross a fork.
+    """
+    from .database import engine, read_engine
+    from .migrations import upgrade_schema
+    from .pricing import pricing_reloader
+    from .search import get_price_index
+    from .utils import current_pricing
+
+    upgrade_schema(engine)
+    pricing_reloader.check()
+    get_price_index(current_pricing())
+    engine.dispose()
+    read_engine.dispose()
+
+def run_worker(app, sock: socket.socket, slot: int, graceful_timeout: float) -> None:
+    """Serve requests on the shared socket until told to stop."""
+    import uvicorn
+    from .database import engine, read_engine
+
+    for signum in WORKER_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    # Singleton background jobs run in the first worker only
+    config.BACKGROUND_TASKS = config.BACKGROUND_TASKS and slot == 0
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
+
+    server = uvicorn.Server(uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level="info",
+        access_log=True,
+        timeout_graceful_shutdown=graceful_timeout,
+    ))
+    # uvicorn stops accepting on TERM/INT, finishes in-flight requests and
+    # runs the shutdown handlers, which flush the write-behind queues
+    server.run(sockets=[sock])
+
+class Supervisor:
+    """Keeps a pool of forked workers alive, resizes and drains it."""
+
+    def __init__(self, app, sock: socket.socket, workers: int, graceful_timeout: float):
+        self.app = app
+        self.sock = sock
+        self.target = max(1, workers)
+        self.graceful_timeout = graceful_timeout
+        self.workers: Dict[int, int] = {}  # pid -> slot
+        self.started_at: Dict[int, float] = {}
+        self._retiring: Set[int] = set()
+        self._signals: List[int] = []
+        self._stopping = False
+
+    def spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(self.app, self.sock, slot, self.graceful_timeout)
+            except Exception as e:
+                logger.error(f"Worker {slot} failed: {str(e)}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = slot
+        self.started_at[pid] = time.monotonic()
+        logger.info(f"Started worker {slot} (pid {pid})")
+        return pid
+
+    def retire(self, pid: int) -> None:
+        """Ask a worker to drain and exit."""
+        self._retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.workers.pop(pid, None)
+            started_at = self.started_at.pop(pid, time.monotonic())
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                logger.info(f"Worker {slot} (pid {pid}) stopped")
+                continue
+            if slot is None:
+                continue
+            logger.error(
+                f"Worker {slot} (pid {pid}) exited unexpectedly"
+                f" with code {os.waitstatus_to_exitcode(status)}"
+            )
+            if time.monotonic() - started_at < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+
+    def wait_for(self, pids: Set[int], timeout: float) -> None:
+        """Reap until the given workers exit; kill any still running after timeout."""
+        deadline = time.monotonic() + timeout
+        while pids & set(self.workers) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in pids & set(self.workers):
+            logger.warning(f"Worker {self.workers[pid]} (pid {pid}) did not drain in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while pids & set(self.workers):
+            self.reap()
+            time.sleep(0.05)
+
+    def active_slots(self) -> Set[int]:
+        return {slot for pid, slot in self.workers.items() if pid not in self._retiring}
+
+    def maintain(self) -> None:
+        """Start workers for empty slots and retire those above the target."""
+        slots = self.active_slots()
+        for slot in range(self.target):
+            if slot not in slots:
+                self.spawn(slot)
+        for pid, slot in list(self.workers.items()):
+            if slot >= self.target and pid not in self._retiring:
+                self.retire(pid)
+
+    def rolling_restart(self) -> None:
+        """Replace workers one at a time so the socket always has acceptors."""
+        preload()
+        for pid, slot in sorted(self.workers.items(), key=lambda item: item[1]):
+            if pid in self._retiring or pid not in self.workers:
+                continue
+            self.retire(pid)
+            self.spawn(slot)
+            self.wait_for({pid}, self.graceful_timeout + 5)
+
+    def stop(self) -> None:
+        """Drain every worker, killing those that outlast the graceful timeout."""
+        self._stopping = True
+        pids = set(self.workers)
+        for pid in pids:
+            self.retire(pid)
+        self.wait_for(pids, self.graceful_timeout + 5)
+
+    def _on_signal(self, signum, frame) -> None:
+        self._signals.append(signum)
+
+    def run(self) -> int:
+        for signum in WORKER_SIGNALS:
+            signal.signal(signum, self._on_signal)
+        logger.info(f"Supervisor {os.getpid()} starting {self.target} workers")
+        self.maintain()
+        while not self._stopping:
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    logger.info("Draining workers and shutting down")
+                    self.stop()
+                    break
+                if signum == signal.SIGHUP:
+                    logger.info("Rolling restart")
+                    self.rolling_restart()
+                elif signum == signal.SIGTTIN:
+                    self.target += 1
+                elif signum == signal.SIGTTOU:
+                    self.target = max(1, self.target - 1)
+                logger.info(f"Running {self.target} workers")
+            if self._stopping:
+                break
+            self.reap()
+            self.maintain()
+            time.sleep(0.2)
+        self.sock.close()
+        logger.info("Supervisor stopped")
+        return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked workers")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default=config.WEB_HOST)
+    parser.add_argument("--port", type=int, default=config.WEB_PORT)
+    parser.add_argument("--backlog", type=int, default=config.WEB_BACKLOG)
+    parser.add_argument("--graceful-timeout", type=float, default=config.WORKER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from .main import app
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    logger.info(f"Listening on {args.host}:{args.port}")
+    preload()
+    return Supervisor(app, sock, args.workers, args.graceful_timeout).run()
+
+if __name__ == "__main__":
+    sys.exit(main())
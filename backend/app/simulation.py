@@ -0,0 +1,322 @@
+"""What-if repricing of calculation history under candidate pricing tables.
+
+Every DiamondPriceDB row in range is repriced under each candidate table and
+compared with the price it was actually quoted at. Rows are streamed in
+chunks of SIMULATION_CHUNK_SIZE with their grades already turned into a
+matrix index by SQLite; each chunk is then priced for all scenarios at once
+from the stacked scenario multipliers, and folded into running totals per
+scenario, branch and staff member plus counts of per-stone price changes.
+Memory stays bounded by the chunk size whatever the history length.
+
+Stones are repriced exactly as /api/calculate-price would price them, in
+the same multiplication order and with the same rounding, so a table equal
+to the one a quote was made under reports no change for it.
+
+A simulation scans the whole history in range, so the endpoint is limited
+to pricing admins and SIMULATION_CONCURRENCY simulations per worker.
+
+Run from the backend directory with a JSON file holding one pricing table
+(as POSTed to /api/pricing-tables, optionally with a "name") or a list:
+
+    python -m app.simulation scenarios.json
+    python -m app.simulation scenarios.json --start 2026-01-01 --staff s1 --json
+"""
+import sys
+import json
+import math
+import time
+import threading
+import argparse
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import case, select
+
+from . import config
+from .database import read_engine
+from .history import HistoryFilters, filter_conditions
+from .inventory import GRADE_CODES
+from .models import DiamondPriceDB
+from .pricing import validate_multipliers
+from .utils import (
+    DEFAULT_MULTIPLIERS, PRICING_AXES, PricingSnapshot, build_pricing_snapshot, round_cents
+)
+
+# Per-stone price changes, in percent, are counted in slots of
+# CHANGE_RESOLUTION, which bounds the error of the reported percentiles, and
+# reported as a histogram of CHANGE_BIN_WIDTH bins. Changes beyond
+# CHANGE_LIMIT either way are counted at the limit; min and max stay exact.
+CHANGE_RESOLUTION = 0.01
+CHANGE_BIN_WIDTH = 1.0
+CHANGE_LIMIT = 100.0
+SIMULATION_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Held by each running simulation started from the API
+simulation_slots = threading.BoundedSemaphore(config.SIMULATION_CONCURRENCY)
+
+class Scenario(NamedTuple):
+    name: str
+    snapshot: PricingSnapshot
+
+def build_scenarios(tables: Sequence[dict]) -> List[Scenario]:
+    """Snapshots for candidate tables. Raises ValueError for invalid tables.
+
+    Each table has base_price and the four multiplier maps, and optionally
+    a name.
+    """
+    scenarios = []
+    for i, table in enumerate(tables):
+        name = table.get("name") or f"scenario {i + 1}"
+        multipliers = {axis: table.get(axis) or {} for axis in PRICING_AXES}
+        try:
+            validate_multipliers(multipliers)
+        except ValueError as e:
+            raise ValueError(f"{name}: {str(e)}")
+        base_price = table.get("base_price")
+        if not isinstance(base_price, (int, float)) or not base_price > 0:
+            raise ValueError(f"{name}: base_price must be greater than 0")
+        ordered = {
+            axis: {grade: multipliers[axis][grade] for grade in DEFAULT_MULTIPLIERS[axis]}
+            for axis in PRICING_AXES
+        }
+        scenarios.append(Scenario(name, build_pricing_snapshot(0, base_price, ordered)))
+    names = [scenario.name for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique")
+    return scenarios
+
+class GroupTotals:
+    """Running quoted and repriced totals per group, for every scenario."""
+
+    def __init__(self, scenarios: int):
+        self.index: Dict[Optional[str], int] = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.quoted = np.zeros(0)
+        self.repriced = np.zeros((scenarios, 0))
+
+    def groups(self, keys: Sequence[Optional[str]]) -> np.ndarray:
+        """Group number of each key, numbering unseen keys."""
+        index = self.index
+        for key in set(keys) - index.keys():
+            index[key] = len(index)
+        return np.fromiter(map(index.__getitem__, keys), dtype=np.int64, count=len(keys))
+
+    def add(self, groups: np.ndarray, quoted: np.ndarray, repriced: np.ndarray) -> None:
+        size = len(self.index)
+        if size > len(self.count):
+            grow = size - len(self.count)
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.quoted = np.concatenate([self.quoted, np.zeros(grow)])
+            self.repriced = np.concatenate([self.repriced, np.zeros((len(self.repriced), grow))], axis=1)
+        self.count += np.bincount(groups, minlength=size)
+        self.quoted += np.bincount(groups, weights=quoted, minlength=size)
+        for s, prices in enumerate(repriced):
+            self.repriced[s] += np.bincount(groups, weights=prices, minlength=size)
+
+    def describe(self, scenario: int, label: str) -> List[dict]:
+        """Groups with their totals under one scenario, largest change first."""
+        groups = [
+            {label: key, **totals(int(self.count[i]), self.quoted[i], self.repriced[scenario, i])}
+            for key, i in self.index.items()
+        ]
+        return sorted(groups, key=lambda group: abs(group["delta"]), reverse=True)
+
+def totals(count: int, quoted: float, repriced: float) -> dict:
+    delta = repriced - quoted
+    return {
+        "count": count,
+        "quoted_total": round(quoted, 2),
+        "repriced_total": round(repriced, 2),
+        "delta": round(delta, 2),
+        "delta_pct": round(delta / quoted * 100, 4) if quoted else None,
+    }
+
+def change_distribution(slots: np.ndarray, low: float, high: float) -> dict:
+    """Exact min and max, nearest-rank percentiles and the non-empty bins.
+
+    ``slots`` counts stones per CHANGE_RESOLUTION step from -CHANGE_LIMIT.
+    """
+    total = int(slots.sum())
+    if not total:
+        return {"min": None, "max": None, **{f"p{p}": None for p in SIMULATION_PERCENTILES}, "histogram": []}
+    changes = np.arange(len(slots)) * CHANGE_RESOLUTION - CHANGE_LIMIT
+    cumulative = np.cumsum(slots)
+    distribution = {"min": round(low, 4), "max": round(high, 4)}
+    for p in SIMULATION_PERCENTILES:
+        slot = int(np.searchsorted(cumulative, math.ceil(p / 100 * total)))
+        distribution[f"p{p}"] = round(float(min(max(changes[slot], low), high)), 4)
+    bins = np.floor(changes / CHANGE_BIN_WIDTH + 1e-9).astype(np.int64)
+    counts = np.bincount(bins - bins[0], weights=slots)
+    distribution["histogram"] = [
+        {
+            "from": float((i + bins[0]) * CHANGE_BIN_WIDTH),
+            "to": float((i + bins[0] + 1) * CHANGE_BIN_WIDTH),
+            "count": int(counts[i]),
+        }
+        for i in np.flatnonzero(counts)
+    ]
+    return distribution
+
+def history_chunks(filters: HistoryFilters, chunk_size: int) -> Iterator[tuple]:
+    """Yield (carat, grade code, price, staff, branch) column tuples per chunk.
+
+    The four grades arrive as one flat index into a pricing matrix, negative
+    when any grade is outside the built-in tables. Rows are read with the
+    plain sqlite3 cursor; at millions of rows, building SQLAlchemy rows
+    would cost more than repricing them.
+    """
+    shape = [len(GRADE_CODES[axis]) for axis in PRICING_AXES]
+    flat_code = None
+    for axis, size in zip(PRICING_AXES, shape):
+        code = case(GRADE_CODES[axis], value=getattr(DiamondPriceDB, axis), else_=-int(np.prod(shape)))
+        flat_code = code if flat_code is None else flat_code * size + code
+    query = (
+        select(
+            DiamondPriceDB.carat,
+            flat_code,
+            DiamondPriceDB.price,
+            DiamondPriceDB.calculated_by,
+            DiamondPriceDB.branch,
+        )
+        .where(*filter_conditions(filters))
+    )
+    compiled = query.compile(dialect=read_engine.dialect, compile_kwargs={"literal_binds": True})
+    with read_engine.connect() as connection:
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(str(compiled))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield tuple(zip(*rows))
+        finally:
+            cursor.close()
+
+def simulate(
+    scenarios: Sequence[Scenario],
+    filters: Optional[HistoryFilters] = None,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """Reprice matching history under every scenario and summarize the changes."""
+    started = time.perf_counter()
+    filters = filters or HistoryFilters()
+    chunk_size = chunk_size or config.SIMULATION_CHUNK_SIZE
+    shape = tuple(len(GRADE_CODES[axis]) for axis in PRICING_AXES)
+    # (scenarios, 1) base prices and, per axis, (scenarios, grades) multipliers
+    base_prices = np.array([[scenario.snapshot.base_price] for scenario in scenarios])
+    factors = [
+        np.stack([scenario.snapshot.factors[i] for scenario in scenarios])
+        for i in range(len(PRICING_AXES))
+    ]
+    count = len(scenarios)
+    limit = int(round(CHANGE_LIMIT / CHANGE_RESOLUTION))
+
+    quoted_total = 0.0
+    repriced_total = np.zeros(count)
+    slots = np.zeros((count, 2 * limit + 1), dtype=np.int64)
+    change_low = np.full(count, np.inf)
+    change_high = np.full(count, -np.inf)
+    by_branch = GroupTotals(count)
+    by_staff = GroupTotals(count)
+    rows = skipped = 0
+
+    for carat, code, price, staff, branch in history_chunks(filters, chunk_size):
+        rows += len(carat)
+        carats = np.array(carat, dtype=np.float64)  # None becomes nan
+        quoted = np.array(price, dtype=np.float64)
+        codes = np.array(code, dtype=np.int64)
+        branch_groups = by_branch.groups(branch)
+        staff_groups = by_staff.groups(staff)
+        valid = (codes >= 0) & ~np.isnan(carats) & ~np.isnan(quoted)
+        if not valid.all():
+            skipped += int((~valid).sum())
+            carats, quoted, codes = carats[valid], quoted[valid], codes[valid]
+            branch_groups, staff_groups = branch_groups[valid], staff_groups[valid]
+        if not len(carats):
+            continue
+
+        # (scenarios, stones), multiplied in quote_price's order
+        clarity, color, cut, certification = np.unravel_index(codes, shape)
+        repriced = round_cents(
+            base_prices * carats * factors[0][:, clarity] * factors[1][:, color]
+            * factors[2][:, cut] * factors[3][:, certification]
+        )
+        quoted_total += quoted.sum()
+        repriced_total += repriced.sum(axis=1)
+        by_branch.add(branch_groups, quoted, repriced)
+        by_staff.add(staff_groups, quoted, repriced)
+
+        priced = quoted > 0
+        if priced.any():
+            change = (repriced[:, priced] / quoted[priced] - 1) * 100
+            change_low = np.minimum(change_low, change.min(axis=1))
+            change_high = np.maximum(change_high, change.max(axis=1))
+            steps = np.clip(np.rint(change / CHANGE_RESOLUTION).astype(np.int64), -limit, limit) + limit
+            for s in range(count):
+                slots[s] += np.bincount(steps[s], minlength=len(slots[s]))
+
+    return {
+        "rows": rows,
+        "skipped": skipped,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "scenarios": [
+            {
+                "name": scenario.name,
+                "matrix_version": scenario.snapshot.matrix_version,
+                **totals(rows - skipped, quoted_total, float(repriced_total[s])),
+                "change_pct": change_distribution(
+                    slots[s], float(change_low[s]), float(change_high[s])
+                ),
+                "by_branch": by_branch.describe(s, "branch"),
+                "by_staff": by_staff.describe(s, "staff_id"),
+            }
+            for s, scenario in enumerate(scenarios)
+        ],
+    }
+
+def print_report(result: dict, top: int) -> None:
+    print(f"{result['rows']} quotes ({result['skipped']} skipped) in {result['elapsed_seconds']}s")
+    for scenario in result["scenarios"]:
+        change = scenario["change_pct"]
+        print(
+            f"\n{scenario['name']}: {scenario['quoted_total']:,.2f} -> {scenario['repriced_total']:,.2f}"
+            f"  delta {scenario['delta']:+,.2f} ({scenario['delta_pct'] or 0:+.2f}%)"
+        )
+        print("  per stone change %: " + "  ".join(
+            f"{key} {change[key]:+.2f}" for key in ("min", "p5", "p50", "p95", "max")
+            if change[key] is not None
+        ))
+        for label, groups in (("branch", scenario["by_branch"]), ("staff_id", scenario["by_staff"])):
+            for group in groups[:top]:
+                print(f"  {label} {group[label]!s:<20} {group['delta']:>+16,.2f}  ({group['delta_pct'] or 0:+.2f}%)")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reprice calculation history under candidate tables")
+    parser.add_argument("scenarios", help="JSON file with a pricing table or a list of them")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Only quotes from this time on (UTC)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Only quotes up to this time (UTC)")
+    parser.add_argument("--staff", action="append", help="Only quotes by this staff member")
+    parser.add_argument("--chunk-size", type=int, default=config.SIMULATION_CHUNK_SIZE)
+    parser.add_argument("--top", type=int, default=5, help="Branches and staff shown per scenario")
+    parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.scenarios) as f:
+        tables = json.load(f)
+    try:
+        scenarios = build_scenarios(tables if isinstance(tables, list) else [tables])
+    except ValueError as e:
+        parser.error(str(e))
+    filters = HistoryFilters(start=args.start, end=args.end, staff_id=args.staff)
+
+    result = simulate(scenarios, filters, args.chunk_size)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args.top)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+from . import config
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+def configure_logging() -> None:
+    """The one logging setup for the API and the command line tools."""
+    logging.basicConfig(level=config.LOG_LEVEL, format=LOG_FORMAT)
+
+class StartupTimer:
+    """Wall time of each startup phase, logged once and exported to /metrics."""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        total = sum(self.phases.values())
+        breakdown = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.phases.items())
+        return f"Startup took {total * 1000:.1f} ms ({breakdown})"
+
+startup_timer = StartupTimer()
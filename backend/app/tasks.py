@@ -0,0 +1,49 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """Background thread that calls ``run`` every ``interval`` seconds.
+
+    An interval of 0 or less disables the task. Failures are logged and the
+    next run goes ahead as scheduled.
+    """
+
+    def __init__(self, name: str, interval: float, run: Callable[[], object]):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self.runs = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Periodic task '{self.name}' failed: {str(e)}")
@@ -1,3 +1,9 @@
+import hashlib
+from operator import attrgetter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
 from .models import Diamond
 
 # Price constants
@@ -22,12 +28,204 @@ CERTIFICATION_MULTIPLIERS = {
     'GIA': 1.3, 'AGS': 1.25, 'IGI': 1.1, 'HRD': 1.2, 'None': 1.0
 }
 
-def calculate_diamond_price(diamond: Diamond) -> float:
+# Grade axes of the price matrix, in index order
+PRICING_AXES = ("clarity", "color", "cut", "certification")
+
+# Built-in pricing table, published as version 1 on a fresh database
+DEFAULT_PRICING_VERSION = 1
+DEFAULT_MULTIPLIERS = {
+    "clarity": CLARITY_MULTIPLIERS,
+    "color": COLOR_MULTIPLIERS,
+    "cut": CUT_MULTIPLIERS,
+    "certification": CERTIFICATION_MULTIPLIERS,
+}
+
+# Parcels larger than this are priced with the vectorized batch engine
+BATCH_PRICING_THRESHOLD = 16
+
+class PricingSnapshot(NamedTuple):
+    """An immutable pricing table with its precomputed lookups.
+
+    Never mutated once built: a new table version replaces the whole
+    snapshot, so a request that holds one prices every stone consistently.
+    """
+    version: int  # Published pricing table version
+    base_price: float
+    multipliers: Dict[str, Dict[str, float]]  # axis -> grade -> multiplier
+    codes: Dict[str, Dict[str, int]]  # axis -> grade -> matrix index
+    factors: Tuple[np.ndarray, ...]  # Per axis, the multipliers by grade code
+    matrix: np.ndarray
+    matrix_version: str  # Content hash of the matrix, used as its ETag
+    grade_multipliers: Dict[Tuple[str, str, str, str], Tuple[float, float, float, float]]
+
+def build_price_matrix(base_price: float, multipliers: Dict[str, Dict[str, float]]) -> np.ndarray:
+    """Build the combined per-carat price for every grade combination.
+
+    The result has shape (clarity, color, cut, certification) and is
+    indexed by the grade codes, which follow multiplier table order. It
+    ranks and describes grade combinations; quotes are not priced from it
+    (see quote_price).
+    """
+    clarity, color, cut, certification = axis_factors(multipliers)
+    matrix = (base_price *
+              clarity[:, None, None, None] *
+              color[None, :, None, None] *
+              cut[None, None, :, None] *
+              certification[None, None, None, :])
+    matrix.setflags(write=False)
+    return matrix
+
+def axis_factors(multipliers: Dict[str, Dict[str, float]]) -> Tuple[np.ndarray, ...]:
+    """Per axis, the multipliers as a read-only array indexed by grade code."""
+    factors = tuple(
+        np.array(list(multipliers[axis].values()), dtype=np.float64) for axis in PRICING_AXES
+    )
+    for array in factors:
+        array.setflags(write=False)
+    return factors
+
+def build_pricing_snapshot(
+    version: int, base_price: float, multipliers: Dict[str, Dict[str, float]]
+) -> PricingSnapshot:
+    """Precompute the price matrix and lookups for a pricing table."""
+    multipliers = {axis: dict(multipliers[axis]) for axis in PRICING_AXES}
+    # Small integer codes for each grade, in multiplier table order
+    codes = {
+        axis: {grade: code for code, grade in enumerate(multipliers[axis])}
+        for axis in PRICING_AXES
+    }
+    matrix = build_price_matrix(base_price, multipliers)
+    factors = axis_factors(multipliers)
+    # Quotes are computed from the factors, so they are hashed along with it
+    digest = hashlib.sha256(matrix.tobytes())
+    for array in factors:
+        digest.update(array.tobytes())
+    for axis in PRICING_AXES:
+        digest.update("|".join(codes[axis]).encode())
+    clarity_codes, color_codes, cut_codes, certification_codes = (
+        codes[axis] for axis in PRICING_AXES
+    )
+    # Scalar lookups go through a dict keyed by the grade tuple
+    grade_multipliers = {
+        (clarity, color, cut, certification): (
+            multipliers["clarity"][clarity], multipliers["color"][color],
+            multipliers["cut"][cut], multipliers["certification"][certification],
+        )
+        for clarity in clarity_codes
+        for color in color_codes
+        for cut in cut_codes
+        for certification in certification_codes
+    }
+    return PricingSnapshot(
+        version=version,
+        base_price=float(base_price),
+        multipliers=multipliers,
+        codes=codes,
+        factors=factors,
+        matrix=matrix,
+        matrix_version=digest.hexdigest()[:16],
+        grade_multipliers=grade_multipliers,
+    )
+
+_current_pricing = build_pricing_snapshot(
+    DEFAULT_PRICING_VERSION, BASE_PRICE, DEFAULT_MULTIPLIERS
+)
+
+def current_pricing() -> PricingSnapshot:
+    """Return the pricing snapshot in effect.
+
+    Callers should fetch it once per request and pass it along, so a table
+    swap mid-request cannot mix two versions.
+    """
+    return _current_pricing
+
+def install_pricing(snapshot: PricingSnapshot) -> None:
+    """Make a snapshot current.
+
+    A single reference assignment, so readers never need a lock and never
+    observe a partially built table.
+    """
+    global _current_pricing
+    _current_pricing = snapshot
+
+def get_price_matrix(snapshot: Optional[PricingSnapshot] = None) -> dict:
+    """Describe the price matrix for clients that price stones locally."""
+    snapshot = snapshot or current_pricing()
+    return {
+        "version": snapshot.matrix_version,
+        "pricing_version": snapshot.version,
+        "axes": {axis: list(snapshot.codes[axis]) for axis in PRICING_AXES},
+        # What quotes are computed from, in quote_price's order
+        "base_price": snapshot.base_price,
+        "multipliers": {axis: snapshot.factors[i].tolist() for i, axis in enumerate(PRICING_AXES)},
+        "shape": list(snapshot.matrix.shape),
+        "prices": snapshot.matrix.ravel().tolist(),
+    }
+
+def quote_price(snapshot: PricingSnapshot, grades: Tuple[str, str, str, str], carat: float) -> float:
+    """Price of a stone of the given (clarity, color, cut, certification).
+
+    Multiplies in the original formula's order, base price by carat and then
+    each multiplier. Floating point products depend on the order, and a
+    precombined per-carat price would move about 3.5% of quotes by a cent.
+    """
+    clarity, color, cut, certification = snapshot.grade_multipliers[grades]
+    return round(snapshot.base_price * carat * clarity * color * cut * certification, 2)
+
+def calculate_diamond_price(diamond: Diamond, snapshot: Optional[PricingSnapshot] = None) -> float:
     """Calculate the price of a single diamond based on its characteristics."""
-    price = (BASE_PRICE * 
-            diamond.carat * 
-            CLARITY_MULTIPLIERS[diamond.clarity] * 
-            COLOR_MULTIPLIERS[diamond.color] * 
-            CUT_MULTIPLIERS[diamond.cut] * 
-            CERTIFICATION_MULTIPLIERS[diamond.certification])
-    return round(price, 2)
\ No newline at end of file
+    return quote_price(
+        snapshot or current_pricing(),
+        (diamond.clarity, diamond.color, diamond.cut, diamond.certification),
+        diamond.carat,
+    )
+
+def encode_diamonds(diamonds: Sequence[Diamond], snapshot: Optional[PricingSnapshot] = None):
+    """Encode a parcel as a carat array and four grade code arrays.
+
+    Each field is pulled out with one map over the parcel, so the per-stone
+    work stays in C instead of a Python loop.
+    """
+    snapshot = snapshot or current_pricing()
+    count = len(diamonds)
+    carats = np.fromiter(map(attrgetter("carat"), diamonds), dtype=np.float64, count=count)
+    codes = (
+        np.fromiter(
+            map(snapshot.codes[axis].__getitem__, map(attrgetter(axis), diamonds)),
+            dtype=np.int8, count=count,
+        )
+        for axis in PRICING_AXES
+    )
+    return (carats, *codes)
+
+def calculate_diamond_prices(
+    diamonds: Sequence[Diamond], snapshot: Optional[PricingSnapshot] = None
+) -> List[float]:
+    """Calculate the prices of a parcel of diamonds in one array pass.
+
+    Multiplies in the same order as quote_price, so every price is
+    identical to pricing the stones one at a time.
+    """
+    snapshot = snapshot or current_pricing()
+    return price_encoded(snapshot, *encode_diamonds(diamonds, snapshot))
+
+def round_cents(prices: np.ndarray) -> np.ndarray:
+    """Round an array to cents exactly as Python's round(price, 2) does.
+
+    np.round scales by 100 and rounds the already inexact product, which
+    goes the wrong way near half-cent ties. Values that close to a tie are
+    rounded with round() one by one; everything else is rounded in bulk.
+    """
+    scaled = prices * 100
+    cents = np.rint(scaled) / 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 2 * np.spacing(scaled)
+    if near_tie.any():
+        cents[near_tie] = [round(price, 2) for price in prices[near_tie].tolist()]
+    return cents
+
+def price_encoded(snapshot: PricingSnapshot, carats, clarity, color, cut, certification) -> List[float]:
+    """Price stones given as a carat array and four grade code arrays."""
+    clarity_factors, color_factors, cut_factors, certification_factors = snapshot.factors
+    prices = (snapshot.base_price * carats * clarity_factors[clarity] * color_factors[color]
+              * cut_factors[cut] * certification_factors[certification])
+    return round_cents(prices).tolist()
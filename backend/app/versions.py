@@ -0,0 +1,43 @@
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import CacheVersionDB
+
+# Version counters kept in SQLite so that every worker process sharing the
+# database can tell when its in-memory caches have gone stale.
+
+async def get_version(db, name: str) -> int:
+    """Return the current version of a named cache, 0 if never bumped."""
+    version = await db.scalar(
+        select(CacheVersionDB.version).where(CacheVersionDB.name == name)
+    )
+    return version or 0
+
+async def bump_version(db, name: str) -> int:
+    """Increment a named cache version and return the new value.
+
+    The caller owns the transaction and must commit.
+    """
+    result = await db.execute(
+        update(CacheVersionDB)
+        .where(CacheVersionDB.name == name)
+        .values(version=CacheVersionDB.version + 1)
+    )
+    if not result.rowcount:
+        db.add(CacheVersionDB(name=name, version=1))
+        await db.flush()
+    return await get_version(db, name)
+
+def version_bump(name: str):
+    """Statement that increments a named cache version, creating it at 1.
+
+    For sync sessions, which cannot await bump_version. The caller commits.
+    """
+    return (
+        sqlite_insert(CacheVersionDB)
+        .values(name=name, version=1)
+        .on_conflict_do_update(
+            index_elements=[CacheVersionDB.name],
+            set_={"version": CacheVersionDB.version + 1},
+        )
+    )
@@ -0,0 +1,254 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .database import SessionLocal
+from .metrics import WRITE_BEHIND_FLUSH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ("async", "group", "sync")
+
+class WriteBehindQueue:
+    """Bounded in-process queue that flushes rows with bulk inserts.
+
+    Producers hand over lists of rows; a background thread writes them in
+    batches of up to ``batch_size`` rows, or every ``flush_interval``
+    seconds, whichever comes first. ``write_rows(session, rows)`` performs
+    the insert; the queue owns the session and the commit.
+
+    In ``async`` mode a batch that fails to commit goes back to the head of
+    the queue and is retried on the next flush, up to ``max_attempts``
+    times; only then are its rows logged in full and counted as dropped.
+    In ``group`` mode the failure is raised to the waiting producers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write_rows: Callable[[Session, List[dict]], None],
+        maxsize: int,
+        batch_size: int,
+        flush_interval: float,
+        durability: str = "async",
+        max_attempts: int = 3,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.name = name
+        self.write_rows = write_rows
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.max_attempts = max_attempts
+
+        self._pending = deque()  # (rows, future, attempts) entries
+        self._depth = 0  # Rows currently queued
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.enqueued_rows = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.retried_rows = 0
+        self.dropped_rows = 0
+        self.flushed_batches = 0
+        self.overflow_writes = 0
+        self.peak_depth = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def start(self) -> None:
+        """Start the background flush worker."""
+        if self.running or self.durability == "sync":
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"write-behind-{self.name}", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Write-behind queue '{self.name}' started ({self.durability})")
+
+    def stop(self, timeout: float = 30) -> None:
+        """Flush everything still queued and stop the worker."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        # Anything left over (worker died or timed out) is written inline
+        self._drain(final=True)
+        logger.info(f"Write-behind queue '{self.name}' stopped")
+
+    def put(self, rows: List[dict]) -> Optional[Future]:
+        """Queue rows for writing.
+
+        Returns None when the rows were queued or written, or a Future that
+        resolves once they are committed when the durability mode is
+        ``group``. When the queue is full the rows are written inline.
+        """
+        if not rows:
+            return None
+        if self.durability == "sync" or not self.running:
+            self._write(rows)
+            return None
+        queued, future = self._enqueue(rows)
+        if not queued:
+            self.overflow_writes += 1
+            self._write(rows)
+        return future
+
+    async def submit(self, rows: List[dict]) -> None:
+        """Queue rows from a request handler without blocking the event loop.
+
+        Writes that cannot be queued (sync mode, or a full queue) run on the
+        threadpool, so a backed-up queue slows the producer down instead of
+        stalling every other request on the loop.
+        """
+        if not rows:
+            return
+        if self.durability == "sync" or not self.running:
+            await run_in_threadpool(self._write, rows)
+            return
+        queued, future = self._enqueue(rows)
+        if not queued:
+            self.overflow_writes += 1
+            await run_in_threadpool(self._write, rows)
+        elif future is not None:
+            await asyncio.wrap_future(future)
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "durability": self.durability,
+            "running": self.running,
+            "queue_depth": self._depth,
+            "queue_capacity": self.maxsize,
+            "peak_depth": self.peak_depth,
+            "enqueued_rows": self.enqueued_rows,
+            "flushed_rows": self.flushed_rows,
+            "flushed_batches": self.flushed_batches,
+            "failed_rows": self.failed_rows,
+            "retried_rows": self.retried_rows,
+            "dropped_rows": self.dropped_rows,
+            "overflow_writes": self.overflow_writes,
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+        }
+
+    def _run(self) -> None:
+        backing_off = False
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                # After a failed write, wait out the full interval before retrying
+                while (
+                    not self._stopping
+                    and (backing_off or self._depth < self.batch_size)
+                    and time.monotonic() < deadline
+                ):
+                    self._condition.wait(max(deadline - time.monotonic(), 0))
+                stopping = self._stopping
+            backing_off = not self._drain(final=stopping)
+            if stopping:
+                return
+
+    def _enqueue(self, rows: List[dict]) -> Tuple[bool, Optional[Future]]:
+        """Append rows to the queue unless that would exceed maxsize."""
+        with self._condition:
+            if self._depth + len(rows) > self.maxsize:
+                return False, None
+            future = Future() if self.durability == "group" else None
+            self._pending.append((rows, future, 0))
+            self._depth += len(rows)
+            self.enqueued_rows += len(rows)
+            self.peak_depth = max(self.peak_depth, self._depth)
+            if self._depth >= self.batch_size:
+                self._condition.notify()
+        return True, future
+
+    def _take_batch(self):
+        """Pop up to batch_size rows worth of entries off the queue."""
+        rows, futures, attempts = [], [], 0
+        with self._condition:
+            while self._pending and (not rows or len(rows) < self.batch_size):
+                # A retried batch goes on its own so fresh rows don't share its attempts
+                if rows and (attempts or self._pending[0][2]):
+                    break
+                entry_rows, future, entry_attempts = self._pending.popleft()
+                self._depth -= len(entry_rows)
+                rows.extend(entry_rows)
+                attempts = max(attempts, entry_attempts)
+                if future is not None:
+                    futures.append(future)
+        return rows, futures, attempts
+
+    def _drain(self, final: bool = False) -> bool:
+        """Write queued batches until the queue is empty.
+
+        A failed ``async`` batch is requeued at the head and the drain stops
+        until the next flush; on the ``final`` drain at shutdown it is
+        retried straight away so the attempts still run out. Returns False
+        when the drain stopped on a failed batch.
+        """
+        while True:
+            rows, futures, attempts = self._take_batch()
+            if not rows:
+                return True
+            try:
+                self._write(rows)
+            except Exception as e:
+                if futures:
+                    for future in futures:
+                        future.set_exception(e)
+                elif attempts + 1 < self.max_attempts:
+                    with self._condition:
+                        self._pending.appendleft((rows, None, attempts + 1))
+                        self._depth += len(rows)
+                    self.retried_rows += len(rows)
+                    if not final:
+                        return False
+                else:
+                    self.dropped_rows += len(rows)
+                    logger.error(
+                        f"Write-behind queue '{self.name}' dropped {len(rows)} rows after "
+                        f"{self.max_attempts} attempts: {rows!r}"
+                    )
+            else:
+                for future in futures:
+                    future.set_result(None)
+
+    def _write(self, rows: List[dict]) -> None:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            self.write_rows(db, rows)
+            db.commit()
+            self.flushed_rows += len(rows)
+            self.flushed_batches += 1
+        except Exception as e:
+            db.rollback()
+            self.failed_rows += len(rows)
+            logger.error(f"Write-behind queue '{self.name}' failed to write {len(rows)} rows: {str(e)}")
+            raise
+        finally:
+            db.close()
+            self.last_flush_seconds = time.perf_counter() - started
+            WRITE_BEHIND_FLUSH_LATENCY.observe(self.last_flush_seconds, queue=self.name)
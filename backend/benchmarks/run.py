@@ -0,0 +1,363 @@
+"""Offline load-test and benchmark suite for the Diamond Calculator API.
+
+Runs the ASGI app in-process against a throwaway SQLite file, so results
+only depend on the code and the machine. Run from the backend directory:
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json
+    python -m benchmarks.run --serve-workers 1 2 4   # also app.serve over HTTP
+
+Requires httpx in addition to the backend requirements.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+GRADES = {
+    "clarity": ["FL", "IF", "VVS1", "VVS2", "VS1", "VS2", "SI1", "SI2", "I1"],
+    "color": ["D", "E", "F", "G", "H", "I", "J", "K"],
+    "cut": ["Excellent", "Very Good", "Good", "Fair", "Poor"],
+    "certification": ["GIA", "AGS", "IGI", "HRD", "None"],
+}
+
+def random_stone(rng: random.Random) -> dict:
+    stone = {grade: rng.choice(values) for grade, values in GRADES.items()}
+    stone["carat"] = round(rng.uniform(0.2, 3.0), 2)
+    return stone
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def summarize(name: str, latencies, wall_seconds: float, peak_bytes: int, errors: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests_per_second": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 3),
+    }
+
+def max_rss_bytes() -> int:
+    """Peak resident set size of this process so far (Linux reports KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Bench:
+    def __init__(self, client, trace_memory: bool = False):
+        self.client = client
+        self.trace_memory = trace_memory
+
+    async def login(self, staff_id: str = "bench") -> dict:
+        response = await self.client.post(
+            "/api/login", json={"staff_id": staff_id, "branch": "KL", "counter": "1"}
+        )
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['api_key']}"}
+
+    async def measure(self, name: str, make_request, count: int, concurrency: int = 1) -> dict:
+        """Issue ``count`` requests from ``concurrency`` tasks and summarize."""
+        latencies, errors = [], 0
+        queue = asyncio.Queue()
+        for i in range(count):
+            queue.put_nowait(i)
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                i = queue.get_nowait()
+                started = time.perf_counter()
+                response = await make_request(i)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        # tracemalloc gives per-scenario Python heap peaks but slows every
+        # allocation, so latencies are only comparable between runs that
+        # use the same setting
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            peak = max_rss_bytes()
+        result = summarize(name, latencies, wall, peak, errors)
+        print(
+            f"{name:<28} {result['requests']:>6} req  p50 {result['p50_ms']:>9.3f} ms  "
+            f"p95 {result['p95_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms  "
+            f"{result['requests_per_second']:>9.2f} req/s  {result['peak_memory_mb']:>8.2f} MB",
+            flush=True
+        )
+        return result
+
+def seed_history(rows: int, rng: random.Random) -> None:
+    """Bulk insert synthetic calculation history straight into SQLite."""
+    from sqlalchemy import delete, insert
+    from app.database import SessionLocal
+    from app.models import DiamondPriceDB
+
+    db = SessionLocal()
+    try:
+        db.execute(delete(DiamondPriceDB))
+        batch = []
+        for i in range(rows):
+            stone = random_stone(rng)
+            stone.update(price=1000.0 + i, calculated_by=f"staff{i % 20}", branch="KL")
+            batch.append(stone)
+            if len(batch) == 10000:
+                db.execute(insert(DiamondPriceDB), batch)
+                batch = []
+        if batch:
+            db.execute(insert(DiamondPriceDB), batch)
+        db.commit()
+    finally:
+        db.close()
+
+def check_search_plans() -> None:
+    """Fail the run if a history search reads table rows or sorts unexpectedly."""
+    from app.database import read_engine
+    from app.history import check_plans, plan_problems
+
+    with read_engine.connect() as connection:
+        failing = [
+            name for name, plan in check_plans(connection).items() if plan_problems(name, plan)
+        ]
+    if failing:
+        raise RuntimeError(f"History search plans regressed: {', '.join(failing)}")
+
+async def run_suite(args) -> list:
+    import httpx
+    from app.main import app
+    from app.audit import price_audit_queue
+
+    # Keep per-request INFO logging out of the measurements
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    await app.router.startup()
+    results = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            bench = Bench(client, args.trace_memory)
+            n = args.requests
+
+            results.append(await bench.measure(
+                "login",
+                lambda i: client.post(
+                    "/api/login", json={"staff_id": f"s{i}", "branch": "KL", "counter": "1"}
+                ),
+                n,
+            ))
+
+            headers = await bench.login()
+            single = {"diamonds": [random_stone(rng)]}
+            results.append(await bench.measure(
+                "calculate_price_1",
+                lambda i: client.post("/api/calculate-price", json=single, headers=headers),
+                n,
+            ))
+
+            parcel = {"diamonds": [random_stone(rng) for _ in range(args.parcel_size)]}
+            results.append(await bench.measure(
+                f"calculate_price_{args.parcel_size}",
+                lambda i: client.post("/api/calculate-price", json=parcel, headers=headers),
+                max(n // 50, 3),
+            ))
+            price_audit_queue.stop()
+            price_audit_queue.start()
+
+            for size in args.history_sizes:
+                seed_history(size, rng)
+                results.append(await bench.measure(
+                    f"history_first_page_{size}",
+                    lambda i: client.get("/api/calculation-history/", headers=headers),
+                    n,
+                ))
+                results.append(await bench.measure(
+                    f"history_by_staff_{size}",
+                    lambda i: client.get(
+                        "/api/calculation-history/",
+                        params={"staff_id": f"staff{i % 20}"},
+                        headers=headers
+                    ),
+                    n,
+                ))
+                check_search_plans()
+                results.append(await bench.measure(
+                    f"history_search_{size}",
+                    lambda i: client.get(
+                        "/api/calculation-history/search",
+                        params={"certification": "GIA", "color": ["D", "E", "F"], "carat_min": 1.0},
+                        headers=headers
+                    ),
+                    n,
+                ))
+
+            sessions = [await bench.login(f"mixed{i}") for i in range(args.concurrency)]
+            small_parcel = {"diamonds": [random_stone(rng) for _ in range(10)]}
+
+            def mixed(i):
+                session = sessions[i % len(sessions)]
+                kind = i % 10
+                if kind < 6:
+                    return client.post("/api/calculate-price", json=small_parcel, headers=session)
+                if kind < 9:
+                    return client.get("/api/calculation-history/", headers=session)
+                return client.get("/api/login-logs/", headers=session)
+
+            results.append(await bench.measure(
+                f"mixed_concurrency_{args.concurrency}", mixed, n * 2, args.concurrency
+            ))
+    finally:
+        await app.router.shutdown()
+    return results
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_serving(client, timeout: float = 30) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            (await client.get("/")).raise_for_status()
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def run_serve_scaling(args) -> list:
+    """Measure app.serve over real HTTP at each --serve-workers count.
+
+    Throughput should grow roughly linearly with workers up to the core count.
+    """
+    import httpx
+
+    rng = random.Random(args.seed)
+    # Distinct parcels, so every request is priced rather than a quote cache hit
+    parcels = [
+        {"diamonds": [random_stone(rng) for _ in range(10)]} for _ in range(args.requests)
+    ]
+    results = []
+    for workers in args.serve_workers:
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+            ) as client:
+                await wait_until_serving(client)
+                bench = Bench(client)
+                headers = await bench.login(f"serve{workers}")
+                results.append(await bench.measure(
+                    f"serve_workers_{workers}",
+                    lambda i: client.post(
+                        "/api/calculate-price", json=parcels[i], headers=headers
+                    ),
+                    args.requests, args.concurrency,
+                ))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(current: dict, baseline_path: str) -> None:
+    """Print the change of each metric against an earlier run."""
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in current["results"]:
+        before = baseline.get(result["scenario"])
+        if before is None:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p99_ms", "requests_per_second", "peak_memory_mb"):
+            if before[metric]:
+                delta = (result[metric] - before[metric]) / before[metric] * 100
+                changes.append(f"{metric} {delta:+.1f}%")
+        print(f"{result['scenario']:<28} " + "  ".join(changes))
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--parcel-size", type=int, default=10000, help="Stones in the large parcel")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Report per-scenario Python heap peaks instead of process max RSS"
+    )
+    parser.add_argument(
+        "--serve-workers", type=int, nargs="*", default=[],
+        help="Also benchmark python -m app.serve over HTTP with these worker counts"
+    )
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="diamond-bench-") as tmp:
+        # Must be set before the app (and its engine) is imported
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        results = asyncio.run(run_suite(args))
+        if args.serve_workers:
+            results += asyncio.run(run_serve_scaling(args))
+
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "max_rss_mb": round(max_rss_bytes() / (1024 * 1024), 1),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
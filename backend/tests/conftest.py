@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+# Point the app at a throwaway database before anything imports app.database
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="diamond-tests-"), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    response = client.post("/api/login", json={"staff_id": "tester", "branch": "KL", "counter": "1"})
+    return {"Authorization": f"Bearer {response.json()['api_key']}"}
@@ -0,0 +1,52 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import auth
+from app.auth import StaffSession, TokenCache, resolve_session, utcnow
+
+class RacingSession:
+    """DBSession stand-in whose lookup is overtaken by a logout."""
+
+    def __init__(self, cache: TokenCache, token: str):
+        self.cache = cache
+        self.token = token
+
+    async def execute(self, query):
+        # The session row was read just before another request revoked it
+        self.cache.invalidate(self.token)
+        row = SimpleNamespace(staff_id="s1", branch="KL", expires_at=utcnow() + timedelta(hours=1))
+        return SimpleNamespace(first=lambda: row)
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TokenCache(maxsize=10, ttl=60, version_interval=60)
+
+    async def no_version_check(db):
+        pass
+
+    monkeypatch.setattr(cache, "sync_version", no_version_check)
+    monkeypatch.setattr(auth, "token_cache", cache)
+    return cache
+
+def test_lookup_overtaken_by_a_revoke_is_not_cached(cache):
+    session = asyncio.run(resolve_session(RacingSession(cache, "token"), "token"))
+    assert session.staff_id == "s1"
+    assert cache.get("token") is None
+
+def test_set_skips_stale_generations(cache):
+    generation = cache.generation
+    cache.invalidate_staff("someone else")
+    cache.set("token", StaffSession("s1", "KL", "token"), generation=generation)
+    assert cache.get("token") is None
+    cache.set("token", StaffSession("s1", "KL", "token"), generation=cache.generation)
+    assert cache.get("token") is not None
+
+def test_logout_revokes_a_cached_token(client):
+    key = client.post("/api/login", json={"staff_id": "leaver", "branch": "KL", "counter": "2"}).json()["api_key"]
+    headers = {"Authorization": f"Bearer {key}"}
+    assert client.get("/api/price-matrix", headers=headers).status_code == 200
+    assert client.post("/api/logout", headers=headers).status_code == 200
+    assert client.get("/api/price-matrix", headers=headers).status_code == 401
@@ -0,0 +1,36 @@
+import json
+
+from app import config
+
+STONE = {"carat": 1.0, "clarity": "VS1", "color": "G", "cut": "Excellent", "certification": "GIA"}
+
+def stream(client, auth_headers, body: bytes, content_type="application/x-ndjson"):
+    response = client.post(
+        "/api/calculate-price/stream", content=body,
+        headers={**auth_headers, "Content-Type": content_type},
+    )
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_results_follow_input_order(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_CHUNK_SIZE", 4)
+    records = [json.dumps(STONE).encode()] * 2 + [b"not json"]
+    records += [json.dumps(dict(STONE, carat=-1)).encode(), json.dumps(STONE).encode()]
+    records += [json.dumps(dict(STONE, certification="Others")).encode(), b"\xff"]
+    results = stream(client, auth_headers, b"\n".join(records))
+
+    *lines, summary = results
+    assert [line["line"] for line in lines] == list(range(1, 8))
+    assert ["price" in line for line in lines] == [True, True, False, False, True, False, False]
+    assert lines[2]["error"].startswith("Invalid JSON")
+    assert lines[3]["error"].startswith("carat")
+    assert lines[5]["error"] == "certification: no price for Others"
+    assert lines[6]["error"].startswith("Invalid UTF-8")
+    assert summary["summary"]["count"] == 3 and summary["summary"]["errors"] == 4
+    assert lines[4]["running_total"] == summary["summary"]["total_price"] == round(3 * lines[0]["price"], 2)
+
+def test_csv_rows_are_numbered_by_line(client, auth_headers):
+    body = b"carat,clarity,color,cut,certification\n1,VS1,G,Excellent,GIA\n1,XX,G,Excellent,GIA\n"
+    results = stream(client, auth_headers, body, "text/csv")
+    assert [line.get("line") for line in results[:2]] == [2, 3]
+    assert "price" in results[0] and "error" in results[1]
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import config
+from app.models import DiamondCalculationRequest
+
+STONE = {"carat": 1.0, "clarity": "VS1", "color": "G", "cut": "Excellent", "certification": "GIA"}
+
+# What FastAPI itself reports for a DiamondCalculationRequest body
+reference = FastAPI()
+
+@reference.post("/")
+async def validate(request: DiamondCalculationRequest):
+    return {}
+
+reference_client = TestClient(reference)
+
+# Invalid bodies, and lax-mode inputs Pydantic coerces that the fast path must hand over
+BODIES = [
+    b"",
+    b"{not json",
+    b"[]",
+    json.dumps({"diamonds": "none"}).encode(),
+    json.dumps({"diamonds": [dict(STONE, carat=0)]}).encode(),
+    json.dumps({"diamonds": [dict(STONE, carat="1")]}).encode(),
+    json.dumps({"diamonds": [dict(STONE, carat=True)]}).encode(),
+    json.dumps({"diamonds": [dict(STONE, clarity="XX")]}).encode(),
+    json.dumps({"diamonds": [STONE, dict(STONE, quantity=0)]}).encode(),
+    json.dumps({"diamonds": [{k: v for k, v in STONE.items() if k != "cut"}]}).encode(),
+    json.dumps({"staff_id": 5, "diamonds": [STONE]}).encode(),
+]
+
+@pytest.mark.parametrize("fast_path", [True, False])
+@pytest.mark.parametrize("body", BODIES)
+def test_errors_match_fastapi(client, auth_headers, monkeypatch, fast_path, body):
+    monkeypatch.setattr(config, "FAST_PATH", fast_path)
+    headers = {"Content-Type": "application/json"}
+    response = client.post("/api/calculate-price", content=body, headers={**auth_headers, **headers})
+    expected = reference_client.post("/", content=body, headers=headers)
+    assert response.status_code == expected.status_code
+    if expected.status_code == 422:
+        assert response.json() == expected.json()
+
+@pytest.mark.parametrize("fast_path", [True, False])
+def test_unpriced_grade_is_a_validation_error(client, auth_headers, monkeypatch, fast_path):
+    monkeypatch.setattr(config, "FAST_PATH", fast_path)
+    body = {"diamonds": [STONE, dict(STONE, certification="Others")]}
+    response = client.post("/api/calculate-price", json=body, headers=auth_headers)
+    assert response.status_code == 422
+    [error] = response.json()["detail"]
+    assert error["loc"] == ["body", "diamonds", 1, "certification"]
+    assert error["type"] == "value_error" and error["input"] == "Others"
+
+def test_fast_and_model_paths_price_alike(client, auth_headers, monkeypatch):
+    body = {"diamonds": [dict(STONE, carat=0.01 * i) for i in range(1, 40)]}
+    prices = []
+    for fast_path in (True, False):
+        monkeypatch.setattr(config, "FAST_PATH", fast_path)
+        response = client.post("/api/calculate-price", json=body, headers=auth_headers)
+        assert response.status_code == 200
+        prices.append(response.json()["individual_prices"])
+    assert prices[0] == prices[1]
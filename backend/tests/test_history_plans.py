@@ -0,0 +1,59 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, insert
+
+from app.database import engine, read_engine
+from app.history import (
+    FULL_SORT_CASES, INDEX_ONLY_CASES, check_plans, full_sorts, plan_problems, table_reads,
+    table_scans,
+)
+from app.migrations import upgrade_schema
+from app.models import DiamondPriceDB
+from app.utils import DEFAULT_MULTIPLIERS, PRICING_AXES
+
+def seed(rows: int) -> None:
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with engine.begin() as connection:
+        connection.execute(delete(DiamondPriceDB))
+        connection.execute(insert(DiamondPriceDB), [
+            {
+                **{axis: rng.choice(list(DEFAULT_MULTIPLIERS[axis])) for axis in PRICING_AXES},
+                "carat": round(rng.uniform(0.2, 3.0), 2),
+                "price": round(rng.uniform(1000, 200000), 2),
+                "calculated_by": f"staff{i % 20}",
+                "branch": "KL",
+                "timestamp": now - timedelta(minutes=i),
+            }
+            for i in range(rows)
+        ])
+
+@pytest.fixture(scope="module", params=["empty", "analyzed"])
+def plans(request):
+    upgrade_schema(engine)
+    if request.param == "analyzed":
+        seed(5000)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE diamond_prices")
+    with read_engine.connect() as connection:
+        yield check_plans(connection)
+
+def test_searches_never_scan_the_table(plans):
+    for name, plan in plans.items():
+        assert table_scans(plan) == [], name
+
+def test_time_and_staff_searches_stay_in_the_index(plans):
+    for name in INDEX_ONLY_CASES:
+        assert table_reads(plans[name]) == [], name
+        assert table_reads(plans[f"{name}_next_page"]) == [], name
+
+def test_searches_plan_as_intended(plans):
+    for name, plan in plans.items():
+        assert plan_problems(name, plan) == [], name
+
+def test_full_sorts_are_detected(plans):
+    # Keeps the sort check honest: the documented full-sort cases do sort
+    for name in FULL_SORT_CASES:
+        assert full_sorts(plans[name]), name
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.fastpath import Stone
+from app.models import Diamond
+from app.utils import (
+    PRICING_AXES, build_pricing_snapshot, calculate_diamond_prices, current_pricing,
+    quote_price, round_cents,
+)
+
+def random_parcel(snapshot, count: int, seed: int):
+    rng = random.Random(seed)
+    return [
+        Stone(
+            round(rng.uniform(0.01, 10), 2),
+            *(rng.choice(list(snapshot.codes[axis])) for axis in PRICING_AXES),
+            1,
+        )
+        for _ in range(count)
+    ]
+
+@pytest.mark.parametrize("snapshot", [
+    current_pricing(),
+    # Awkward multipliers, so more products land near a half cent
+    build_pricing_snapshot(2, 1234.5, {
+        "clarity": {"FL": 1.15, "VS1": 0.35},
+        "color": {"D": 1.05, "G": 0.95},
+        "cut": {"Excellent": 1.005, "Good": 0.85},
+        "certification": {"GIA": 1.1, "None": 1.0},
+    }),
+])
+def test_batch_prices_match_quote_price(snapshot):
+    stones = random_parcel(snapshot, 20000, seed=snapshot.version)
+    expected = [quote_price(snapshot, stone[1:5], stone.carat) for stone in stones]
+    assert calculate_diamond_prices(stones, snapshot) == expected
+
+def test_batch_prices_accept_diamond_models():
+    snapshot = current_pricing()
+    stones = random_parcel(snapshot, 100, seed=3)
+    diamonds = [Diamond(**stone._asdict()) for stone in stones]
+    assert calculate_diamond_prices(diamonds, snapshot) == calculate_diamond_prices(stones, snapshot)
+
+def test_round_cents_matches_round():
+    rng = np.random.default_rng(11)
+    cents = rng.integers(0, 10**9, 200000)
+    prices = np.concatenate([
+        rng.uniform(0, 1e6, 200000),
+        # Exact and nearly exact half cents
+        (cents + 0.5) / 100,
+        np.nextafter((cents + 0.5) / 100, 0),
+        np.nextafter((cents + 0.5) / 100, np.inf),
+    ])
+    assert round_cents(prices).tolist() == [round(price, 2) for price in prices.tolist()]
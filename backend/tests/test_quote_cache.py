@@ -0,0 +1,56 @@
+import time
+
+from sqlalchemy import select
+
+from app import utils
+from app.database import SessionLocal
+from app.fastpath import Stone
+from app.models import Diamond, RequoteDB
+from app.quote_cache import quote_cache, quote_key
+from app.utils import (
+    DEFAULT_MULTIPLIERS, PRICING_AXES, build_pricing_snapshot, current_pricing, quote_price,
+)
+
+STONE = {"carat": 1.25, "clarity": "VVS2", "color": "E", "cut": "Good", "certification": "HRD"}
+
+def test_key_covers_prices_only():
+    version = current_pricing().matrix_version
+    stone = Stone(1.0, "VS1", "G", "Excellent", "GIA", 1)
+    key = quote_key([stone, stone._replace(carat=2.0)], version)
+    assert quote_key([stone._replace(carat=1), stone._replace(carat=2.0, quantity=5)], version) == key
+    assert quote_key([stone._replace(carat=2.0), stone], version) != key
+    assert quote_key([stone, stone._replace(carat=2.0, cut="Good")], version) != key
+    assert quote_key([stone, stone._replace(carat=2.0)], "another table") != key
+
+def requotes(key: str):
+    with SessionLocal() as db:
+        return db.scalars(select(RequoteDB).where(RequoteDB.quote_key == key)).all()
+
+def test_repeat_is_served_from_cache_and_audited(client, auth_headers):
+    body = {"diamonds": [STONE, dict(STONE, carat=0.5)]}
+    first = client.post("/api/calculate-price", json=body, headers=auth_headers).json()
+    hits = quote_cache.hits
+    second = client.post("/api/calculate-price", json=body, headers=auth_headers).json()
+    assert quote_cache.hits == hits + 1
+    assert second["individual_prices"] == first["individual_prices"]
+
+    key = quote_key([Diamond(**stone) for stone in body["diamonds"]], current_pricing().matrix_version)
+    deadline = time.monotonic() + 5
+    while not requotes(key) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    [requote] = requotes(key)
+    assert requote.stone_count == 2 and requote.total_price == first["total_price"]
+    assert requote.pricing_version == current_pricing().version
+
+def test_new_pricing_table_misses_the_cache(client, auth_headers, monkeypatch):
+    body = {"diamonds": [STONE]}
+    before = client.post("/api/calculate-price", json=body, headers=auth_headers).json()
+    multipliers = dict(DEFAULT_MULTIPLIERS, cut=dict(DEFAULT_MULTIPLIERS["cut"], Good=1.2))
+    snapshot = build_pricing_snapshot(99, utils.BASE_PRICE, multipliers)
+    monkeypatch.setattr(utils, "_current_pricing", snapshot)
+
+    hits = quote_cache.hits
+    after = client.post("/api/calculate-price", json=body, headers=auth_headers).json()
+    assert quote_cache.hits == hits
+    grades = tuple(STONE[axis] for axis in PRICING_AXES)
+    assert after["total_price"] == quote_price(snapshot, grades, STONE["carat"]) != before["total_price"]
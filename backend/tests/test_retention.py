@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from app import config, retention
+from app.retention import append_archive, archive_file, iter_archive, iter_members
+
+MONTH = "2024-01"
+
+def rows(first: int, count: int):
+    return [{"id": i, "timestamp": f"{MONTH}-15 10:00:00"} for i in range(first, first + count)]
+
+def member(batch) -> bytes:
+    return gzip.compress("".join(json.dumps(row) + "\n" for row in batch).encode())
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_PATH", str(tmp_path))
+    monkeypatch.setattr(retention, "_archive_ends", {})
+
+def crash_mid_append(path: str, batch) -> None:
+    """Leave the first half of a member at the end of the file, as a crash would."""
+    data = member(batch)
+    with open(path, "ab") as f:
+        f.write(data[:len(data) // 2])
+
+def test_append_after_interrupted_append_stays_readable():
+    append_archive("login_logs", MONTH, rows(1, 3))
+    path = archive_file("login_logs", MONTH)
+    crash_mid_append(path, rows(4, 200))
+    retention._archive_ends.clear()  # A new process after the crash
+
+    append_archive("login_logs", MONTH, rows(4, 200))
+    assert list(iter_members(path)) == [rows(1, 3), rows(4, 200)]
+    with gzip.open(path, "rt") as f:  # The torn member was cut off
+        assert len(f.read().splitlines()) == 203
+
+def test_reader_resyncs_after_a_torn_member():
+    path = archive_file("requotes", MONTH)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(member(rows(1, 3)))
+    crash_mid_append(path, rows(4, 200))
+    with open(path, "ab") as f:  # Appended without the truncation
+        f.write(member(rows(4, 200)))
+    assert list(iter_members(path)) == [rows(1, 3), rows(4, 200)]
+
+def test_torn_member_at_end_is_skipped():
+    append_archive("requotes", MONTH, rows(1, 3))
+    path = archive_file("requotes", MONTH)
+    crash_mid_append(path, rows(4, 200))
+    assert list(iter_members(path)) == [rows(1, 3)]
+
+def test_rows_repeated_by_an_uncommitted_batch_are_read_once():
+    # The delete of batch 1-3 never committed, so the next batch repeats it
+    append_archive("diamond_prices", MONTH, rows(1, 3))
+    append_archive("diamond_prices", MONTH, rows(1, 5))
+    append_archive("diamond_prices", MONTH, rows(6, 2))
+    ids = [row.id for chunk in iter_archive("diamond_prices", MONTH) for row in chunk]
+    assert ids == list(range(1, 8))
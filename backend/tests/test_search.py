@@ -0,0 +1,30 @@
+import itertools
+import random
+
+from app.search import search_prices
+from app.utils import PRICING_AXES, current_pricing, quote_price
+
+def all_grades(snapshot):
+    return list(itertools.product(*(snapshot.codes[axis] for axis in PRICING_AXES)))
+
+def test_matches_are_decided_on_the_quoted_price():
+    snapshot = current_pricing()
+    combos = all_grades(snapshot)
+    rng = random.Random(5)
+    for _ in range(100):
+        carat_min = round(rng.uniform(0.1, 3), 2)
+        carat_max = round(carat_min + rng.uniform(0, 2), 2)
+        # A budget exactly at some quote is the boundary case
+        budget = quote_price(snapshot, rng.choice(combos), carat_min)
+        expected = sum(quote_price(snapshot, grades, carat_min) <= budget for grades in combos)
+
+        found = search_prices(snapshot, budget, carat_min, carat_max, limit=len(combos))
+        assert found["total_matches"] == expected
+        for result in found["results"]:
+            grades = tuple(result[axis] for axis in PRICING_AXES)
+            assert result["min_carat_price"] == quote_price(snapshot, grades, carat_min) <= budget
+            max_carat = result["max_carat"]
+            assert carat_min <= max_carat <= carat_max
+            assert result["max_carat_price"] == quote_price(snapshot, grades, max_carat) <= budget
+            if max_carat < carat_max:
+                assert quote_price(snapshot, grades, round(max_carat + 0.01, 2)) > budget
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+from app.writer import WriteBehindQueue
+
+class Recorder:
+    """write_rows stand-in that records batches and can fail the first few."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches = []
+        self.threads = []
+
+    def __call__(self, db, rows):
+        self.threads.append(threading.current_thread())
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.batches.append(list(rows))
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+def make_queue(write_rows, **kwargs):
+    options = dict(maxsize=100, batch_size=10, flush_interval=0.01)
+    options.update(kwargs)
+    return WriteBehindQueue("test", write_rows, **options)
+
+def test_stop_flushes_queued_rows_in_batches():
+    recorder = Recorder()
+    queue = make_queue(recorder, flush_interval=60)
+    queue.start()
+    for i in range(25):
+        queue.put([{"n": i}])
+    queue.stop()
+    assert recorder.rows == [{"n": i} for i in range(25)]
+    assert all(len(batch) <= 10 for batch in recorder.batches)
+    assert queue.depth == 0 and queue.flushed_rows == 25
+
+def test_overflow_from_submit_is_written_off_the_event_loop():
+    recorder = Recorder()
+    queue = make_queue(recorder, maxsize=5, flush_interval=60)
+    queue.start()
+
+    async def produce():
+        await queue.submit([{"n": 0}] * 5)
+        await queue.submit([{"n": 1}] * 5)  # Doesn't fit; written inline
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(produce())
+    assert queue.overflow_writes == 1
+    assert recorder.batches == [[{"n": 1}] * 5]
+    assert recorder.threads[0] is not loop_thread
+    queue.stop()
+    assert len(recorder.rows) == 10
+
+def test_failed_batch_is_retried():
+    recorder = Recorder(failures=1)
+    queue = make_queue(recorder)
+    queue.start()
+    queue.put([{"n": i} for i in range(3)])
+    queue.stop()
+    assert recorder.rows == [{"n": i} for i in range(3)]
+    assert queue.retried_rows == 3 and queue.dropped_rows == 0
+
+def test_batch_is_dropped_only_after_max_attempts():
+    recorder = Recorder(failures=10)
+    queue = make_queue(recorder, max_attempts=3)
+    queue.start()
+    queue.put([{"n": 0}, {"n": 1}])
+    queue.stop()
+    assert recorder.rows == []
+    assert len(recorder.threads) == 3
+    assert queue.dropped_rows == 2 and queue.depth == 0
+
+def test_group_mode_waits_for_commit_and_raises_failures():
+    recorder = Recorder(failures=1)
+    queue = make_queue(recorder, durability="group")
+    queue.start()
+
+    async def produce(rows):
+        try:
+            await queue.submit(rows)
+        except RuntimeError:
+            return "failed"
+        return recorder.rows[:]
+
+    try:
+        assert asyncio.run(produce([{"n": 0}])) == "failed"
+        assert asyncio.run(produce([{"n": 1}])) == [{"n": 1}]
+    finally:
+        queue.stop()